@@ -2,18 +2,225 @@ import os
 import json
 import toml
 from pathlib import Path
-from typing import Dict, Any, List
-from ratchets.results import MatchResult, TestResult
+from typing import Dict, Any, List, Optional, Tuple
+from ratchets.results import FileCounts, MatchResult, TestResult
+from ratchets.daemon import query_results
+from ratchets.discovery import IgnoreRules
 
 from .run_tests import (
+    TEST_FILENAME,
+    count_matches,
+    count_since,
+    empty_results,
+    evaluate_at_merge_base,
+    evaluate_files,
     evaluate_regex_tests,
     evaluate_shell_tests,
-    filter_excluded_files,
+    get_ignore_rules,
     find_project_root,
+    get_changed_python_files,
     get_python_files,
     get_ratchet_path,
+    get_result_cache,
+    get_settings,
+    project_counts,
+    results_to_json,
+    total_counts,
 )
 
+# git ref used by the checks when no 'since' argument is given.
+SINCE_ENVIRONMENT_VARIABLE = "RATCHETS_SINCE"
+
+
+class RatchetSession:
+    """
+    Shared state for every ratchet check in a test session. Configuration,
+    file discovery and baseline counts are loaded once, and all configured
+    rules are evaluated together the first time any result is needed, so
+    each per-rule check only looks up its result. When a 'ratchets serve'
+    daemon runs for the root, the results are taken from it instead.
+    """
+
+    use_daemon = True
+
+    def __init__(self, root: str):
+        self.root = root
+        self._config: Optional[Dict[str, Any]] = None
+        self._files: Optional[List[Path]] = None
+        self._baseline: Optional[Dict[str, int]] = None
+        self._results: Optional[Tuple[Dict[str, TestResult], Dict[str, TestResult]]]
+        self._results = None
+        self._counts: Optional[Dict[str, int]] = None
+        self._projected: Dict[str, Dict[str, int]] = {}
+
+    @property
+    def config(self) -> Dict[str, Any]:
+        """The tests.toml configuration, or an empty dict if it can't be loaded."""
+        if self._config is None:
+            try:
+                self._config = toml.load(Path(self.root) / "tests.toml")
+            except Exception:
+                self._config = {}
+        return self._config
+
+    @property
+    def regex_tests(self) -> Dict[str, Any]:
+        return self.config.get("ratchet", {}).get("regex") or {}
+
+    @property
+    def shell_tests(self) -> Dict[str, Any]:
+        return self.config.get("ratchet", {}).get("shell") or {}
+
+    @property
+    def files(self) -> List[Path]:
+        """Python files under the root that are not excluded."""
+        if self._files is None:
+            try:
+                rules: Optional[IgnoreRules] = get_ignore_rules(self.root)
+            except Exception:
+                rules = None
+            self._files = get_python_files(self.root, None, rules)
+        return self._files
+
+    @property
+    def baseline(self) -> Dict[str, int]:
+        if self._baseline is None:
+            self._baseline = load_baseline_counts()
+        return self._baseline
+
+    def results(self) -> Tuple[Dict[str, TestResult], Dict[str, TestResult]]:
+        """Evaluate every configured rule in one pass over the files, once."""
+        if self._results is None and self.use_daemon:
+            self._results = query_results(self.root)
+        if self._results is None:
+            regex_tests = self.regex_tests or None
+            shell_tests = self.shell_tests or None
+            if not self.files or not (regex_tests or shell_tests):
+                self._results = empty_results(regex_tests, shell_tests)
+            else:
+                self._results = self.evaluate(self.files, regex_tests, shell_tests)
+        return self._results
+
+    def evaluate(
+        self,
+        files: List[Path],
+        regex_tests: Optional[Dict[str, Any]],
+        shell_tests: Optional[Dict[str, Any]],
+    ) -> Tuple[Dict[str, TestResult], Dict[str, TestResult]]:
+        """Evaluate the configured rules on 'files', honouring the settings."""
+        settings = get_settings(self.config)
+        return evaluate_files(
+            files,
+            regex_tests,
+            shell_tests,
+            settings.get("jobs"),
+            get_result_cache(self.root, settings, None),
+        )
+
+    def counts(self) -> Dict[str, int]:
+        """
+        Return the match count of every configured rule. Unless the matches
+        were already evaluated or come from a daemon, they are counted
+        without building them.
+        """
+        if self._counts is None:
+            if self._results is None and self.use_daemon:
+                self._results = query_results(self.root)
+            if self._results is not None:
+                self._counts = results_to_json(self._results)
+            else:
+                regex_tests = self.regex_tests or None
+                shell_tests = self.shell_tests or None
+                counted: FileCounts = {}
+                if self.files and (regex_tests or shell_tests):
+                    counted = self.count(self.files, regex_tests, shell_tests)
+                self._counts = total_counts(counted)
+        return self._counts
+
+    def count(
+        self,
+        files: List[Path],
+        regex_tests: Optional[Dict[str, Any]],
+        shell_tests: Optional[Dict[str, Any]],
+    ) -> FileCounts:
+        """Count the matches of the configured rules in 'files' per file."""
+        settings = get_settings(self.config)
+        return count_matches(
+            files,
+            regex_tests,
+            shell_tests,
+            settings.get("jobs"),
+            get_result_cache(self.root, settings, None),
+        )
+
+    def projected_counts(self, since: str) -> Dict[str, int]:
+        """
+        Return the counts a full run would give for every configured rule,
+        counting only the files changed since 'since' now and at the merge
+        base, once per ref.
+        """
+        if since not in self._projected:
+            self._projected[since] = count_since(
+                os.path.join(self.root, TEST_FILENAME),
+                False,
+                False,
+                since,
+                baseline=self.baseline,
+            )
+        return self._projected[since]
+
+    def regex_count(self, test_name: str, rule: Dict[str, Any]) -> int:
+        """Return the match count of a regex rule, sharing the session's counts."""
+        if self.regex_tests.get(test_name) == rule:
+            return self.counts().get(test_name, 0)
+        return len(self.regex_matches(test_name, rule))
+
+    def shell_count(self, test_name: str, rule: Dict[str, Any]) -> int:
+        """Return the match count of a shell rule, sharing the session's counts."""
+        if self.shell_tests.get(test_name) == rule:
+            return self.counts().get(test_name, 0)
+        return len(self.shell_matches(test_name, rule))
+
+    def regex_matches(self, test_name: str, rule: Dict[str, Any]) -> List[MatchResult]:
+        """Return the matches of a regex rule, sharing the session's evaluation."""
+        if self.regex_tests.get(test_name) == rule:
+            tr = self.results()[0].get(test_name)
+        else:
+            tr = evaluate_regex_tests(self.files, {test_name: rule}).get(test_name)
+        return tr.matches if tr is not None else []
+
+    def shell_matches(self, test_name: str, rule: Dict[str, Any]) -> List[MatchResult]:
+        """Return the matches of a shell rule, sharing the session's evaluation."""
+        if self.shell_tests.get(test_name) == rule:
+            tr = self.results()[1].get(test_name)
+        else:
+            tr = evaluate_shell_tests(self.files, {test_name: rule}).get(test_name)
+        return tr.matches if tr is not None else []
+
+
+# one session per project root, so tests that change directories stay isolated.
+_SESSIONS: Dict[str, RatchetSession] = {}
+
+
+def get_session() -> RatchetSession:
+    """Return the shared session for the current project root."""
+    root = find_project_root()
+    session = _SESSIONS.get(root)
+    if session is None:
+        session = RatchetSession(root)
+        _SESSIONS[root] = session
+    return session
+
+
+def set_session(session: RatchetSession) -> None:
+    """Use 'session' for every check run under its project root."""
+    _SESSIONS[session.root] = session
+
+
+def reset_session() -> None:
+    """Forget all shared state so the next check reloads and re-evaluates."""
+    _SESSIONS.clear()
+
 
 def get_root() -> str:
     """Return the project root directory."""
@@ -22,12 +229,7 @@ def get_root() -> str:
 
 def get_config() -> Dict[str, Any]:
     """Load and return the tests.toml configuration."""
-    root = get_root()
-    toml_path = Path(root) / "tests.toml"
-    try:
-        return toml.load(toml_path)
-    except Exception:
-        return {}
+    return get_session().config
 
 
 def get_regex_tests() -> Dict[str, Any]:
@@ -45,7 +247,7 @@ def get_shell_tests() -> Dict[str, Any]:
 
 
 def load_baseline_counts() -> Dict[str, int]:
-    """Load baseline counts from ratchet path, returning a dict of test names and counts."""
+    """Load baseline counts from the ratchet path as a dict of test names and counts."""
     try:
         ratchet_path: str = get_ratchet_path()
         if os.path.isfile(ratchet_path):
@@ -59,48 +261,78 @@ def load_baseline_counts() -> Dict[str, int]:
 
 
 def get_baseline_counts() -> Dict[str, int]:
-    """Return baseline counts"""
-    return load_baseline_counts()
+    """Return baseline counts, loaded once per session."""
+    return dict(get_session().baseline)
 
 
 def get_filtered_files() -> List[Path]:
     """Retrieve all Python files under the project, filtering excluded paths."""
-    root = get_root()
-    files: List[Path] = get_python_files(root, None)
-    excluded_path: str = os.path.join(root, "ratchet_excluded.txt")
-    ignore_path: str = os.path.join(root, ".gitignore")
-
-    try:
-        return filter_excluded_files(files, excluded_path, ignore_path)
-    except Exception:
-        return files
+    return list(get_session().files)
 
 
 def get_python_test_matches(test_name: str, rule: Dict[str, Any]) -> List[MatchResult]:
-    """Run a regex test for a single rule and return MatchResult objects."""
-    files = get_filtered_files()  # expected to return List[Path] or similar
-    results: Dict[str, TestResult] = evaluate_regex_tests(files, {test_name: rule})
-    tr = results.get(test_name)
-    return tr.matches if tr is not None else []
+    """Return MatchResult objects for a single regex rule from the shared session."""
+    return get_session().regex_matches(test_name, rule)
 
 
 def get_shell_test_matches(
     test_name: str, test_dict: Dict[str, Any]
 ) -> List[MatchResult]:
-    """Run a shell test for a single rule and return MatchResult objects."""
-    files = get_filtered_files()
-    results: Dict[str, TestResult] = evaluate_shell_tests(files, {test_name: test_dict})
-    tr = results.get(test_name)
-    return tr.matches if tr is not None else []
+    """Return MatchResult objects for a single shell rule from the shared session."""
+    return get_session().shell_matches(test_name, test_dict)
+
+
+def get_since(since: Optional[str] = None) -> Optional[str]:
+    """Return the git ref to compare against, defaulting to $RATCHETS_SINCE."""
+    if since:
+        return since
+    return os.environ.get(SINCE_ENVIRONMENT_VARIABLE) or None
 
 
-def check_regex_rule(test_name: str, rule: Dict[str, Any]) -> None:
-    """Check if a single regex rule has been violated by increasing infraction count."""
+def get_projected_count(
+    test_name: str,
+    regex_tests: Optional[Dict[str, Any]],
+    shell_tests: Optional[Dict[str, Any]],
+    since: str,
+) -> int:
+    """
+    Return the count a full run would give for a test, evaluating only
+    the files changed since 'since' now and at the merge base. Configured
+    tests share the session's projected counts.
+    """
+    session = get_session()
+    configured = dict(session.regex_tests, **session.shell_tests)
+    rule = dict(regex_tests or {}, **(shell_tests or {})).get(test_name)
+    if rule is not None and configured.get(test_name) == rule:
+        return session.projected_counts(since).get(test_name, 0)
+
+    root = get_root()
+    files = get_changed_python_files(root, since)
+    current = empty_results(regex_tests, shell_tests)
+    if files:
+        current = evaluate_files(files, regex_tests, shell_tests)
+    base = evaluate_at_merge_base(root, since, regex_tests, shell_tests)
+    projected = project_counts(
+        results_to_json(current), results_to_json(base), get_baseline_counts()
+    )
+    return projected.get(test_name, 0)
+
+
+def check_regex_rule(
+    test_name: str, rule: Dict[str, Any], since: Optional[str] = None
+) -> None:
+    """
+    Check if a single regex rule has been violated by increasing infraction count.
+    If 'since' or $RATCHETS_SINCE is a git ref, only changed files are evaluated.
+    """
     assert test_name is not None
     assert rule is not None
 
-    matches = get_python_test_matches(test_name, rule)
-    current_count = len(matches)
+    since = get_since(since)
+    if since is None:
+        current_count = get_session().regex_count(test_name, rule)
+    else:
+        current_count = get_projected_count(test_name, {test_name: rule}, None, since)
     baseline_counts = get_baseline_counts()
     baseline_count = baseline_counts.get(test_name, 0)
     if current_count > baseline_count:
@@ -115,13 +347,23 @@ def check_regex_rule(test_name: str, rule: Dict[str, Any]) -> None:
         )
 
 
-def check_shell_rule(test_name: str, test_dict: Dict[str, Any]) -> None:
-    """Check if a single shell rule has been violated by increasing infraction count."""
+def check_shell_rule(
+    test_name: str, test_dict: Dict[str, Any], since: Optional[str] = None
+) -> None:
+    """
+    Check if a single shell rule has been violated by increasing infraction count.
+    If 'since' or $RATCHETS_SINCE is a git ref, only changed files are evaluated.
+    """
     assert test_name is not None
     assert test_dict is not None
 
-    matches = get_shell_test_matches(test_name, test_dict)
-    current_count = len(matches)
+    since = get_since(since)
+    if since is None:
+        current_count = get_session().shell_count(test_name, test_dict)
+    else:
+        current_count = get_projected_count(
+            test_name, None, {test_name: test_dict}, since
+        )
     baseline_counts = get_baseline_counts()
     baseline_count = baseline_counts.get(test_name, 0)
     if current_count > baseline_count:
@@ -0,0 +1,440 @@
+"""
+Benchmarks for ratchets on generated repositories.
+
+    python -m ratchets.bench --output results.json
+    python -m ratchets.bench --compare results.json --threshold 0.1
+
+A synthetic repository with a local git history is generated from a seed,
+so runs with the same options measure the same work. Each benchmark is
+timed '--repeat' times after its own setup, and the results are written
+as JSON. With '--compare', the medians are compared against a saved
+result and the exit status is 1 if any benchmark regressed by more than
+the threshold.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import statistics
+import subprocess
+import tempfile
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from ratchets.blame import build_blame_index
+from ratchets.caching import CachingDatabase, ResultCache
+from ratchets.discovery import walk_python_files
+from ratchets.results import Results
+from ratchets.run_tests import (
+    MAX_THREADS,
+    count_matches,
+    enrich_with_blames,
+    evaluate_files,
+    get_ignore_rules,
+    get_python_files,
+    load_tests,
+)
+
+DEFAULT_THRESHOLD = 0.1
+# directories listed in the generated .gitignore, holding the ignored files.
+IGNORED_DIRS = [".venv", "node_modules", "build"]
+# authors of the generated commits, so blames differ between lines.
+AUTHORS = ["Ada", "Grace", "Linus"]
+START_TIME = 1704067200  # 2024-01-01T00:00:00Z
+DAY = 86400
+
+BENCH_TOML = """
+[ratchet.regex.prints]
+regex = "print\\\\("
+
+[ratchet.regex.trailing_whitespace]
+regex = "[ \\\\t]+$"
+
+[ratchet.regex.markers]
+regex = "#.*\\\\bXXX\\\\b"
+
+[ratchet.shell.line_too_long]
+argv = ["awk", "length($0) > 88 { print FILENAME \\":\\" $0 }", "{files}"]
+batch = true
+"""
+
+
+@dataclass
+class RepoSpec:
+    """Shape of a generated repository."""
+
+    files: int = 300
+    lines: int = 150
+    # fraction of lines that break one of the rules.
+    density: float = 0.02
+    # .py files placed in ignored directories, which discovery should skip.
+    ignored_files: int = 300
+    commits: int = 5
+    seed: int = 0
+
+
+def make_line(rng: random.Random, idx: int, density: float) -> str:
+    """Return one line of generated code, breaking a rule with 'density' odds."""
+    if rng.random() < density:
+        kind = rng.randrange(4)
+        if kind == 0:
+            return f"    print(value_{idx})"
+        if kind == 1:
+            return f"value_{idx} = {rng.randrange(1000)}   "
+        if kind == 2:
+            return f"# XXX revisit {idx}"
+        return f"value_{idx} = " + " + ".join(str(n) for n in range(40))
+    kind = rng.randrange(3)
+    if kind == 0:
+        return f"value_{idx} = {rng.randrange(1000)}"
+    if kind == 1:
+        return f"def func_{idx}(x):\n    return x * {rng.randrange(10)}"
+    return f"# note {idx}"
+
+
+def make_file(rng: random.Random, spec: RepoSpec) -> List[str]:
+    return [make_line(rng, idx, spec.density) for idx in range(spec.lines)]
+
+
+def file_path(idx: int) -> str:
+    return f"pkg{idx % 10}/sub{idx % 7}/module_{idx}.py"
+
+
+def write_lines(path: Path, lines: List[str]) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text("\n".join(lines) + "\n")
+
+
+def commit(root: Path, number: int, message: str) -> None:
+    """Commit everything as one of the authors, at a fixed time."""
+    author = AUTHORS[number % len(AUTHORS)]
+    date = f"@{START_TIME + number * DAY} +0000"
+    env = dict(
+        os.environ,
+        GIT_AUTHOR_NAME=author,
+        GIT_AUTHOR_EMAIL=f"{author.lower()}@example.com",
+        GIT_AUTHOR_DATE=date,
+        GIT_COMMITTER_NAME=author,
+        GIT_COMMITTER_EMAIL=f"{author.lower()}@example.com",
+        GIT_COMMITTER_DATE=date,
+    )
+    for args in (["add", "-A"], ["commit", "-q", "--no-gpg-sign", "-m", message]):
+        subprocess.run(
+            ["git"] + args, cwd=root, env=env, check=True, capture_output=True
+        )
+
+
+def generate_repo(root: Path, spec: RepoSpec) -> None:
+    """
+    Write a repository with 'spec.files' modules and a git history of
+    'spec.commits' commits, each rewriting lines in a fifth of the files.
+    """
+    rng = random.Random(spec.seed)
+    root.mkdir(parents=True, exist_ok=True)
+    (root / "tests.toml").write_text(BENCH_TOML)
+    (root / ".gitignore").write_text("".join(f"{d}/\n" for d in IGNORED_DIRS))
+
+    contents = {file_path(idx): make_file(rng, spec) for idx in range(spec.files)}
+    for rel, lines in contents.items():
+        write_lines(root / rel, lines)
+    for idx in range(spec.ignored_files):
+        ignored = IGNORED_DIRS[idx % len(IGNORED_DIRS)]
+        path = root / ignored / f"lib{idx % 5}" / f"dep_{idx}.py"
+        write_lines(path, make_file(rng, spec))
+
+    subprocess.run(["git", "init", "-q"], cwd=root, check=True)
+    commit(root, 0, "initial")
+    for number in range(1, spec.commits):
+        for rel in rng.sample(sorted(contents), max(1, spec.files // 5)):
+            lines = contents[rel]
+            for _ in range(max(1, spec.lines // 10)):
+                idx = rng.randrange(len(lines))
+                lines[idx] = make_line(rng, idx, spec.density)
+            write_lines(root / rel, lines)
+        commit(root, number, f"change {number}")
+
+
+@dataclass
+class BenchContext:
+    root: str
+    scratch: str
+    regex_tests: Dict[str, Dict[str, Any]]
+    shell_tests: Dict[str, Dict[str, Any]]
+    files: List[Path]
+
+    def scratch_path(self, name: str) -> str:
+        """Return a path for a database that no earlier run has used."""
+        # a fresh directory is created atomically, unlike a bare file name
+        return os.path.join(tempfile.mkdtemp(prefix=name, dir=self.scratch), "db")
+
+
+# a benchmark prepares its state and returns the function to time.
+Benchmark = Callable[[BenchContext], Callable[[], Any]]
+
+
+def bench_discovery_git(ctx: BenchContext) -> Callable[[], Any]:
+    return lambda: get_python_files(ctx.root, None, get_ignore_rules(ctx.root))
+
+
+def bench_discovery_walk(ctx: BenchContext) -> Callable[[], Any]:
+    return lambda: walk_python_files(ctx.root, get_ignore_rules(ctx.root))
+
+
+def bench_regex_scan(ctx: BenchContext) -> Callable[[], Any]:
+    return lambda: evaluate_files(ctx.files, ctx.regex_tests, None)
+
+
+def bench_regex_count(ctx: BenchContext) -> Callable[[], Any]:
+    return lambda: count_matches(ctx.files, ctx.regex_tests, None)
+
+
+def bench_shell(ctx: BenchContext) -> Callable[[], Any]:
+    return lambda: evaluate_files(ctx.files, None, ctx.shell_tests)
+
+
+def run_cached(ctx: BenchContext, cache: ResultCache) -> Results:
+    return evaluate_files(ctx.files, ctx.regex_tests, ctx.shell_tests, None, cache)
+
+
+def bench_cache_miss(ctx: BenchContext) -> Callable[[], Any]:
+    cache = ResultCache(ctx.scratch_path("results"))
+    return lambda: run_cached(ctx, cache)
+
+
+def bench_cache_hit(ctx: BenchContext) -> Callable[[], Any]:
+    cache = ResultCache(ctx.scratch_path("results"))
+    run_cached(ctx, cache)
+    return lambda: run_cached(ctx, cache)
+
+
+def blame_matches(ctx: BenchContext, db_path: str) -> None:
+    regex_results = evaluate_files(ctx.files, ctx.regex_tests, None)[0]
+    with CachingDatabase(db_path) as db:
+        enrich_with_blames(regex_results, {}, db, ctx.root)
+
+
+def bench_blame_cold(ctx: BenchContext) -> Callable[[], Any]:
+    db_path = ctx.scratch_path("blame")
+    return lambda: blame_matches(ctx, db_path)
+
+
+def bench_blame_warm(ctx: BenchContext) -> Callable[[], Any]:
+    db_path = ctx.scratch_path("blame")
+    blame_matches(ctx, db_path)
+    return lambda: blame_matches(ctx, db_path)
+
+
+def bench_blame_index(ctx: BenchContext) -> Callable[[], Any]:
+    db_path = ctx.scratch_path("blame")
+
+    def run() -> None:
+        with CachingDatabase(db_path) as db:
+            build_blame_index(ctx.root, db, workers=MAX_THREADS)
+
+    return run
+
+
+BENCHMARKS: Dict[str, Benchmark] = {
+    "discovery_git": bench_discovery_git,
+    "discovery_walk": bench_discovery_walk,
+    "regex_scan": bench_regex_scan,
+    "regex_count": bench_regex_count,
+    "shell": bench_shell,
+    "cache_miss": bench_cache_miss,
+    "cache_hit": bench_cache_hit,
+    "blame_cold": bench_blame_cold,
+    "blame_warm": bench_blame_warm,
+    "blame_index": bench_blame_index,
+}
+
+
+def time_benchmark(bench: Benchmark, ctx: BenchContext, repeat: int) -> List[float]:
+    """Set up and time a benchmark 'repeat' times, returning seconds per run."""
+    runs = []
+    for _ in range(repeat):
+        run = bench(ctx)
+        start = time.perf_counter()
+        run()
+        runs.append(time.perf_counter() - start)
+    return runs
+
+
+def environment() -> Dict[str, Any]:
+    try:
+        git = subprocess.run(
+            ["git", "--version"], capture_output=True, text=True
+        ).stdout.strip()
+    except OSError:
+        git = None
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "git": git,
+    }
+
+
+def run_benchmarks(
+    root: str, spec: RepoSpec, names: List[str], repeat: int
+) -> Dict[str, Any]:
+    """Run the named benchmarks on the repository at 'root'."""
+    regex_tests, shell_tests, _ = load_tests(
+        os.path.join(root, "tests.toml"), False, False
+    )
+    with tempfile.TemporaryDirectory() as scratch:
+        ctx = BenchContext(
+            root=root,
+            scratch=scratch,
+            regex_tests=regex_tests or {},
+            shell_tests=shell_tests or {},
+            files=get_python_files(root, None, get_ignore_rules(root)),
+        )
+        results: Dict[str, Any] = {}
+        for name in names:
+            runs = time_benchmark(BENCHMARKS[name], ctx, repeat)
+            results[name] = {
+                "median": statistics.median(runs),
+                "min": min(runs),
+                "runs": runs,
+            }
+    return {
+        "spec": asdict(spec),
+        "repeat": repeat,
+        "environment": environment(),
+        "results": results,
+    }
+
+
+def compare_results(
+    baseline: Dict[str, Any], current: Dict[str, Any], threshold: float
+) -> List[Tuple[str, float, float, float, bool]]:
+    """
+    Compare the medians of benchmarks present in both results, returning
+    (name, baseline, current, ratio, regressed) for each.
+    """
+    rows = []
+    for name, result in current["results"].items():
+        base = baseline["results"].get(name)
+        if base is None:
+            continue
+        ratio = result["median"] / base["median"] if base["median"] else 1.0
+        regressed = ratio > 1 + threshold
+        rows.append((name, base["median"], result["median"], ratio, regressed))
+    return rows
+
+
+def print_results(results: Dict[str, Any]) -> None:
+    for name, result in results["results"].items():
+        median, fastest = result["median"], result["min"]
+        print(f"{name:<16} median {median:.4f}s  min {fastest:.4f}s")
+
+
+def print_comparison(rows: List[Tuple[str, float, float, float, bool]]) -> None:
+    for name, base, current, ratio, regressed in rows:
+        flag = "  REGRESSION" if regressed else ""
+        print(f"{name:<16} {base:.4f}s -> {current:.4f}s  ({ratio:.2f}x){flag}")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m ratchets.bench",
+        description="benchmark ratchets on a generated repository",
+    )
+    defaults = RepoSpec()
+    parser.add_argument("--files", type=int, default=defaults.files)
+    parser.add_argument("--lines", type=int, default=defaults.lines)
+    parser.add_argument(
+        "--density",
+        type=float,
+        default=defaults.density,
+        help="fraction of lines that break a rule",
+    )
+    parser.add_argument(
+        "--ignored-files",
+        type=int,
+        default=defaults.ignored_files,
+        help=".py files to place in ignored directories",
+    )
+    parser.add_argument("--commits", type=int, default=defaults.commits)
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--only",
+        nargs="+",
+        choices=list(BENCHMARKS),
+        help="run only these benchmarks",
+    )
+    parser.add_argument(
+        "--repo",
+        metavar="DIR",
+        help="generate the repository in DIR and keep it, or reuse it",
+    )
+    parser.add_argument("-o", "--output", metavar="PATH", help="write results here")
+    parser.add_argument(
+        "--compare",
+        metavar="BASELINE",
+        help="compare against results saved with --output",
+    )
+    parser.add_argument(
+        "--current",
+        metavar="PATH",
+        help="compare saved results from PATH instead of running the benchmarks",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=DEFAULT_THRESHOLD,
+        help="slowdown counted as a regression, as a fraction of the baseline "
+        + f"(default is {DEFAULT_THRESHOLD})",
+    )
+    args = parser.parse_args(argv)
+
+    if args.current is not None:
+        if args.compare is None:
+            raise Exception("--current requires --compare.")
+        with open(args.current, "r", encoding="utf-8") as f:
+            results = json.load(f)
+    else:
+        if args.repeat < 1:
+            raise Exception("--repeat must be at least 1.")
+        spec = RepoSpec(
+            files=args.files,
+            lines=args.lines,
+            density=args.density,
+            ignored_files=args.ignored_files,
+            commits=max(1, args.commits),
+            seed=args.seed,
+        )
+        names = args.only or list(BENCHMARKS)
+        if args.repo is not None:
+            if not os.path.isdir(os.path.join(args.repo, ".git")):
+                generate_repo(Path(args.repo), spec)
+            root = os.path.abspath(args.repo)
+            results = run_benchmarks(root, spec, names, args.repeat)
+        else:
+            with tempfile.TemporaryDirectory() as tmp:
+                generate_repo(Path(tmp), spec)
+                results = run_benchmarks(tmp, spec, names, args.repeat)
+        print_results(results)
+        if args.output is not None:
+            with open(args.output, "w", encoding="utf-8") as f:
+                json.dump(results, f, indent=2)
+
+    if args.compare is None:
+        return 0
+    with open(args.compare, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    if baseline.get("spec") != results.get("spec"):
+        print("Warning: the results were measured on different repositories.")
+    rows = compare_results(baseline, results, args.threshold)
+    print_comparison(rows)
+    return 1 if any(row[4] for row in rows) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
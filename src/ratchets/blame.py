@@ -0,0 +1,196 @@
+import os
+from dataclasses import dataclass
+from datetime import datetime
+from functools import partial
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from ratchets.caching import BlameRecord, CachingDatabase
+from ratchets.scheduler import run_tasks
+from ratchets.vcs import diff_names, file_blob_id, head_commit, run_git, tree_blobs
+
+# (author, author time, commit, line content) of a single blamed line.
+LineBlame = Tuple[str, datetime, str, str]
+
+# blame the whole file when matches are this dense or need this many ranges.
+DENSE_FRACTION = 0.25
+MAX_RANGES = 64
+BLAME_TIMEOUT = 60
+
+# metadata key holding the commit the blame index was last brought up to.
+INDEXED_COMMIT = "indexed_commit"
+
+
+def line_ranges(lines: Iterable[int]) -> List[Tuple[int, int]]:
+    """Collapse line numbers into sorted, inclusive (start, end) ranges."""
+    ranges: List[Tuple[int, int]] = []
+    for line in sorted(set(lines)):
+        if ranges and ranges[-1][1] + 1 == line:
+            ranges[-1] = (ranges[-1][0], line)
+        else:
+            ranges.append((line, line))
+    return ranges
+
+
+def count_lines(file_path: str) -> int:
+    """Return the number of lines in a file, or 0 if it can't be read."""
+    try:
+        with open(file_path, "rb") as f:
+            return sum(1 for _ in f)
+    except OSError:
+        return 0
+
+
+def blame_args(file_path: str, lines: Iterable[int]) -> List[str]:
+    """
+    Return 'git blame' arguments for the given lines of a file: one '-L'
+    per range of adjacent lines, or none to blame the whole file when the
+    lines are dense or scattered over many ranges.
+    """
+    lines = set(lines)
+    ranges = line_ranges(lines)
+    args = ["blame", "--line-porcelain"]
+    total = count_lines(file_path)
+    if len(ranges) <= MAX_RANGES and len(lines) < total * DENSE_FRACTION:
+        for start, end in ranges:
+            args += ["-L", f"{start},{end}"]
+    return args + ["--", file_path]
+
+
+def parse_line_porcelain(output: str) -> Dict[int, LineBlame]:
+    """Parse 'git blame --line-porcelain' output into blame by final line number."""
+    blames: Dict[int, LineBlame] = {}
+    final_line: Optional[int] = None
+    commit = ""
+    author: Optional[str] = None
+    author_time: Optional[datetime] = None
+    expect_header = True
+
+    for line in output.splitlines():
+        if expect_header:
+            # '<sha> <original line> <final line> [<group size>]'
+            parts = line.split()
+            final_line = int(parts[2]) if len(parts) >= 3 else None
+            commit = parts[0] if parts else ""
+            author = None
+            author_time = None
+            expect_header = False
+        elif line.startswith("\t"):
+            if final_line is not None and author is not None and author_time:
+                blames[final_line] = (author, author_time, commit, line[1:])
+            expect_header = True
+        elif line.startswith("author "):
+            author = line[len("author ") :].strip()
+        elif line.startswith("author-time "):
+            try:
+                author_time = datetime.fromtimestamp(int(line[len("author-time ") :]))
+            except ValueError:
+                author_time = None
+    return blames
+
+
+def is_committed(commit: str) -> bool:
+    """Whether a blamed commit is real rather than git's all-zero placeholder."""
+    return bool(commit.strip("0"))
+
+
+def blame_file(
+    file_path: str, lines: Iterable[int], root: str
+) -> Dict[int, LineBlame]:
+    """Blame the given lines of a file with a single git invocation."""
+    output = run_git(blame_args(file_path, lines), root, timeout=BLAME_TIMEOUT)
+    return parse_line_porcelain(output)
+
+
+def blame_whole_file(
+    path: str, root: str, rev: Optional[str] = None
+) -> Dict[int, LineBlame]:
+    """Blame every line of a file at 'rev', or in the working tree if None."""
+    args = ["blame", "--line-porcelain"] + ([rev] if rev else []) + ["--", path]
+    return parse_line_porcelain(run_git(args, root, timeout=BLAME_TIMEOUT))
+
+
+def blame_records(
+    blames: Dict[int, LineBlame], file_path: str, blob_id: str
+) -> List[BlameRecord]:
+    """Turn parsed blame into records stored under 'blob_id'."""
+    return [
+        BlameRecord(content, line_no, author_time, file_path, author, blob_id)
+        for line_no, (author, author_time, _, content) in blames.items()
+    ]
+
+
+@dataclass
+class IndexSummary:
+    """What one 'build_blame_index' run did."""
+
+    commit: str
+    indexed: int
+    overlaid: int
+
+
+def build_blame_index(
+    root: str, db: CachingDatabase, rebuild: bool = False, workers: int = 1
+) -> IndexSummary:
+    """
+    Blame every committed .py file under 'root' at HEAD and store the result
+    by blob id. After the first run only files that changed since the
+    indexed commit are blamed again. Files with uncommitted changes are then
+    blamed in the working tree: committed lines are stored under the blob
+    id of the working copy and uncommitted lines are kept until HEAD moves.
+    """
+    head = head_commit(root)
+    blobs = {
+        path: blob
+        for path, blob in tree_blobs(head, root).items()
+        if path.endswith(".py")
+    }
+
+    candidates = set(blobs)
+    previous = None if rebuild else db.get_meta(INDEXED_COMMIT)
+    if previous is not None:
+        try:
+            candidates &= set(diff_names(previous, head, root))
+        except Exception:
+            # the indexed commit is gone, e.g. after a rebase; check every blob
+            pass
+    if not rebuild:
+        indexed = db.get_indexed(blobs[path] for path in candidates)
+        candidates = {path for path in candidates if blobs[path] not in indexed}
+
+    def index_task(path: str) -> None:
+        blames = blame_whole_file(path, root, head)
+        file_path = os.path.join(root, path)
+        db.create_or_update_blob_blames(blame_records(blames, file_path, blobs[path]))
+        db.mark_indexed([blobs[path]])
+
+    tasks = ((path, partial(index_task, path)) for path in sorted(candidates))
+    run_tasks(tasks, max(1, min(workers, len(candidates))))
+
+    # uncommitted changes, limited to files git already tracks
+    worktree: List[BlameRecord] = []
+    dirty = [
+        path
+        for path in diff_names(head, None, root)
+        if path in blobs and os.path.isfile(os.path.join(root, path))
+    ]
+    for path in dirty:
+        file_path = os.path.join(root, path)
+        blob_id = file_blob_id(file_path)
+        if blob_id is None:
+            continue
+        blames = blame_whole_file(path, root)
+        committed = {
+            line_no: blame
+            for line_no, blame in blames.items()
+            if is_committed(blame[2])
+        }
+        db.create_or_update_blob_blames(blame_records(committed, file_path, blob_id))
+        uncommitted = {
+            line_no: blame
+            for line_no, blame in blames.items()
+            if line_no not in committed
+        }
+        worktree += blame_records(uncommitted, file_path, blob_id)
+    db.replace_worktree_blames(head, worktree)
+    db.set_meta(INDEXED_COMMIT, head)
+    return IndexSummary(head, len(candidates), len(dirty))
@@ -1,8 +1,36 @@
+import os
+import json
+import time
 import sqlite3
+import hashlib
 import argparse
+import warnings
+import threading
 from datetime import datetime
-from typing import Optional, Dict, List
-from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional, Dict, List, Any, Iterable, Set, Tuple, Union
+from dataclasses import dataclass, replace
+
+from ratchets.vcs import file_blob_id
+
+
+# seconds a connection waits for another process's write lock.
+BUSY_TIMEOUT = 30.0
+# keys per lookup query, below SQLite's default limit on bound parameters.
+LOOKUP_BATCH_SIZE = 400
+# queued rows that trigger a flush inside a 'with' block.
+MAX_PENDING_ROWS = 10000
+
+
+def connect(path: str) -> sqlite3.Connection:
+    """
+    Open a cache database in WAL mode with a busy timeout, so parallel runs
+    and pytest-xdist workers can share it safely.
+    """
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    return conn
 
 
 @dataclass
@@ -12,151 +40,552 @@ class BlameRecord:
     timestamp: datetime
     file_name: str
     author: str
+    blob_id: Optional[str] = None
 
 
 class CachingDatabase:
+    """
+    Blame cache backed by a single persistent SQLite connection in WAL mode,
+    so concurrent runs can read while one of them writes. Writes are queued
+    and applied in one transaction by 'flush', which runs before every read,
+    when the queue grows large, and when the database is closed. Outside a
+    'with' block every write is flushed straight away.
+    """
 
     def __init__(self, path: str):
         """Initialization: verify/create DB on disk for caching."""
         self.db_path = path
+        self._lock = threading.RLock()
+        self._pending: List[Tuple[str, List[Tuple[Any, ...]]]] = []
+        self._depth = 0
+        self.conn: Optional[sqlite3.Connection] = connect(path)
         self.__create_db__(path)
 
+    def __enter__(self) -> "CachingDatabase":
+        with self._lock:
+            self._depth += 1
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        with self._lock:
+            self._depth -= 1
+            if self._depth == 0:
+                self.close()
+
+    def _connection(self) -> sqlite3.Connection:
+        if self.conn is None:
+            self.conn = connect(self.db_path)
+        return self.conn
+
     def __create_db__(self, path: str):
-        """Create table if needed, and add 'author' column if missing."""
-        conn = sqlite3.connect(path)
-        cursor = conn.cursor()
+        """Create the tables if needed."""
+        with self._lock:
+            conn = self._connection()
+            cursor = conn.cursor()
 
-        cursor.execute(
+            # blames used to be keyed by file name and line number, which went
+            # stale whenever a file changed
+            cursor.execute("DROP TABLE IF EXISTS blames")
+
+            # keyed by the git blob id of the file contents, so entries survive
+            # renames and different checkouts, and expire when the blob changes
+            cursor.execute(
+                """
+                CREATE TABLE IF NOT EXISTS blob_blames (
+                    blob_id TEXT,
+                    line_number INTEGER,
+                    line_content TEXT,
+                    file_name TEXT,
+                    timestamp TEXT,
+                    author TEXT,
+                    PRIMARY KEY(blob_id, line_number)
+                )
             """
-            CREATE TABLE IF NOT EXISTS blames (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                file_name TEXT,
-                line_number INTEGER,
-                line_content TEXT,
-                timestamp TEXT,
-                author TEXT,
-                UNIQUE(file_name, line_number)
             )
-        """
-        )
 
-        cursor.execute(
+            # blobs whose every line has been blamed by 'ratchets blame-index'
+            cursor.execute(
+                """
+                CREATE TABLE IF NOT EXISTS indexed_blobs (
+                    blob_id TEXT PRIMARY KEY
+                )
             """
-            CREATE INDEX IF NOT EXISTS idx_blame_file_line
-            ON blames(file_name, line_number)
-        """
-        )
+            )
 
-        conn.commit()
-        cursor.close()
-        conn.close()
+            # lines not committed yet, only valid while HEAD is 'head'
+            cursor.execute(
+                """
+                CREATE TABLE IF NOT EXISTS worktree_blames (
+                    blob_id TEXT,
+                    line_number INTEGER,
+                    head TEXT,
+                    line_content TEXT,
+                    file_name TEXT,
+                    timestamp TEXT,
+                    author TEXT,
+                    PRIMARY KEY(blob_id, line_number)
+                )
+            """
+            )
+
+            cursor.execute(
+                """
+                CREATE TABLE IF NOT EXISTS index_meta (
+                    key TEXT PRIMARY KEY,
+                    value TEXT
+                )
+            """
+            )
+
+            conn.commit()
+            cursor.close()
+
+    def _write(self, query: str, rows: List[Tuple[Any, ...]]) -> None:
+        """Queue rows for 'query', flushing unless batching inside a 'with'."""
+        if not rows:
+            return
+        with self._lock:
+            self._pending.append((query, rows))
+            queued = sum(len(pending_rows) for _, pending_rows in self._pending)
+            if self._depth == 0 or queued >= MAX_PENDING_ROWS:
+                self.flush()
+
+    def flush(self) -> None:
+        """Apply every queued write in a single transaction."""
+        with self._lock:
+            if not self._pending:
+                return
+            conn = self._connection()
+            with conn:
+                for query, rows in self._pending:
+                    conn.executemany(query, rows)
+            self._pending = []
+
+    def close(self) -> None:
+        """Flush queued writes and close the connection."""
+        with self._lock:
+            self.flush()
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
 
     def create_or_update_blames(self, blames: List[BlameRecord]):
-        """Insert or update a list of blames."""
+        """
+        Deprecated, use 'create_or_update_blob_blames'. Blames without a
+        blob id are stored for the current contents of their file, and are
+        skipped if it can't be read.
+        """
+        warnings.warn(
+            "create_or_update_blames is deprecated, use create_or_update_blob_blames",
+            DeprecationWarning,
+            stacklevel=2,
+        )
+        records = []
+        for blame in blames:
+            blob_id = blame.blob_id or file_blob_id(blame.file_name)
+            if blob_id is not None:
+                records.append(replace(blame, blob_id=blob_id))
+        self.create_or_update_blob_blames(records)
 
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+    def create_or_update_blame(self, blame: BlameRecord):
+        """Deprecated, use 'create_or_update_blob_blames'."""
+        self.create_or_update_blames([blame])
 
-        cursor.execute("PRAGMA journal_mode = OFF")
-        cursor.execute("PRAGMA synchronous = OFF")
+    def get_blame(self, line_number: int, file_name: str) -> Optional[BlameRecord]:
+        """
+        Deprecated, use 'get_blob_blames'. Looks up the blame of a line of
+        the current contents of 'file_name', or returns None.
+        """
+        return self.get_blames([(file_name, line_number)]).get(
+            (file_name, line_number)
+        )
 
-        upsert_query = """
-            INSERT INTO blames (file_name, line_number, line_content, timestamp, author)
-            VALUES (?, ?, ?, ?, ?)
-            ON CONFLICT(file_name, line_number) DO UPDATE SET
-                line_content = excluded.line_content,
-                timestamp = excluded.timestamp,
-                author = excluded.author
+    def get_blames(
+        self, keys: Iterable[Tuple[str, int]]
+    ) -> Dict[Tuple[str, int], BlameRecord]:
         """
+        Deprecated, use 'get_many_blob_blames'. Looks up (file name, line
+        number) keys in the blames of the current contents of each file.
+        """
+        warnings.warn(
+            "get_blame and get_blames are deprecated, use get_many_blob_blames",
+            DeprecationWarning,
+            stacklevel=2,
+        )
+        keys = list(keys)
+        blob_ids = {name: file_blob_id(name) for name, _ in keys}
+        cached = self.get_many_blob_blames(b for b in blob_ids.values() if b)
+        found: Dict[Tuple[str, int], BlameRecord] = {}
+        for name, line_number in keys:
+            record = cached.get(blob_ids[name] or "", {}).get(line_number)
+            if record is not None:
+                found[(name, line_number)] = record
+        return found
 
-        cursor.executemany(
-            upsert_query,
+    def create_or_update_blob_blames(self, blames: List[BlameRecord]):
+        """Insert or update blames keyed by their blob id and line number."""
+        self._write(
+            """
+            INSERT OR REPLACE INTO blob_blames
+                (blob_id, line_number, line_content, file_name, timestamp, author)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """,
             [
                 (
-                    blame.file_name,
+                    blame.blob_id,
                     blame.line_number,
                     blame.line_content,
+                    blame.file_name,
                     blame.timestamp.isoformat(),
                     blame.author,
                 )
                 for blame in blames
+                if blame.blob_id is not None
             ],
         )
 
-        conn.commit()
-        cursor.close()
-        conn.close()
+    def get_blob_blames(self, blob_id: str) -> Dict[int, BlameRecord]:
+        """Return every cached blame for a blob, keyed by line number."""
+        return self.get_many_blob_blames([blob_id]).get(blob_id, {})
 
-    def create_or_update_blame(self, blame: BlameRecord):
-        """Insert or update a blame."""
-        conn = sqlite3.connect(self.db_path)
+    def get_many_blob_blames(
+        self, blob_ids: Iterable[str]
+    ) -> Dict[str, Dict[int, BlameRecord]]:
+        """Return cached blames for many blobs, using 'IN' queries in batches."""
+        blob_ids = list(set(blob_ids))
+        blames: Dict[str, Dict[int, BlameRecord]] = {}
+        with self._lock:
+            self.flush()
+            conn = self._connection()
+            for start in range(0, len(blob_ids), LOOKUP_BATCH_SIZE):
+                batch = blob_ids[start : start + LOOKUP_BATCH_SIZE]
+                placeholders = ", ".join("?" for _ in batch)
+                rows = conn.execute(
+                    "SELECT blob_id, line_number, line_content, file_name,"
+                    + " timestamp, author FROM blob_blames"
+                    + f" WHERE blob_id IN ({placeholders})",
+                    batch,
+                ).fetchall()
+                for blob_id, line_number, line_content, file_name, ts, author in rows:
+                    try:
+                        timestamp = datetime.fromisoformat(ts)
+                    except Exception:
+                        continue
+                    blames.setdefault(blob_id, {})[line_number] = BlameRecord(
+                        line_content, line_number, timestamp, file_name, author, blob_id
+                    )
+        return blames
+
+    def mark_indexed(self, blob_ids: Iterable[str]) -> None:
+        """Record blobs whose every line has been blamed."""
+        self._write(
+            "INSERT OR IGNORE INTO indexed_blobs (blob_id) VALUES (?)",
+            [(blob_id,) for blob_id in blob_ids],
+        )
+
+    def get_indexed(self, blob_ids: Iterable[str]) -> Set[str]:
+        """Return the given blobs that have been fully blamed."""
+        blob_ids = list(set(blob_ids))
+        indexed: Set[str] = set()
+        with self._lock:
+            self.flush()
+            conn = self._connection()
+            for start in range(0, len(blob_ids), LOOKUP_BATCH_SIZE):
+                batch = blob_ids[start : start + LOOKUP_BATCH_SIZE]
+                placeholders = ", ".join("?" for _ in batch)
+                rows = conn.execute(
+                    "SELECT blob_id FROM indexed_blobs"
+                    + f" WHERE blob_id IN ({placeholders})",
+                    batch,
+                ).fetchall()
+                indexed.update(row[0] for row in rows)
+        return indexed
+
+    def replace_worktree_blames(self, head: str, blames: List[BlameRecord]) -> None:
+        """Replace the blames of uncommitted lines, valid while HEAD is 'head'."""
+        with self._lock:
+            self.flush()
+            conn = self._connection()
+            with conn:
+                conn.execute("DELETE FROM worktree_blames")
+                conn.executemany(
+                    """
+                    INSERT OR REPLACE INTO worktree_blames
+                        (blob_id, line_number, head, line_content, file_name,
+                         timestamp, author)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                    [
+                        (
+                            blame.blob_id,
+                            blame.line_number,
+                            head,
+                            blame.line_content,
+                            blame.file_name,
+                            blame.timestamp.isoformat(),
+                            blame.author,
+                        )
+                        for blame in blames
+                        if blame.blob_id is not None
+                    ],
+                )
+
+    def get_worktree_blames(
+        self, head: str, blob_ids: Iterable[str]
+    ) -> Dict[str, Dict[int, BlameRecord]]:
+        """Return indexed blames of uncommitted lines if HEAD is still 'head'."""
+        blob_ids = list(set(blob_ids))
+        blames: Dict[str, Dict[int, BlameRecord]] = {}
+        with self._lock:
+            self.flush()
+            conn = self._connection()
+            for start in range(0, len(blob_ids), LOOKUP_BATCH_SIZE):
+                batch = blob_ids[start : start + LOOKUP_BATCH_SIZE]
+                placeholders = ", ".join("?" for _ in batch)
+                rows = conn.execute(
+                    "SELECT blob_id, line_number, line_content, file_name,"
+                    + " timestamp, author FROM worktree_blames"
+                    + f" WHERE head = ? AND blob_id IN ({placeholders})",
+                    [head] + batch,
+                ).fetchall()
+                for blob_id, line_number, line_content, file_name, ts, author in rows:
+                    try:
+                        timestamp = datetime.fromisoformat(ts)
+                    except Exception:
+                        continue
+                    blames.setdefault(blob_id, {})[line_number] = BlameRecord(
+                        line_content, line_number, timestamp, file_name, author, blob_id
+                    )
+        return blames
+
+    def get_meta(self, key: str) -> Optional[str]:
+        """Return a value stored by 'set_meta', or None."""
+        with self._lock:
+            self.flush()
+            row = (
+                self._connection()
+                .execute("SELECT value FROM index_meta WHERE key = ?", (key,))
+                .fetchone()
+            )
+        return row[0] if row else None
+
+    def set_meta(self, key: str, value: str) -> None:
+        """Store a value such as the commit the blame index was built at."""
+        self._write(
+            "INSERT OR REPLACE INTO index_meta (key, value) VALUES (?, ?)",
+            [(key, value)],
+        )
+
+    def clear_cache(self) -> None:
+        """Clear the local blame caching DB."""
+        with self._lock:
+            self._pending = []
+            conn = self._connection()
+            with conn:
+                conn.execute("DELETE FROM blob_blames")
+                conn.execute("DELETE FROM indexed_blobs")
+                conn.execute("DELETE FROM worktree_blames")
+                conn.execute("DELETE FROM index_meta")
+
+
+# (line number, line content, column) found by one rule in one file.
+CachedMatches = List[Tuple[int, str, Optional[int]]]
+
+# rule fields that do not change which lines a rule matches.
+RULE_METADATA_KEYS = ("description", "valid", "invalid")
+
+# files modified this recently may still change within the same mtime tick,
+# so their stat signature is not trusted on later runs.
+RACY_SECONDS = 2.0
+
+
+def hash_rule(kind: str, rule: Dict[str, Any]) -> str:
+    """Hash the parts of a rule definition that affect its results."""
+    definition = {k: v for k, v in rule.items() if k not in RULE_METADATA_KEYS}
+    payload = json.dumps([kind, definition], sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+def hash_content(data: bytes) -> str:
+    """Hash the raw contents of a file."""
+    return hashlib.sha1(data).hexdigest()
+
+
+class ResultCache:
+    """
+    On-disk cache of per-file, per-rule matches keyed by the hash of the
+    file contents and the hash of the rule definition. File stat signatures
+    are stored so unchanged files are not re-read to compute their hash.
+    Signatures of deleted files, and results for contents no file has
+    anymore, are dropped as results are stored.
+    """
+
+    def __init__(self, path: str):
+        """Initialization: verify/create DB on disk for caching."""
+        self.db_path = path
+        self.__create_db__(path)
+
+    def __create_db__(self, path: str):
+        """Create the stat and result tables if needed."""
+        conn = connect(path)
         cursor = conn.cursor()
 
-        upsert_query = """
-            INSERT INTO blames (file_name, line_number, line_content, timestamp, author)
-            VALUES (?, ?, ?, ?, ?)
-            ON CONFLICT(file_name, line_number) DO UPDATE SET
-                line_content = excluded.line_content,
-                timestamp = excluded.timestamp,
-                author = excluded.author
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS file_stats (
+                file_name TEXT PRIMARY KEY,
+                mtime_ns INTEGER,
+                size INTEGER,
+                inode INTEGER,
+                content_hash TEXT
+            )
         """
+        )
+
         cursor.execute(
-            upsert_query,
-            (
-                blame.file_name,
-                blame.line_number,
-                blame.line_content,
-                blame.timestamp.isoformat(),
-                blame.author,
-            ),
+            """
+            CREATE TABLE IF NOT EXISTS results (
+                content_hash TEXT,
+                rule_hash TEXT,
+                matches TEXT,
+                PRIMARY KEY(content_hash, rule_hash)
+            )
+        """
         )
 
         conn.commit()
         cursor.close()
         conn.close()
 
-    def get_blame(self, line_number: int, file_name: str) -> Optional[BlameRecord]:
+    def content_hashes(self, files: Iterable[Union[str, Path]]) -> Dict[str, str]:
         """
-        Lookup the blame for the specified file and line number.
-        Returns None if not found, else:
-        {
-            'author': AUTHOR,
-            'timestamp': TS (datetime),
-            'line_content': content (str)
-        }
+        Return the content hash of every file, only reading files whose
+        mtime, size or inode differ from the last run.
         """
-        conn = sqlite3.connect(self.db_path)
+        conn = connect(self.db_path)
         cursor = conn.cursor()
+        cursor.execute(
+            "SELECT file_name, mtime_ns, size, inode, content_hash FROM file_stats"
+        )
+        known = {row[0]: row[1:] for row in cursor.fetchall()}
 
-        select_query = """
-            SELECT author, timestamp, line_content
-              FROM blames
-             WHERE file_name = ? AND line_number = ?
-        """
-        cursor.execute(select_query, (file_name, line_number))
-        row = cursor.fetchone()
+        hashes: Dict[str, str] = {}
+        updates = []
+        now = time.time()
+
+        for file_path in files:
+            file_str = str(file_path)
+            stat = os.stat(file_str)
+            signature = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+            previous = known.get(file_str)
+            if previous is not None and tuple(previous[:3]) == signature:
+                hashes[file_str] = previous[3]
+                continue
+
+            with open(file_str, "rb") as f:
+                digest = hash_content(f.read())
+            hashes[file_str] = digest
+            if now - stat.st_mtime > RACY_SECONDS:
+                updates.append((file_str, *signature, digest))
+
+        gone = [
+            (name,) for name in known if name not in hashes and not os.path.exists(name)
+        ]
+        if updates:
+            cursor.executemany(
+                """
+                INSERT OR REPLACE INTO file_stats
+                    (file_name, mtime_ns, size, inode, content_hash)
+                VALUES (?, ?, ?, ?, ?)
+            """,
+                updates,
+            )
+        if gone:
+            cursor.executemany("DELETE FROM file_stats WHERE file_name = ?", gone)
+        if updates or gone:
+            conn.commit()
 
         cursor.close()
         conn.close()
+        return hashes
 
-        if not row:
-            return None
+    def get_results(
+        self, content_hashes: Iterable[str], rule_hashes: Iterable[str]
+    ) -> Dict[Tuple[str, str], CachedMatches]:
+        """
+        Return cached matches of the given contents and rules, keyed by
+        (content, rule) hash. Contents are looked up in batches through the
+        primary key.
+        """
+        content_hashes = list(set(content_hashes))
+        rules = set(rule_hashes)
+        found: Dict[Tuple[str, str], CachedMatches] = {}
+        if not content_hashes or not rules:
+            return found
 
-        author, ts_str, line_content = row
-        try:
-            ts = datetime.fromisoformat(ts_str)
-        except Exception:
-            return None
+        conn = connect(self.db_path)
+        cursor = conn.cursor()
+        for start in range(0, len(content_hashes), LOOKUP_BATCH_SIZE):
+            batch = content_hashes[start : start + LOOKUP_BATCH_SIZE]
+            placeholders = ", ".join("?" for _ in batch)
+            cursor.execute(
+                "SELECT content_hash, rule_hash, matches FROM results"
+                + f" WHERE content_hash IN ({placeholders})",
+                batch,
+            )
+            for content_hash, rule_hash, matches in cursor.fetchall():
+                if rule_hash not in rules:
+                    continue
+                # entries written before columns were stored only have two fields
+                found[(content_hash, rule_hash)] = [
+                    (int(line), str(content), rest[0] if rest else None)
+                    for line, content, *rest in json.loads(matches)
+                ]
 
-        blame = BlameRecord(line_content, line_number, ts, file_name, author)
+        cursor.close()
+        conn.close()
+        return found
 
-        return blame
+    def save_results(
+        self,
+        results: Dict[Tuple[str, str], CachedMatches],
+        current: Iterable[str] = (),
+    ) -> None:
+        """
+        Store matches keyed by (content hash, rule hash), and drop the results
+        of contents that no known file has. 'current' are the content hashes
+        of the files being evaluated, which may have no stored signature yet.
+        """
+        conn = connect(self.db_path)
+        with conn:
+            conn.executemany(
+                """
+                INSERT OR REPLACE INTO results (content_hash, rule_hash, matches)
+                VALUES (?, ?, ?)
+            """,
+                [
+                    (content_hash, rule_hash, json.dumps(matches))
+                    for (content_hash, rule_hash), matches in results.items()
+                ],
+            )
+            keep = set(current)
+            keep.update(
+                row[0] for row in conn.execute("SELECT content_hash FROM file_stats")
+            )
+            stale = [
+                row
+                for row in conn.execute("SELECT DISTINCT content_hash FROM results")
+                if row[0] not in keep
+            ]
+            conn.executemany("DELETE FROM results WHERE content_hash = ?", stale)
+        conn.close()
 
     def clear_cache(self) -> None:
-        """Clear the local blame caching DB."""
-        conn = sqlite3.connect(self.db_path)
+        """Clear all cached results and file signatures."""
+        conn = connect(self.db_path)
         cursor = conn.cursor()
-        cursor.execute("DELETE FROM blames")
+        cursor.execute("DELETE FROM results")
+        cursor.execute("DELETE FROM file_stats")
         conn.commit()
         cursor.close()
         conn.close()
@@ -0,0 +1,112 @@
+import os
+import json
+import socket
+import hashlib
+import tempfile
+from typing import Any, Dict, Optional
+
+from ratchets.results import Results, results_from_dict
+
+SOCKET_FILENAME = ".ratchet_daemon.sock"
+# Unix socket paths longer than this don't fit in 'sockaddr_un' everywhere.
+MAX_SOCKET_PATH = 100
+CONNECT_TIMEOUT = 0.5
+REQUEST_TIMEOUT = 600
+
+
+def runtime_dir() -> str:
+    """
+    Return a directory for sockets that only the current user can use:
+    $XDG_RUNTIME_DIR, or a private directory in the temporary directory.
+    """
+    xdg = os.environ.get("XDG_RUNTIME_DIR")
+    if xdg and os.path.isdir(xdg):
+        return xdg
+    return os.path.join(tempfile.gettempdir(), f"ratchets-{os.getuid()}")
+
+
+def socket_path(root: str) -> str:
+    """Return the socket a daemon serving 'root' listens on."""
+    path = os.path.join(root, SOCKET_FILENAME)
+    if len(path) <= MAX_SOCKET_PATH:
+        return path
+    digest = hashlib.sha1(os.path.abspath(root).encode("utf-8")).hexdigest()[:16]
+    return os.path.join(runtime_dir(), f"ratchets-{digest}.sock")
+
+
+def make_socket_dir(path: str) -> None:
+    """
+    Create the directory of a socket path if it is missing, private to the
+    current user, raising if it exists but another user can reach it.
+    """
+    directory = os.path.dirname(path)
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    st = os.stat(directory)
+    if directory == runtime_dir() and (
+        st.st_uid != os.getuid() or st.st_mode & 0o077
+    ):
+        raise Exception(
+            f"{directory} must be owned by you and not accessible to other users."
+        )
+
+
+def owned_by_user(path: str) -> bool:
+    """Return whether 'path' exists and belongs to the current user."""
+    try:
+        return os.stat(path).st_uid == os.getuid()
+    except OSError:
+        return False
+
+
+def send_message(sock: socket.socket, message: Dict[str, Any]) -> None:
+    """Send one newline-terminated JSON message."""
+    sock.sendall(json.dumps(message).encode("utf-8") + b"\n")
+
+
+def read_message(sock: socket.socket) -> Optional[Dict[str, Any]]:
+    """Read one newline-terminated JSON message, or None if the peer hung up."""
+    chunks = []
+    while True:
+        chunk = sock.recv(65536)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        if chunk.endswith(b"\n"):
+            break
+    data = b"".join(chunks)
+    if not data.strip():
+        return None
+    return json.loads(data)
+
+
+def request(
+    root: str, message: Dict[str, Any], timeout: float = REQUEST_TIMEOUT
+) -> Optional[Dict[str, Any]]:
+    """Send 'message' to the daemon serving 'root', or return None if none is."""
+    path = socket_path(root)
+    # a socket another user created could answer with forged results
+    if not owned_by_user(path):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(CONNECT_TIMEOUT)
+        sock.connect(path)
+        sock.settimeout(timeout)
+        send_message(sock, message)
+        return read_message(sock)
+    except (OSError, ValueError):
+        return None
+    finally:
+        sock.close()
+
+
+def query_results(root: str) -> Optional[Results]:
+    """
+    Return the results of every configured rule from a running daemon, or
+    None when no daemon serves 'root' or it failed, so callers can evaluate
+    in process instead.
+    """
+    response = request(root, {"command": "results"})
+    if response is None or "results" not in response:
+        return None
+    return results_from_dict(response["results"])
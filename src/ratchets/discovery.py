@@ -0,0 +1,163 @@
+import os
+import stat
+import pathspec
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+
+from ratchets.vcs import ls_files
+
+# directories never worth entering, whatever the ignore files say.
+ALWAYS_SKIPPED = {".git"}
+
+
+def read_patterns(path: str) -> List[str]:
+    """Return the lines of an ignore file, or no lines if it doesn't exist."""
+    if not os.path.isfile(path):
+        return []
+    with open(path, "r") as f:
+        return f.read().splitlines()
+
+
+class IgnoreRules:
+    """
+    Decides which paths under 'root' are ignored. Paths are matched relative
+    to the root, or for .gitignore files relative to the directory holding
+    them. Patterns from 'excluded' always apply, like ratchet_excluded.txt.
+    .gitignore files are read lazily, and as in git a deeper .gitignore takes
+    precedence over those above it.
+    """
+
+    def __init__(
+        self,
+        root: Union[str, Path],
+        excluded: List[str],
+        ignore_filename: Optional[str] = ".gitignore",
+    ):
+        self.root = os.path.abspath(root)
+        self.excluded = pathspec.PathSpec.from_lines("gitwildmatch", excluded)
+        self.ignore_filename = ignore_filename
+        self._specs: Dict[str, Optional[pathspec.PathSpec]] = {}
+        self._dirs: Dict[str, bool] = {}
+
+    def spec_for(self, rel_dir: str) -> Optional[pathspec.PathSpec]:
+        """Return the patterns of the ignore file in 'rel_dir', if it has one."""
+        if self.ignore_filename is None:
+            return None
+        if rel_dir not in self._specs:
+            path = os.path.join(self.root, rel_dir, self.ignore_filename)
+            patterns = read_patterns(path)
+            self._specs[rel_dir] = (
+                pathspec.PathSpec.from_lines("gitwildmatch", patterns)
+                if patterns
+                else None
+            )
+        return self._specs[rel_dir]
+
+    def is_ignored(self, rel_path: str, is_dir: bool = False) -> bool:
+        """Whether a '/' separated path relative to the root is ignored."""
+        path = rel_path + "/" if is_dir else rel_path
+        if self.excluded.match_file(path):
+            return True
+        parts = rel_path.split("/")
+        for depth in range(len(parts) - 1, -1, -1):
+            base = "/".join(parts[:depth])
+            spec = self.spec_for(base)
+            if spec is None:
+                continue
+            result = spec.check_file(path[len(base) + 1 :] if base else path)
+            if result.include is not None:
+                return bool(result.include)
+        return False
+
+    def is_path_ignored(self, path: Union[str, Path]) -> bool:
+        """
+        Whether a file is ignored, either itself or through one of its
+        directories. Files outside the root are matched by absolute path
+        against the excluded and root ignore patterns.
+        """
+        abs_path = os.path.abspath(path)
+        rel_path = os.path.relpath(abs_path, self.root)
+        if rel_path == ".." or rel_path.startswith(".." + os.sep):
+            spec = self.spec_for("")
+            return bool(
+                self.excluded.match_file(abs_path)
+                or (spec is not None and spec.match_file(abs_path))
+            )
+        return self.is_relpath_ignored(Path(rel_path).as_posix())
+
+    def is_relpath_ignored(self, rel_path: str) -> bool:
+        """Whether a file under the root, or one of its directories, is ignored."""
+        parts = rel_path.split("/")
+        for depth in range(1, len(parts)):
+            rel_dir = "/".join(parts[:depth])
+            if rel_dir not in self._dirs:
+                self._dirs[rel_dir] = self.is_ignored(rel_dir, is_dir=True)
+            if self._dirs[rel_dir]:
+                return True
+        return self.is_ignored(rel_path)
+
+
+def walk_python_files(
+    root: Union[str, Path], rules: Optional[IgnoreRules] = None
+) -> List[Path]:
+    """
+    Return the .py files under 'root' in name order, skipping symlinks.
+    Ignored directories are pruned before they are entered, so nothing
+    below them is listed.
+    """
+    root = os.path.abspath(root)
+    files: List[Path] = []
+    pending = [""]
+    while pending:
+        rel_dir = pending.pop()
+        try:
+            with os.scandir(os.path.join(root, rel_dir)) as it:
+                entries = sorted(it, key=lambda entry: entry.name)
+        except OSError:
+            continue
+
+        subdirs = []
+        for entry in entries:
+            if entry.is_symlink():
+                continue
+            rel_path = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+            if entry.is_dir():
+                if entry.name in ALWAYS_SKIPPED:
+                    continue
+                if rules is None or not rules.is_ignored(rel_path, is_dir=True):
+                    subdirs.append(rel_path)
+            elif entry.name.endswith(".py"):
+                if rules is None or not rules.is_ignored(rel_path):
+                    files.append(Path(entry.path))
+        # depth first, visiting subdirectories in name order
+        pending.extend(reversed(subdirs))
+    return files
+
+
+def git_python_files(
+    root: Union[str, Path], rules: IgnoreRules
+) -> Optional[List[Path]]:
+    """
+    Return the .py files under 'root' that git tracks or would track, read
+    from the index in one 'git ls-files' call, or None if 'root' is not in
+    a git checkout or git can't be run. 'rules' are applied on top, which
+    also drops tracked files matched by a .gitignore. Symlinks and tracked
+    files deleted from the working tree are left out.
+    """
+    root = os.path.abspath(root)
+    files: List[Path] = []
+    try:
+        for rel_path in ls_files(root, ["*.py"]):
+            if not rel_path.endswith(".py") or rules.is_relpath_ignored(rel_path):
+                continue
+            path = os.path.join(root, rel_path)
+            try:
+                if not stat.S_ISREG(os.lstat(path).st_mode):
+                    continue
+            except OSError:
+                continue
+            files.append(Path(path))
+    except Exception:
+        return None
+    files.sort()
+    return files
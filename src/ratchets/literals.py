@@ -0,0 +1,105 @@
+import re
+from typing import FrozenSet, Iterable, List, Optional, Pattern
+
+try:
+    from re import _parser as sre_parse  # Python 3.11+
+except ImportError:
+    import sre_parse  # type: ignore
+
+# Literal alternatives, at least one of which appears in every match.
+Literals = FrozenSet[str]
+
+_LITERAL = sre_parse.LITERAL
+_IN = sre_parse.IN
+_BRANCH = sre_parse.BRANCH
+_SUBPATTERN = sre_parse.SUBPATTERN
+_ATOMIC_GROUP = getattr(sre_parse, "ATOMIC_GROUP", None)
+_REPEATS = {
+    sre_parse.MAX_REPEAT,
+    sre_parse.MIN_REPEAT,
+    getattr(sre_parse, "POSSESSIVE_REPEAT", sre_parse.MAX_REPEAT),
+}
+
+# character classes larger than this are not worth prefiltering on.
+MAX_CLASS_LITERALS = 4
+
+
+def required_literals(pattern: Pattern[str]) -> Optional[Literals]:
+    """
+    Return literal strings such that any match of 'pattern' contains at
+    least one of them, or None if no such literal could be found.
+    """
+    try:
+        parsed = sre_parse.parse(pattern.pattern, pattern.flags)
+    except Exception:
+        return None
+    return _required(parsed)
+
+
+def _best(candidates: List[Literals]) -> Optional[Literals]:
+    """Pick the candidate whose shortest alternative is longest."""
+    candidates = [c for c in candidates if c and all(c)]
+    if not candidates:
+        return None
+    return max(candidates, key=lambda c: (min(len(s) for s in c), -len(c)))
+
+
+def _required(items: Iterable) -> Optional[Literals]:
+    """Find required literals for a parsed sequence of regex items."""
+    candidates: List[Literals] = []
+    run: List[str] = []
+
+    for op, av in items:
+        if op is _LITERAL:
+            run.append(chr(av))
+            continue
+        if run:
+            candidates.append(frozenset(["".join(run)]))
+            run = []
+        found = _required_item(op, av)
+        if found is not None:
+            candidates.append(found)
+
+    if run:
+        candidates.append(frozenset(["".join(run)]))
+    return _best(candidates)
+
+
+def _required_item(op, av) -> Optional[Literals]:
+    """Find required literals for a single non-literal regex item."""
+    if op is _SUBPATTERN:
+        _, add_flags, _, sub = av
+        if add_flags & re.IGNORECASE:
+            return None
+        return _required(sub)
+
+    if _ATOMIC_GROUP is not None and op is _ATOMIC_GROUP:
+        return _required(av)
+
+    if op in _REPEATS:
+        min_count, _, sub = av
+        return _required(sub) if min_count >= 1 else None
+
+    if op is _BRANCH:
+        alternatives: List[str] = []
+        for branch in av[1]:
+            found = _required(branch)
+            if found is None:
+                return None
+            alternatives.extend(found)
+        return frozenset(alternatives)
+
+    if op is _IN:
+        if len(av) > MAX_CLASS_LITERALS:
+            return None
+        if any(sub_op is not _LITERAL for sub_op, _ in av):
+            return None
+        return frozenset(chr(code) for _, code in av)
+
+    return None
+
+
+def literal_pattern(literals: Iterable[str], flags: int = 0) -> Pattern[str]:
+    """Compile an alternation matching any of the given literals."""
+    ordered = sorted(set(literals), key=len, reverse=True)
+    return re.compile("|".join(re.escape(lit) for lit in ordered), flags)
@@ -0,0 +1,165 @@
+import os
+import json
+import urllib.parse
+from pathlib import Path
+from typing import Any, Dict, Iterable, Optional, TextIO
+
+from ratchets.results import Finding, MatchResult
+
+SARIF_SCHEMA = "https://json.schemastore.org/sarif-2.1.0.json"
+SARIF_VERSION = "2.1.0"
+TOOL_URI = "https://github.com/andrewlaack/ratchets"
+# base id that SARIF locations are relative to.
+ROOT_BASE_ID = "%SRCROOT%"
+
+
+def match_to_dict(kind: str, name: str, m: MatchResult) -> Dict[str, Any]:
+    """Return a JSON-serializable dict describing one match."""
+    return {
+        "kind": kind,
+        "rule": name,
+        "file": m.file,
+        "line": m.line,
+        "column": m.column,
+        "content": m.content,
+    }
+
+
+class Sink:
+    """
+    Writes matches to 'out' as they are found. 'start' is called with every
+    rule being evaluated before the first match, and 'finish' after the last.
+    """
+
+    def __init__(self, out: TextIO, root: str):
+        self.out = out
+        self.root = root
+        self.counts: Dict[str, int] = {}
+
+    def start(self, rules: Dict[str, Dict[str, Any]]) -> None:
+        self.counts = {name: 0 for name in rules}
+
+    def write(self, kind: str, name: str, m: MatchResult) -> None:
+        self.counts[name] = self.counts.get(name, 0) + 1
+
+    def finish(self) -> None:
+        self.out.flush()
+
+
+class JsonLinesSink(Sink):
+    """One JSON object per line and match."""
+
+    def write(self, kind: str, name: str, m: MatchResult) -> None:
+        super().write(kind, name, m)
+        self.out.write(json.dumps(match_to_dict(kind, name, m)) + "\n")
+
+
+class JsonSink(Sink):
+    """A single JSON document holding every match and the count of each rule."""
+
+    def start(self, rules: Dict[str, Dict[str, Any]]) -> None:
+        super().start(rules)
+        self.out.write('{"matches": [')
+        self.separator = "\n"
+
+    def write(self, kind: str, name: str, m: MatchResult) -> None:
+        super().write(kind, name, m)
+        self.out.write(self.separator + json.dumps(match_to_dict(kind, name, m)))
+        self.separator = ",\n"
+
+    def finish(self) -> None:
+        self.out.write('\n], "counts": ' + json.dumps(self.counts) + "}\n")
+        super().finish()
+
+
+class SarifSink(Sink):
+    """
+    A SARIF 2.1.0 log with one run, whose results are written one at a
+    time. Locations under the root are relative to the %SRCROOT% base id.
+    """
+
+    def start(self, rules: Dict[str, Dict[str, Any]]) -> None:
+        super().start(rules)
+        self.descriptions = {
+            name: str(rule.get("description") or "") for name, rule in rules.items()
+        }
+        driver = {
+            "name": "ratchets",
+            "informationUri": TOOL_URI,
+            "rules": [
+                dict(
+                    {"id": name},
+                    **({"shortDescription": {"text": text}} if text else {}),
+                )
+                for name, text in self.descriptions.items()
+            ],
+        }
+        header = json.dumps(
+            {
+                "$schema": SARIF_SCHEMA,
+                "version": SARIF_VERSION,
+                "runs": [
+                    {
+                        "tool": {"driver": driver},
+                        "originalUriBaseIds": {
+                            ROOT_BASE_ID: {"uri": Path(self.root).as_uri() + "/"}
+                        },
+                        "results": [],
+                    }
+                ],
+            }
+        )
+        # the results array is left open and filled in by 'write'
+        self.out.write(header[: -len("]}]}")])
+        self.separator = "\n"
+
+    def location(self, m: MatchResult) -> Dict[str, Any]:
+        artifact: Dict[str, Any] = {"uri": Path(os.path.abspath(m.file)).as_uri()}
+        rel_path = os.path.relpath(os.path.abspath(m.file), self.root)
+        if not rel_path.startswith(".."):
+            uri = urllib.parse.quote(Path(rel_path).as_posix())
+            artifact = {"uri": uri, "uriBaseId": ROOT_BASE_ID}
+        location: Dict[str, Any] = {"artifactLocation": artifact}
+        if m.line:
+            region: Dict[str, Any] = {"startLine": m.line}
+            if m.column:
+                region["startColumn"] = m.column
+            region["snippet"] = {"text": m.content}
+            location["region"] = region
+        return {"physicalLocation": location}
+
+    def write(self, kind: str, name: str, m: MatchResult) -> None:
+        super().write(kind, name, m)
+        result = {
+            "ruleId": name,
+            "level": "warning",
+            "message": {"text": self.descriptions.get(name) or f"'{name}' matched."},
+            "locations": [self.location(m)],
+        }
+        self.out.write(self.separator + json.dumps(result))
+        self.separator = ",\n"
+
+    def finish(self) -> None:
+        self.out.write("\n]}]}\n")
+        super().finish()
+
+
+SINKS = {"jsonl": JsonLinesSink, "json": JsonSink, "sarif": SarifSink}
+
+
+def write_findings(
+    findings: Iterable[Finding],
+    rules: Dict[str, Dict[str, Any]],
+    fmt: str,
+    out: TextIO,
+    root: Optional[str] = None,
+) -> Dict[str, int]:
+    """Write every finding to 'out' in format 'fmt', returning the counts."""
+    if fmt not in SINKS:
+        raise Exception(f"Unknown output format: {fmt}")
+    sink = SINKS[fmt](out, os.path.abspath(root or os.getcwd()))
+    sink.start(rules)
+    for kind, name, m in findings:
+        sink.write(kind, name, m)
+    sink.finish()
+    return sink.counts
@@ -0,0 +1,339 @@
+import os
+import sys
+import json
+import time
+import threading
+import tracemalloc
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, TextIO, Tuple
+
+# the profiler of the current run, if '--profile' was given.
+_ACTIVE: Optional["Profiler"] = None
+_HOOK_INSTALLED = False
+
+# audit events of processes started by 'subprocess' and 'os'.
+SPAWN_EVENTS = {"subprocess.Popen", "os.posix_spawn", "os.spawn", "os.system"}
+FORK_EVENT = "os.fork"
+# files listed in the summary, slowest first.
+SLOWEST_FILES = 10
+
+
+def active() -> Optional["Profiler"]:
+    """Return the profiler of the current run, or None when not profiling."""
+    return _ACTIVE
+
+
+def command_name(event: str, args: Tuple[Any, ...]) -> str:
+    """Return the program a spawn audit event starts, such as 'git'."""
+    if event == "os.system":
+        program = str(args[0]).split(" ", 1)[0]
+    elif event == "subprocess.Popen" and args[0] is None:
+        # shell commands and argv lists both name the program first
+        command = args[1]
+        program = command.split(" ", 1)[0] if isinstance(command, str) else command[0]
+    else:
+        program = args[0]
+    return os.path.basename(os.fsdecode(program)) or "?"
+
+
+def _audit(event: str, args: Tuple[Any, ...]) -> None:
+    profiler = _ACTIVE
+    if profiler is None:
+        return
+    if event in SPAWN_EVENTS:
+        try:
+            name = command_name(event, args)
+        except Exception:
+            name = "?"
+        profiler.add_process(name)
+    elif event == FORK_EVENT:
+        profiler.add_fork()
+
+
+class Span:
+    """A timed region of one thread, shown as a slice in the trace."""
+
+    __slots__ = ("name", "cat", "start", "wall", "cpu", "tid", "args")
+
+    def __init__(
+        self,
+        name: str,
+        cat: str,
+        start: float,
+        wall: float,
+        cpu: float,
+        tid: int,
+        args: Dict[str, Any],
+    ):
+        self.name = name
+        self.cat = cat
+        self.start = start
+        self.wall = wall
+        self.cpu = cpu
+        self.tid = tid
+        self.args = args
+
+
+class Profiler:
+    """
+    Records where a run spends its time: phases, rules and files as spans
+    of wall and thread CPU time, the processes it starts and the peak
+    memory allocated by Python. Processes are counted with audit hooks,
+    which need Python 3.8 or later.
+    """
+
+    def __init__(self, trace_memory: bool = True):
+        self.trace_memory = trace_memory
+        self.spans: List[Span] = []
+        self.processes: Dict[str, int] = {}
+        self.forks = 0
+        # seconds spent per (category, name) and per file
+        self.totals: Dict[Tuple[str, str], List[float]] = {}
+        self.files: Dict[str, float] = {}
+        # (files, rules) of every regex scan, timed per rule afterwards
+        self.regex_work: List[Tuple[List[Path], Dict[str, Dict[str, Any]]]] = []
+        self.peak_memory: Optional[int] = None
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.child_cpu = 0.0
+        self._lock = threading.Lock()
+        self._origin = 0.0
+        self._times = os.times()
+        self._started_tracing = False
+
+    def start(self) -> None:
+        global _ACTIVE, _HOOK_INSTALLED
+        if not _HOOK_INSTALLED and hasattr(sys, "addaudithook"):
+            # audit hooks can't be removed, so one hook serves every profiler
+            sys.addaudithook(_audit)
+            _HOOK_INSTALLED = True
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        self._times = os.times()
+        self._origin = time.perf_counter()
+        _ACTIVE = self
+
+    def stop(self) -> None:
+        global _ACTIVE
+        _ACTIVE = None
+        self.wall = time.perf_counter() - self._origin
+        times = os.times()
+        self.cpu = (times.user + times.system) - (
+            self._times.user + self._times.system
+        )
+        self.child_cpu = (times.children_user + times.children_system) - (
+            self._times.children_user + self._times.children_system
+        )
+        if tracemalloc.is_tracing():
+            self.peak_memory = tracemalloc.get_traced_memory()[1]
+            if self._started_tracing:
+                tracemalloc.stop()
+
+    @contextmanager
+    def span(
+        self, name: str, cat: str = "phase", file: Optional[str] = None
+    ) -> Iterator[None]:
+        """Time the enclosed block as 'name', adding it to the file if given."""
+        start = time.perf_counter()
+        cpu_start = time.thread_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - start
+            cpu = time.thread_time() - cpu_start
+            self.add(name, cat, wall, cpu, start, {"file": file} if file else {})
+            if file is not None:
+                self.add_file(file, wall)
+
+    def add(
+        self,
+        name: str,
+        cat: str,
+        wall: float,
+        cpu: float = 0.0,
+        start: Optional[float] = None,
+        args: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        """Add time to a (category, name) total, and a span if 'start' is given."""
+        with self._lock:
+            total = self.totals.setdefault((cat, name), [0, 0.0, 0.0])
+            total[0] += 1
+            total[1] += wall
+            total[2] += cpu
+            if start is not None:
+                span = Span(
+                    name, cat, start, wall, cpu, threading.get_ident(), args or {}
+                )
+                self.spans.append(span)
+
+    def add_file(self, file: str, wall: float) -> None:
+        with self._lock:
+            self.files[file] = self.files.get(file, 0.0) + wall
+
+    def add_process(self, name: str) -> None:
+        with self._lock:
+            self.processes[name] = self.processes.get(name, 0) + 1
+
+    def add_fork(self) -> None:
+        with self._lock:
+            self.forks += 1
+
+    def add_regex_work(self, files: List[Path], test_str: Dict[str, Any]) -> None:
+        with self._lock:
+            self.regex_work.append((list(files), dict(test_str)))
+
+    def rows(self, cat: str) -> List[Tuple[str, int, float, float]]:
+        """Return (name, calls, wall, CPU) of a category, slowest first."""
+        rows = [
+            (name, int(calls), wall, cpu)
+            for (row_cat, name), (calls, wall, cpu) in self.totals.items()
+            if row_cat == cat
+        ]
+        rows.sort(key=lambda row: row[2], reverse=True)
+        return rows
+
+    def summary(self) -> Dict[str, Any]:
+        """Return the profile as a JSON-serializable dict."""
+
+        def table(cat: str) -> List[Dict[str, Any]]:
+            return [
+                {"name": name, "calls": calls, "wall": wall, "cpu": cpu}
+                for name, calls, wall, cpu in self.rows(cat)
+            ]
+
+        slowest = sorted(self.files.items(), key=lambda item: item[1], reverse=True)
+        return {
+            "wall": self.wall,
+            "cpu": self.cpu,
+            "child_cpu": self.child_cpu,
+            "peak_memory": self.peak_memory,
+            "phases": table("phase"),
+            "rules": {"regex": table("regex"), "shell": table("shell")},
+            "slowest_files": [
+                {"file": file, "wall": wall} for file, wall in slowest[:SLOWEST_FILES]
+            ],
+            "processes": dict(self.processes),
+            "forks": self.forks,
+        }
+
+    def print_summary(self, out: TextIO) -> None:
+        """Print the phases, rules, slowest files and processes as tables."""
+        memory = (
+            f"{self.peak_memory / 2 ** 20:.1f} MB"
+            if self.peak_memory is not None
+            else "not traced"
+        )
+        out.write(
+            f"\nProfile: {self.wall:.3f}s wall, {self.cpu:.3f}s CPU, "
+            + f"{self.child_cpu:.3f}s CPU in child processes, "
+            + f"peak Python memory {memory}\n"
+        )
+        out.write("Phases overlap, and shell rules run on several threads.\n")
+
+        out.write(f"\n{'Phase':<30} {'Calls':>7} {'Wall (s)':>10} {'CPU (s)':>10}\n")
+        for name, calls, wall, cpu in self.rows("phase"):
+            out.write(f"{name:<30} {calls:>7} {wall:>10.3f} {cpu:>10.3f}\n")
+
+        out.write(f"\n{'Rule':<30} {'Kind':>7} {'Calls':>7} {'Wall (s)':>10}\n")
+        for kind in ("regex", "shell"):
+            for name, calls, wall, _ in self.rows(kind):
+                out.write(f"{name:<30} {kind:>7} {calls:>7} {wall:>10.3f}\n")
+        if self.rows("regex"):
+            out.write(
+                "Regex rules are timed one at a time in a separate pass, "
+                + "since the scan runs them together.\n"
+            )
+
+        if self.files:
+            out.write(f"\n{'Slowest files':<60} {'Wall (s)':>10}\n")
+            slowest = sorted(
+                self.files.items(), key=lambda item: item[1], reverse=True
+            )
+            for file, wall in slowest[:SLOWEST_FILES]:
+                out.write(f"{os.path.relpath(file):<60} {wall:>10.3f}\n")
+
+        if hasattr(sys, "addaudithook"):
+            started = sum(self.processes.values())
+            commands = ", ".join(
+                f"{name} {count}"
+                for name, count in sorted(
+                    self.processes.items(), key=lambda item: item[1], reverse=True
+                )
+            )
+            out.write(
+                f"\nProcesses started: {started}"
+                + (f" ({commands})" if commands else "")
+                + f", worker processes forked: {self.forks}\n"
+            )
+        else:
+            out.write("\nProcesses are only counted on Python 3.8 or later.\n")
+
+    def trace_events(self) -> Dict[str, Any]:
+        """
+        Return the spans in the Chrome trace event format, which Perfetto
+        and chrome://tracing open.
+        """
+        pid = os.getpid()
+        threads: Dict[int, int] = {}
+        events: List[Dict[str, Any]] = []
+        for span in sorted(self.spans, key=lambda span: span.start):
+            # small thread ids keep the tracks readable
+            tid = threads.setdefault(span.tid, len(threads))
+            event = {
+                "name": span.name,
+                "cat": span.cat,
+                "ph": "X",
+                "ts": (span.start - self._origin) * 1e6,
+                "dur": span.wall * 1e6,
+                "pid": pid,
+                "tid": tid,
+                "args": dict(span.args, cpu=span.cpu),
+            }
+            events.append(event)
+        for tid in threads.values():
+            name = "main" if tid == 0 else f"worker {tid}"
+            events.append(
+                {
+                    "name": "thread_name",
+                    "ph": "M",
+                    "pid": pid,
+                    "tid": tid,
+                    "args": {"name": name},
+                }
+            )
+        return {
+            "traceEvents": events,
+            "displayTimeUnit": "ms",
+            "otherData": self.summary(),
+        }
+
+    def write_trace(self, path: str) -> None:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.trace_events(), f)
+
+
+@contextmanager
+def phase(name: str, cat: str = "phase", file: Optional[str] = None) -> Iterator[None]:
+    """Time the enclosed block when profiling, and do nothing otherwise."""
+    profiler = _ACTIVE
+    if profiler is None:
+        yield
+        return
+    with profiler.span(name, cat, file):
+        yield
+
+
+@contextmanager
+def profiled(profiler: Optional[Profiler]) -> Iterator[None]:
+    """Profile the enclosed block with 'profiler', if one is given."""
+    if profiler is None:
+        yield
+        return
+    profiler.start()
+    try:
+        with profiler.span("run"):
+            yield
+    finally:
+        profiler.stop()
@@ -0,0 +1,284 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+from pathlib import Path
+from typing import Dict, Any, List, Optional
+
+import pytest
+
+from .results import (
+    FileCounts,
+    Results,
+    merge_file_counts,
+    merge_results,
+    results_from_dict,
+    results_to_dict,
+)
+from .run_tests import (
+    TEST_FILENAME,
+    count_matches,
+    evaluate_files,
+    find_project_root,
+    get_result_cache,
+    get_settings,
+)
+from .abstracted_tests import RatchetSession, get_session, set_session
+
+# key used to hand the shared directory from the xdist controller to workers.
+SHARED_DIR_KEY = "ratchets_shared_dir"
+# key used to hand the project root to workers, so they don't look it up.
+ROOT_KEY = "ratchets_root"
+# shards per worker, so faster workers can pick up more of the scan.
+SHARDS_PER_WORKER = 4
+POLL_SECONDS = 0.05
+# seconds a worker waits for a shard that another worker is evaluating.
+SHARD_TIMEOUT = 600.0
+# shards hold either full results or per-file counts.
+RESULTS = "results"
+COUNTS = "counts"
+
+
+def shard_files(files: List[Path], shards: int) -> List[List[Path]]:
+    """Split files into at most 'shards' contiguous slices of similar length."""
+    shards = max(1, min(shards, len(files)))
+    size, extra = divmod(len(files), shards)
+    slices: List[List[Path]] = []
+    start = 0
+    for idx in range(shards):
+        end = start + size + (1 if idx < extra else 0)
+        slices.append(files[start:end])
+        start = end
+    return slices
+
+
+def pid_alive(pid: int) -> bool:
+    """Return whether a process with 'pid' is still running on this host."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class SharedSession(RatchetSession):
+    """
+    A session whose scan is split across xdist workers. The files are cut
+    into shards, each worker claims unclaimed shards through exclusively
+    created claim files and writes their results to the shared directory,
+    then reads the shards claimed by other workers. Every worker ends up
+    with the same aggregated counts while each file is scanned once. A
+    worker that fails on a shard leaves an error marker, so the others
+    raise instead of waiting for it.
+    """
+
+    def __init__(self, root: str, shared_dir: str, worker: int, workers: int):
+        super().__init__(root)
+        digest = hashlib.sha1(root.encode("utf-8")).hexdigest()[:16]
+        self.shared_dir = os.path.join(shared_dir, digest)
+        self.worker = worker
+        self.workers = max(1, workers)
+
+    def evaluate(
+        self,
+        files: List[Path],
+        regex_tests: Optional[Dict[str, Any]],
+        shell_tests: Optional[Dict[str, Any]],
+    ) -> Results:
+        return merge_results(self.run_shards(RESULTS, files, regex_tests, shell_tests))
+
+    def count(
+        self,
+        files: List[Path],
+        regex_tests: Optional[Dict[str, Any]],
+        shell_tests: Optional[Dict[str, Any]],
+    ) -> FileCounts:
+        parts = self.run_shards(COUNTS, files, regex_tests, shell_tests)
+        return merge_file_counts(parts)
+
+    def run_shards(
+        self,
+        kind: str,
+        files: List[Path],
+        regex_tests: Optional[Dict[str, Any]],
+        shell_tests: Optional[Dict[str, Any]],
+    ) -> List[Any]:
+        """Evaluate unclaimed shards of 'kind' and read the others' shards."""
+        os.makedirs(self.shared_dir, exist_ok=True)
+        shards = shard_files(files, self.workers * SHARDS_PER_WORKER)
+        parts: List[Any] = [None] * len(shards)
+
+        # start at a different shard on every worker to avoid claim races
+        offset = self.worker * len(shards) // self.workers
+        order = [(offset + idx) % len(shards) for idx in range(len(shards))]
+        for idx in order:
+            if self.claim(idx, kind):
+                parts[idx] = self.run_shard(
+                    idx, shards[idx], regex_tests, shell_tests, kind
+                )
+
+        for idx in order:
+            if parts[idx] is None:
+                parts[idx] = self.wait_for_shard(
+                    idx, shards[idx], regex_tests, shell_tests, kind
+                )
+        return parts
+
+    def shard_path(self, idx: int, suffix: str, kind: str = RESULTS) -> str:
+        return os.path.join(self.shared_dir, f"{kind}-{idx}{suffix}")
+
+    def claim(self, idx: int, kind: str = RESULTS) -> bool:
+        """Atomically claim a shard, returning False if another worker has it."""
+        try:
+            fd = os.open(
+                self.shard_path(idx, ".claim", kind),
+                os.O_CREAT | os.O_EXCL | os.O_WRONLY,
+            )
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, "w") as f:
+            f.write(str(os.getpid()))
+        return True
+
+    def publish(self, path: str, data: Any) -> None:
+        """Write 'data' as JSON to 'path', so readers never see partial files."""
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    def run_shard(
+        self,
+        idx: int,
+        files: List[Path],
+        regex_tests: Optional[Dict[str, Any]],
+        shell_tests: Optional[Dict[str, Any]],
+        kind: str = RESULTS,
+    ) -> Any:
+        """Evaluate a shard and publish its results for the other workers."""
+        # parallelism comes from the xdist workers, so each shard runs serially
+        settings = get_settings(self.config)
+        cache = get_result_cache(self.root, settings, None)
+        try:
+            if kind == COUNTS:
+                counts = count_matches(files, regex_tests, shell_tests, None, cache)
+                data, part = counts, counts
+            else:
+                results = evaluate_files(files, regex_tests, shell_tests, None, cache)
+                data, part = results_to_dict(results), results
+        except Exception as e:
+            self.publish(self.shard_path(idx, ".error", kind), f"{e!r}")
+            raise
+        self.publish(self.shard_path(idx, ".json", kind), data)
+        return part
+
+    def wait_for_shard(
+        self,
+        idx: int,
+        files: List[Path],
+        regex_tests: Optional[Dict[str, Any]],
+        shell_tests: Optional[Dict[str, Any]],
+        kind: str = RESULTS,
+    ) -> Any:
+        """
+        Read a shard claimed by another worker, taking it over if it died.
+        Raises if that worker failed on it, or after SHARD_TIMEOUT seconds.
+        """
+        path = self.shard_path(idx, ".json", kind)
+        error_path = self.shard_path(idx, ".error", kind)
+        deadline = time.monotonic() + SHARD_TIMEOUT
+        while True:
+            if os.path.exists(path):
+                with open(path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                return data if kind == COUNTS else results_from_dict(data)
+            if os.path.exists(error_path):
+                with open(error_path, "r", encoding="utf-8") as f:
+                    error = json.load(f)
+                raise Exception(f"Another worker failed on shard {idx}: {error}")
+            if not self.claimant_alive(idx, kind):
+                return self.run_shard(idx, files, regex_tests, shell_tests, kind)
+            if time.monotonic() > deadline:
+                raise Exception(
+                    f"Gave up on shard {idx} after waiting {SHARD_TIMEOUT}s "
+                    + "for another worker."
+                )
+            time.sleep(POLL_SECONDS)
+
+    def claimant_alive(self, idx: int, kind: str = RESULTS) -> bool:
+        path = self.shard_path(idx, ".claim", kind)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                content = f.read()
+        except OSError:
+            return False
+        # the claim file is created before the pid is written
+        if not content:
+            return True
+        return pid_alive(int(content))
+
+
+def worker_index(workerid: str) -> int:
+    """Return the numeric index of an xdist worker id such as 'gw3'."""
+    digits = "".join(c for c in workerid if c.isdigit())
+    return int(digits) if digits else 0
+
+
+def ratchets_root() -> Optional[str]:
+    """Return the project root if it has a tests.toml, or None outside one."""
+    try:
+        root = find_project_root()
+    except Exception:
+        return None
+    if not os.path.isfile(os.path.join(root, TEST_FILENAME)):
+        return None
+    return root
+
+
+@pytest.hookimpl(optionalhook=True)
+def pytest_configure_node(node) -> None:
+    """
+    Give every xdist worker the same shared directory for shard results.
+    Suites of projects without a tests.toml are left alone.
+    """
+    config = node.config
+    if not hasattr(config, "_ratchets_root"):
+        config._ratchets_root = ratchets_root()
+    if config._ratchets_root is None:
+        return
+    shared_dir = getattr(config, "_ratchets_shared_dir", None)
+    if shared_dir is None:
+        shared_dir = tempfile.mkdtemp(prefix="ratchets-")
+        config._ratchets_shared_dir = shared_dir
+    node.workerinput[SHARED_DIR_KEY] = shared_dir
+    node.workerinput[ROOT_KEY] = config._ratchets_root
+
+
+def pytest_configure(config) -> None:
+    workerinput = getattr(config, "workerinput", None)
+    if workerinput is None or ROOT_KEY not in workerinput:
+        return
+    set_session(
+        SharedSession(
+            workerinput[ROOT_KEY],
+            workerinput[SHARED_DIR_KEY],
+            worker_index(workerinput.get("workerid", "")),
+            int(workerinput.get("workercount", 1)),
+        )
+    )
+
+
+def pytest_unconfigure(config) -> None:
+    shared_dir = getattr(config, "_ratchets_shared_dir", None)
+    if shared_dir is not None:
+        shutil.rmtree(shared_dir, ignore_errors=True)
+
+
+@pytest.fixture(scope="session")
+def ratchet_session() -> RatchetSession:
+    """The shared ratchet session for the current project root."""
+    return get_session()
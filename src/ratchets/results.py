@@ -1,18 +1,111 @@
+import sys
 from datetime import datetime
-from typing import Optional, List
+from typing import Any, Dict, Optional, List, Tuple
 from dataclasses import dataclass
 
 
-@dataclass
 class MatchResult:
-    file: str
-    line: Optional[int]
-    content: str
-    blame_author: Optional[str] = None
-    blame_time: Optional[datetime] = None
+    """
+    A single match. Runs can produce millions of these, so instances use
+    slots instead of a __dict__ and share one interned string per file path.
+    """
+
+    __slots__ = ("file", "line", "content", "blame_author", "blame_time", "column")
+
+    def __init__(
+        self,
+        file: str,
+        line: Optional[int],
+        content: str,
+        blame_author: Optional[str] = None,
+        blame_time: Optional[datetime] = None,
+        column: Optional[int] = None,
+    ):
+        self.file = sys.intern(file) if type(file) is str else file
+        self.line = line
+        self.content = content
+        self.blame_author = blame_author
+        self.blame_time = blame_time
+        self.column = column
+
+    def _fields(self) -> Tuple[Any, ...]:
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __eq__(self, other: object) -> bool:
+        if other.__class__ is not self.__class__:
+            return NotImplemented
+        return self._fields() == other._fields()  # type: ignore[attr-defined]
+
+    __hash__ = None  # type: ignore[assignment]
+
+    def __repr__(self) -> str:
+        fields = ", ".join(
+            f"{name}={value!r}" for name, value in zip(self.__slots__, self._fields())
+        )
+        return f"MatchResult({fields})"
 
 
 @dataclass
 class TestResult:
     name: str
     matches: List[MatchResult]
+
+
+# (regex results, shell results), each keyed by test name.
+Results = Tuple[Dict[str, TestResult], Dict[str, TestResult]]
+# ("regex" or "shell", test name, match) as yielded by streamed evaluation.
+Finding = Tuple[str, str, MatchResult]
+# match counts keyed by test name and then by file.
+FileCounts = Dict[str, Dict[str, int]]
+
+
+def results_to_dict(results: Results) -> Dict[str, Any]:
+    """Convert results to a JSON-serializable dict."""
+    regex_results, shell_results = results
+    return {
+        kind: {
+            name: [[m.file, m.line, m.content, m.column] for m in tr.matches]
+            for name, tr in part.items()
+        }
+        for kind, part in (("regex", regex_results), ("shell", shell_results))
+    }
+
+
+def results_from_dict(data: Dict[str, Any]) -> Results:
+    """Rebuild results written by 'results_to_dict'."""
+    parts = []
+    for kind in ("regex", "shell"):
+        parts.append(
+            {
+                name: TestResult(
+                    name=name,
+                    matches=[
+                        MatchResult(file=file, line=line, content=content, column=col)
+                        for file, line, content, col in found
+                    ],
+                )
+                for name, found in data[kind].items()
+            }
+        )
+    return parts[0], parts[1]
+
+
+def merge_results(parts: List[Results]) -> Results:
+    """Concatenate results in order, keeping every test of every part."""
+    regex_results: Dict[str, TestResult] = {}
+    shell_results: Dict[str, TestResult] = {}
+    for part_regex, part_shell in parts:
+        for merged, part in ((regex_results, part_regex), (shell_results, part_shell)):
+            for name, tr in part.items():
+                merged.setdefault(name, TestResult(name=name, matches=[]))
+                merged[name].matches.extend(tr.matches)
+    return regex_results, shell_results
+
+
+def merge_file_counts(parts: List[FileCounts]) -> FileCounts:
+    """Combine per-file counts of disjoint sets of files."""
+    merged: FileCounts = {}
+    for part in parts:
+        for name, per_file in part.items():
+            merged.setdefault(name, {}).update(per_file)
+    return merged
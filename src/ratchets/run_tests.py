@@ -1,10 +1,44 @@
-from ratchets.results import TestResult, MatchResult
-from ratchets.caching import CachingDatabase, BlameRecord
-import queue
+from ratchets.results import FileCounts, Finding, MatchResult, Results, TestResult
+from ratchets.caching import (
+    CachingDatabase,
+    BlameRecord,
+    ResultCache,
+    CachedMatches,
+    hash_rule,
+)
+from ratchets.discovery import (
+    IgnoreRules,
+    git_python_files,
+    read_patterns,
+    walk_python_files,
+)
+from ratchets.scanning import (
+    STREAM_CHUNK_FILES,
+    build_line_map,
+    count_files,
+    iter_scans,
+    read_text,
+    scan_files,
+    split_lines,
+    time_rules,
+)
+from ratchets.vcs import (
+    changed_files,
+    file_blob_id,
+    head_commit,
+    merge_base,
+    show_file,
+)
+from ratchets.scheduler import Task, interleave, run_tasks
+from ratchets.blame import blame_file, build_blame_index, is_committed
+from ratchets.daemon import query_results
+from ratchets.output import SINKS, write_findings
+from ratchets.profiling import Profiler, phase, profiled
 from datetime import datetime
 import os
+import sys
 import threading
-import pathspec
+import signal
 from datetime import datetime
 from pathlib import Path
 import toml
@@ -12,14 +46,47 @@ import argparse
 import json
 import re
 import subprocess
-from typing import Optional, List, Dict, Tuple, Union, Any
+import tempfile
+from contextlib import contextmanager
+from functools import partial
+from typing import (
+    Optional,
+    List,
+    Dict,
+    Tuple,
+    Union,
+    Any,
+    Callable,
+    FrozenSet,
+    Iterator,
+    Set,
+)
 
 EXCLUDED_FILENAME = "ratchet_excluded.txt"
 IGNORE_FILENAME = ".gitignore"
 RATCHET_FILENAME = "ratchet_values.json"
+# per-file counts are stored next to the totals, e.g. ratchet_values.files.json
+RATCHET_FILES_SUFFIX = ".files.json"
 TEST_FILENAME = "tests.toml"
 CACHING_FILENAME = ".ratchet_blame.db"
+RESULTS_FILENAME = ".ratchet_results.db"
 MAX_THREADS = os.cpu_count() or 1
+# default seconds a shell test may spend on each file, or per file in a batch.
+SHELL_TIMEOUT = 5
+# separates the path from the line content in the output of batched shell tests.
+BATCH_DELIMITER = ":"
+# shell tests print either offending lines or 'path:line[:col][: message]'.
+CONTENT_FORMAT = "content"
+LOCATION_FORMAT = "location"
+SHELL_FORMATS = (CONTENT_FORMAT, LOCATION_FORMAT)
+LOCATION_PATTERN = re.compile(r"(\d+)(?::(\d+))?(?::\s?(.*))?")
+# placeholders in the 'argv' of shell tests run without a shell.
+FILE_PLACEHOLDER = "{file}"
+FILES_PLACEHOLDER = "{files}"
+# most bytes of paths passed in one '{files}' argv, well below ARG_MAX.
+MAX_ARGV_BYTES = 128 * 1024
+# a shell command line, or an argument vector executed directly.
+Command = Union[str, List[str]]
 
 
 def print_diff(current_json: Dict[str, int], previous_json: Dict[str, int]) -> None:
@@ -69,7 +136,7 @@ def get_excludes_path() -> str:
 
 
 def get_file_path(file: Optional[str]) -> str:
-    """Get the path, as a string, for the 'tests.toml' file or return a file path with a matching name to 'file'."""
+    """Return the path of 'file', or of the 'tests.toml' file if no file is given."""
     if file is None or len(file) == 0:
         file = TEST_FILENAME
         root = find_project_root(file)
@@ -78,37 +145,90 @@ def get_file_path(file: Optional[str]) -> str:
 
 
 def get_python_files(
-    directory: Union[str, Path], paths: Optional[List[str]]
+    directory: Union[str, Path],
+    paths: Optional[List[str]],
+    rules: Optional[IgnoreRules] = None,
 ) -> List[Path]:
-    """Return a list of paths for python files in the specified directory."""
+    """
+    Return a list of paths for python files in the specified directory, or
+    the given 'paths'. Paths ignored by 'rules' are left out. Inside a git
+    checkout the files are listed from the git index, otherwise the
+    directory is walked without entering ignored directories.
+    """
+    with phase("discover"):
+        if paths:
+            path_paths = [Path(x) for x in paths]
+            if rules is not None:
+                path_paths = [p for p in path_paths if not rules.is_path_ignored(p)]
+            return path_paths
 
-    if paths:
-        path_paths = [Path(x) for x in paths]
-        return path_paths
+        # git applies .gitignore itself, so it can't list ignored files
+        if rules is not None:
+            files = git_python_files(directory, rules)
+            if files is not None:
+                return files
+        return walk_python_files(directory, rules)
 
-    directory = Path(directory)
-    python_files = set(
-        [path.absolute() for path in directory.rglob("*.py") if not path.is_symlink()]
-    )
-    return list(python_files)
+
+def get_ignore_rules(root: str) -> IgnoreRules:
+    """Return the rules of 'ratchet_excluded.txt' and every .gitignore under root."""
+    excluded = read_patterns(os.path.join(root, EXCLUDED_FILENAME))
+    return IgnoreRules(root, excluded, IGNORE_FILENAME)
 
 
 def filter_excluded_files(
     files: List[Path], excluded_path: str, ignore_path: str
 ) -> List[Path]:
-    """Get a list of paths not excluded by the 'excluded_path' or 'ignore_path'."""
-    patterns = []
-    if os.path.isfile(excluded_path):
-        with open(excluded_path, "r") as f:
-            patterns += f.read().splitlines()
-
-    if os.path.isfile(ignore_path):
-        with open(ignore_path, "r") as f:
-            patterns += f.read().splitlines()
-
-    spec = pathspec.PathSpec.from_lines("gitwildmatch", patterns)
-    files = [f for f in files if not spec.match_file(f)]
-    return files
+    """
+    Get a list of paths not excluded by the 'excluded_path' or 'ignore_path',
+    or by a .gitignore between them and the directory of 'ignore_path'.
+    Paths are matched relative to that directory.
+    """
+    with phase("filter_excluded"):
+        rules = IgnoreRules(
+            os.path.dirname(os.path.abspath(ignore_path)),
+            read_patterns(excluded_path),
+            os.path.basename(ignore_path),
+        )
+        return [f for f in files if not rules.is_path_ignored(f)]
+
+
+def get_settings(config: Dict[str, Any]) -> Dict[str, Any]:
+    """Return the optional 'ratchet.settings' section of a loaded .toml config."""
+    settings = config.get("ratchet", {}).get("settings")
+    return settings or {}
+
+
+def load_tests(
+    path: str, cmd_only: bool, regex_only: bool
+) -> Tuple[
+    Optional[Dict[str, Dict[str, Any]]],
+    Optional[Dict[str, Dict[str, Any]]],
+    Dict[str, Any],
+]:
+    """Load the selected regex tests, shell tests and settings from a .toml file."""
+    with phase("load_config"):
+        config = toml.load(path)
+
+    regex_tests = config.get("ratchet", {}).get("regex")
+    shell_tests = config.get("ratchet", {}).get("shell")
+
+    if not regex_tests or cmd_only:
+        regex_tests = None
+    if not shell_tests or regex_only:
+        shell_tests = None
+    return regex_tests, shell_tests, get_settings(config)
+
+
+def get_result_cache(
+    root: str, settings: Dict[str, Any], use_cache: Optional[bool]
+) -> Optional[ResultCache]:
+    """Open the result cache if enabled by 'use_cache' or the 'cache' setting."""
+    if use_cache is None:
+        use_cache = bool(settings.get("cache", False))
+    if not use_cache:
+        return None
+    return ResultCache(os.path.join(root, RESULTS_FILENAME))
 
 
 def evaluate_tests(
@@ -117,34 +237,421 @@ def evaluate_tests(
     regex_only: bool,
     paths: Optional[List[str]],
     override_filter: bool = False,
+    jobs: Optional[int] = None,
+    use_cache: Optional[bool] = None,
+    since: Optional[str] = None,
 ) -> Tuple[Dict[str, TestResult], Dict[str, TestResult]]:
-    """Runs all requested tests based on the 'path' .toml file."""
+    """
+    Runs all requested tests based on the 'path' .toml file.
+    'jobs' sets the number of regex worker processes and 'use_cache' enables
+    the on-disk result cache, each falling back to the 'jobs' and 'cache'
+    keys in 'ratchet.settings' when not given. If 'since' is a git ref,
+    only files changed since that ref are evaluated.
+    """
     assert os.path.isfile(path)
 
-    config = toml.load(path)
-
-    regex_tests = config.get("ratchet", {}).get("regex")
-    shell_tests = config.get("ratchet", {}).get("shell")
+    regex_tests, shell_tests, settings = load_tests(path, cmd_only, regex_only)
+    if jobs is None:
+        jobs = settings.get("jobs")
 
     root = find_project_root()
-    files = get_python_files(root, paths)
+    cache = get_result_cache(root, settings, use_cache)
 
-    excluded_path = os.path.join(root, EXCLUDED_FILENAME)
-    ignore_path = os.path.join(root, IGNORE_FILENAME)
+    files = select_files(root, paths, override_filter, since)
+    if since is not None and not files:
+        return empty_results(regex_tests, shell_tests)
+    return evaluate_files(files, regex_tests, shell_tests, jobs, cache)
 
-    if not override_filter:
-        files = filter_excluded_files(files, excluded_path, ignore_path)
 
+def select_files(
+    root: str,
+    paths: Optional[List[str]],
+    override_filter: bool = False,
+    since: Optional[str] = None,
+) -> List[Path]:
+    """Return the files to evaluate: 'paths', those changed since 'since' or all."""
+    if since is not None:
+        return get_changed_python_files(root, since, override_filter)
+    rules = None if override_filter else get_ignore_rules(root)
+    return get_python_files(root, paths, rules)
+
+
+def stream_tests(
+    path: str,
+    cmd_only: bool,
+    regex_only: bool,
+    paths: Optional[List[str]],
+    override_filter: bool = False,
+    jobs: Optional[int] = None,
+    since: Optional[str] = None,
+) -> Iterator[Finding]:
+    """
+    Like 'evaluate_tests', but yield each match as soon as its file has been
+    evaluated instead of collecting every result. The result cache is not
+    used, so only matches of the files being evaluated are held in memory.
+    """
+    assert os.path.isfile(path)
+
+    regex_tests, shell_tests, settings = load_tests(path, cmd_only, regex_only)
+    if jobs is None:
+        jobs = settings.get("jobs")
+
+    files = select_files(find_project_root(), paths, override_filter, since)
+    if files:
+        yield from stream_files(files, regex_tests, shell_tests, jobs)
+
+
+def stream_files(
+    files: List[Path],
+    regex_tests: Optional[Dict[str, Dict[str, Any]]],
+    shell_tests: Optional[Dict[str, Dict[str, Any]]],
+    jobs: Optional[int] = None,
+) -> Iterator[Finding]:
+    """
+    Yield ("regex" or "shell", test name, match) for every match. Regex
+    tests scan one file at a time, or stream chunks back from worker
+    processes, and shell tests run on chunks of STREAM_CHUNK_FILES files.
+    """
+    if regex_tests:
+        for file_str, file_matches, _ in iter_scans(files, regex_tests, False, jobs):
+            for name, found in file_matches.items():
+                for lineno, content in found:
+                    yield "regex", name, MatchResult(file_str, lineno, content)
+    if shell_tests:
+        for start in range(0, len(files), STREAM_CHUNK_FILES):
+            chunk = files[start : start + STREAM_CHUNK_FILES]
+            for name, tr in evaluate_shell_tests(chunk, shell_tests).items():
+                for m in tr.matches:
+                    yield "shell", name, m
+
+
+def evaluate_files(
+    files: List[Path],
+    regex_tests: Optional[Dict[str, Dict[str, Any]]],
+    shell_tests: Optional[Dict[str, Dict[str, Any]]],
+    jobs: Optional[int] = None,
+    cache: Optional[ResultCache] = None,
+) -> Tuple[Dict[str, TestResult], Dict[str, TestResult]]:
+    """Evaluate regex and shell tests against an already filtered list of files."""
     regex_issues: Dict[str, TestResult] = {}
     shell_issues: Dict[str, TestResult] = {}
-
-    if regex_tests and not cmd_only:
-        regex_issues = evaluate_regex_tests(files, regex_tests)
-    if shell_tests and not regex_only:
-        shell_issues = evaluate_shell_tests(files, shell_tests)
+    file_lines_map: Optional[Dict[str, Dict[str, List[int]]]] = None
+
+    if cache is not None and files:
+        return evaluate_with_cache(files, regex_tests, shell_tests, cache, jobs)
+
+    if regex_tests:
+        # the shell line lookup reuses the buffers read for the regex scan
+        needs_map = any(needs_line_map(t) for t in (shell_tests or {}).values())
+        file_lines_map = {} if needs_map else None
+        regex_issues = evaluate_regex_tests(files, regex_tests, file_lines_map, jobs)
+    if shell_tests:
+        shell_issues = evaluate_shell_tests(files, shell_tests, file_lines_map)
     return regex_issues, shell_issues
 
 
+def count_tests(
+    path: str,
+    cmd_only: bool,
+    regex_only: bool,
+    paths: Optional[List[str]],
+    override_filter: bool = False,
+    jobs: Optional[int] = None,
+    use_cache: Optional[bool] = None,
+    since: Optional[str] = None,
+) -> FileCounts:
+    """
+    Like 'evaluate_tests', but only count the matches of each test per file.
+    Regex matches are counted without building any match objects.
+    """
+    assert os.path.isfile(path)
+
+    regex_tests, shell_tests, settings = load_tests(path, cmd_only, regex_only)
+    if jobs is None:
+        jobs = settings.get("jobs")
+
+    root = find_project_root()
+    cache = get_result_cache(root, settings, use_cache)
+    files = select_files(root, paths, override_filter, since)
+    return count_matches(files, regex_tests, shell_tests, jobs, cache)
+
+
+def count_matches(
+    files: List[Path],
+    regex_tests: Optional[Dict[str, Dict[str, Any]]],
+    shell_tests: Optional[Dict[str, Dict[str, Any]]],
+    jobs: Optional[int] = None,
+    cache: Optional[ResultCache] = None,
+) -> FileCounts:
+    """
+    Count the matches of every test per file. Regex tests never build their
+    matches, and shell tests only hold those of one chunk of files at a time.
+    Shell tests that need a line lookup get it from the buffers read for
+    the regex count, one chunk at a time. With a result cache, cached
+    matches are counted instead.
+    """
+    if cache is not None and files:
+        results = evaluate_with_cache(files, regex_tests, shell_tests, cache, jobs)
+        return results_to_counts(results)
+
+    counts: FileCounts = {name: {} for name in regex_tests or {}}
+    needs_map = any(needs_line_map(t) for t in (shell_tests or {}).values())
+    shared_reads = bool(regex_tests) and needs_map
+    if regex_tests and files and not shared_reads:
+        counts.update(count_files(files, regex_tests, jobs))
+    for name in shell_tests or {}:
+        counts.setdefault(name, {})
+    if shell_tests:
+        for start in range(0, len(files), STREAM_CHUNK_FILES):
+            chunk = files[start : start + STREAM_CHUNK_FILES]
+            file_lines_map: Optional[Dict[str, Dict[str, List[int]]]] = None
+            if shared_reads:
+                file_lines_map = {}
+                regex_counts = count_files(chunk, regex_tests, jobs, file_lines_map)
+                for name, per_file in regex_counts.items():
+                    counts[name].update(per_file)
+            shell_results = evaluate_shell_tests(chunk, shell_tests, file_lines_map)
+            for name, tr in shell_results.items():
+                per_file = counts[name]
+                for m in tr.matches:
+                    per_file[m.file] = per_file.get(m.file, 0) + 1
+    return counts
+
+
+def empty_results(
+    regex_tests: Optional[Dict[str, Dict[str, Any]]],
+    shell_tests: Optional[Dict[str, Dict[str, Any]]],
+) -> Tuple[Dict[str, TestResult], Dict[str, TestResult]]:
+    """Return results without any matches for every given test."""
+    return (
+        {name: TestResult(name=name, matches=[]) for name in regex_tests or {}},
+        {name: TestResult(name=name, matches=[]) for name in shell_tests or {}},
+    )
+
+
+def get_changed_python_files(
+    root: str, since: str, override_filter: bool = False
+) -> List[Path]:
+    """Return the python files in the working tree that changed since 'since'."""
+    with phase("changed_files"):
+        files = [
+            Path(root, rel).absolute()
+            for rel in changed_files(since, root)
+            if rel.endswith(".py")
+        ]
+    files = [f for f in files if f.is_file() and not f.is_symlink()]
+    if not override_filter:
+        files = filter_excluded_files(
+            files,
+            os.path.join(root, EXCLUDED_FILENAME),
+            os.path.join(root, IGNORE_FILENAME),
+        )
+    return files
+
+
+def evaluate_at_merge_base(
+    root: str,
+    since: str,
+    regex_tests: Optional[Dict[str, Dict[str, Any]]],
+    shell_tests: Optional[Dict[str, Dict[str, Any]]],
+    override_filter: bool = False,
+    jobs: Optional[int] = None,
+    cache: Optional[ResultCache] = None,
+) -> Tuple[Dict[str, TestResult], Dict[str, TestResult]]:
+    """
+    Evaluate the files changed since 'since' as they were at the merge base
+    of 'since' and HEAD. Files are checked out into a temporary directory,
+    so reported paths are not meaningful, only the counts are.
+    """
+    with checkout_merge_base(root, since, override_filter) as files:
+        if not files:
+            return empty_results(regex_tests, shell_tests)
+        return evaluate_files(files, regex_tests, shell_tests, jobs, cache)
+
+
+@contextmanager
+def checkout_merge_base(
+    root: str, since: str, override_filter: bool = False
+) -> Iterator[List[Path]]:
+    """
+    Write the files changed since 'since', as they were at the merge base,
+    into a temporary directory that is removed on exit, and yield them.
+    """
+    base = merge_base(since, root)
+    candidates = [
+        Path(root, rel).absolute()
+        for rel in changed_files(since, root)
+        if rel.endswith(".py")
+    ]
+    if not override_filter:
+        candidates = filter_excluded_files(
+            candidates,
+            os.path.join(root, EXCLUDED_FILENAME),
+            os.path.join(root, IGNORE_FILENAME),
+        )
+
+    with tempfile.TemporaryDirectory() as tmp:
+        files: List[Path] = []
+        for candidate in candidates:
+            rel = os.path.relpath(candidate, root)
+            contents = show_file(base, Path(rel).as_posix(), root)
+            if contents is None:
+                continue
+            target = Path(tmp, rel)
+            target.parent.mkdir(parents=True, exist_ok=True)
+            target.write_bytes(contents)
+            files.append(target)
+        yield files
+
+
+def project_counts(
+    current: Dict[str, int], base: Dict[str, int], baseline: Dict[str, int]
+) -> Dict[str, int]:
+    """
+    Project full-repository counts from the counts of changed files now
+    and at the merge base, assuming 'baseline' matched the merge base.
+    """
+    return {
+        name: baseline.get(name, 0) + current.get(name, 0) - base.get(name, 0)
+        for name in current
+    }
+
+
+def count_since(
+    path: str,
+    cmd_only: bool,
+    regex_only: bool,
+    since: str,
+    override_filter: bool = False,
+    jobs: Optional[int] = None,
+    use_cache: Optional[bool] = None,
+    baseline: Optional[Dict[str, int]] = None,
+) -> Dict[str, int]:
+    """
+    Return the counts a full run would produce, evaluating only the files
+    changed since 'since' now and at the merge base.
+    """
+    regex_tests, shell_tests, settings = load_tests(path, cmd_only, regex_only)
+    if jobs is None:
+        jobs = settings.get("jobs")
+
+    root = find_project_root()
+    cache = get_result_cache(root, settings, use_cache)
+
+    files = get_changed_python_files(root, since, override_filter)
+    current = count_matches(files, regex_tests, shell_tests, jobs, cache)
+    with checkout_merge_base(root, since, override_filter) as base_files:
+        base = count_matches(base_files, regex_tests, shell_tests, jobs, cache)
+
+    if baseline is None:
+        baseline = load_ratchet_results()
+    return project_counts(total_counts(current), total_counts(base), baseline)
+
+
+def evaluate_with_cache(
+    files: List[Path],
+    regex_tests: Optional[Dict[str, Dict[str, Any]]],
+    shell_tests: Optional[Dict[str, Dict[str, Any]]],
+    cache: ResultCache,
+    jobs: Optional[int] = None,
+) -> Tuple[Dict[str, TestResult], Dict[str, TestResult]]:
+    """
+    Evaluate tests, serving (file content, rule) pairs from 'cache' when
+    possible. Files with identical contents are only evaluated once, and
+    only rules whose definition changed are re-run on unchanged files.
+    """
+    regex_tests = regex_tests or {}
+    shell_tests = shell_tests or {}
+
+    with phase("cache_lookup"):
+        hashes = cache.content_hashes(files)
+        unique: Dict[str, Path] = {}
+        for file_path in files:
+            unique.setdefault(hashes[str(file_path)], file_path)
+
+        regex_hashes = {name: hash_rule("regex", r) for name, r in regex_tests.items()}
+        shell_hashes = {name: hash_rule("shell", r) for name, r in shell_tests.items()}
+        rule_hashes = list(regex_hashes.values()) + list(shell_hashes.values())
+        found = cache.get_results(unique, rule_hashes)
+    fresh: Dict[Tuple[str, str], CachedMatches] = {}
+
+    def missing_rules(rule_hashes: Dict[str, str]) -> Dict[FrozenSet[str], List[Path]]:
+        """Group representative files by the set of rules they lack results for."""
+        groups: Dict[FrozenSet[str], List[Path]] = {}
+        for content_hash, file_path in unique.items():
+            names = frozenset(
+                name
+                for name, rule_hash in rule_hashes.items()
+                if (content_hash, rule_hash) not in found
+            )
+            if names:
+                groups.setdefault(names, []).append(file_path)
+        return groups
+
+    def record(
+        group: List[Path], results: Dict[str, TestResult], rule_hashes: Dict[str, str]
+    ) -> None:
+        """Store fresh results, including empty ones, for every evaluated pair."""
+        for name in results:
+            for file_path in group:
+                key = (hashes[str(file_path)], rule_hashes[name])
+                fresh[key] = []
+        for name, tr in results.items():
+            for m in tr.matches:
+                key = (hashes[m.file], rule_hashes[name])
+                fresh[key].append((int(m.line or 0), m.content, m.column))
+
+    shell_groups = missing_rules(shell_hashes)
+    # only rules printing line contents need the line lookup map
+    shell_files = {
+        str(f)
+        for names, group in shell_groups.items()
+        if any(needs_line_map(shell_tests[name]) for name in names)
+        for f in group
+    }
+    file_lines_map: Dict[str, Dict[str, List[int]]] = {}
+
+    for names, group in missing_rules(regex_hashes).items():
+        maps: Optional[Dict[str, Dict[str, List[int]]]] = None
+        if any(str(f) in shell_files for f in group):
+            maps = {}
+        subset = {name: regex_tests[name] for name in regex_tests if name in names}
+        record(group, evaluate_regex_tests(group, subset, maps, jobs), regex_hashes)
+        if maps:
+            file_lines_map.update(
+                (f, line_map) for f, line_map in maps.items() if f in shell_files
+            )
+
+    missing_maps = [f for f in shell_files if f not in file_lines_map]
+    file_lines_map.update(build_file_lines_map(missing_maps))
+    for names, group in shell_groups.items():
+        subset = {name: shell_tests[name] for name in shell_tests if name in names}
+        results = evaluate_shell_tests(group, subset, file_lines_map)
+        record(group, results, shell_hashes)
+
+    with phase("cache_save"):
+        cache.save_results(fresh, unique)
+    found.update(fresh)
+
+    def assemble(rule_hashes: Dict[str, str]) -> Dict[str, TestResult]:
+        """Build results for every file, in file order, from cached matches."""
+        results: Dict[str, TestResult] = {}
+        for name, rule_hash in rule_hashes.items():
+            tr = TestResult(name=name, matches=[])
+            for file_path in files:
+                file_str = str(file_path)
+                for line, content, column in found[(hashes[file_str], rule_hash)]:
+                    tr.matches.append(
+                        MatchResult(
+                            file=file_str, line=line, content=content, column=column
+                        )
+                    )
+            results[name] = tr
+        return results
+
+    return assemble(regex_hashes), assemble(shell_hashes)
+
+
 def print_issues(results: Dict[str, TestResult]) -> None:
     """Print TestResult objects in a human-readable way."""
     for test_name, tr in results.items():
@@ -156,7 +663,9 @@ def print_issues(results: Dict[str, TestResult]) -> None:
                 line = m.line
                 content = m.content or ""
                 truncated = content if len(content) <= 50 else content[:50] + "..."
-                if line is not None:
+                if line is not None and m.column is not None:
+                    print(f"  -> {file_path}:{line}:{m.column}: {truncated}")
+                elif line is not None:
                     print(f"  -> {file_path}:{line}: {truncated}")
                 else:
                     print(f"  -> {file_path}: {truncated}")
@@ -182,45 +691,26 @@ def load_ratchet_results(file_location: Optional[str] = None) -> Dict[str, Any]:
 
 
 def evaluate_regex_tests(
-    files: List[Path], test_str: Dict[str, Dict[str, Any]]
+    files: List[Path],
+    test_str: Dict[str, Dict[str, Any]],
+    file_lines_map: Optional[Dict[str, Dict[str, List[int]]]] = None,
+    jobs: Optional[int] = None,
 ) -> Dict[str, TestResult]:
-    """Evaluate a list of regex tests in parallel with one thread per test."""
+    """
+    Evaluate a list of regex tests, reading each file once for all tests.
+    If 'file_lines_map' is given, it is filled with the shell line lookup
+    map built from the same file buffers. 'jobs' greater than one shards
+    the files across that many processes, and 0 uses one per CPU.
+    """
     if not files:
         raise Exception("No files were passed in to be evaluated.")
     if not test_str:
         raise Exception("No regex tests were passed in to be evaluated.")
 
-    results: Dict[str, TestResult] = {}
-    threads = []
-    results_lock = threading.Lock()
-
-    def eval_thread(test_name: str, rule: Dict[str, Any]):
-        """Evaluate a single regular expression across all specified files."""
-        pattern = re.compile(rule["regex"])
-        tr = TestResult(name=test_name, matches=[])
-
-        for file_path in files:
-            with open(file_path, "r", encoding="utf-8") as f:
-                for lineno, line in enumerate(f, 1):
-                    if pattern.search(line):
-                        mr = MatchResult(
-                            file=str(file_path),
-                            line=lineno,
-                            content=line.strip(),
-                        )
-                        tr.matches.append(mr)
-
-        with results_lock:
-            results[test_name] = tr
-
-    for test_name, rule in test_str.items():
-        thread = threading.Thread(target=eval_thread, args=(test_name, rule))
-        thread.start()
-        threads.append(thread)
-
-    for thread in threads:
-        thread.join()
+    results, line_maps = scan_files(files, test_str, file_lines_map is not None, jobs)
 
+    if file_lines_map is not None:
+        file_lines_map.update(line_maps)
     return results
 
 
@@ -232,62 +722,431 @@ def get_ratchet_path() -> str:
 
 
 def evaluate_shell_tests(
-    files: List[Path], test_str: Dict[str, Dict[str, Any]]
+    files: List[Path],
+    test_str: Dict[str, Dict[str, Any]],
+    file_lines_map: Optional[Dict[str, Dict[str, List[int]]]] = None,
+    workers: Optional[int] = None,
 ) -> Dict[str, TestResult]:
-    """Evaluate all shell tests in parallel."""
+    """
+    Evaluate all shell tests on a bounded pool of 'workers' threads, one per CPU
+    by default, optionally reusing a prebuilt line map. Tests run once per
+    file, or once per chunk of files when 'batch' is set. The line map is only
+    built for tests that print line contents rather than locations.
+    """
     if not test_str:
         raise Exception("No shell tests passed to evaluation method.")
     if not files:
         raise Exception("No files passed to evaluation method.")
 
+    options = {
+        test_name: shell_test_options(test_name, test_dict)
+        for test_name, test_dict in test_str.items()
+    }
     results: Dict[str, TestResult] = {
         test_name: TestResult(name=test_name, matches=[]) for test_name in test_str
     }
     lock = threading.Lock()
 
-    file_strs = [str(p) for p in files]
-    file_lines_map: Dict[str, Dict[str, List[int]]] = build_file_lines_map(file_strs)
+    if file_lines_map is None:
+        if any(needs_line_map(test_dict) for test_dict in test_str.values()):
+            file_lines_map = build_file_lines_map([str(p) for p in files])
+        else:
+            file_lines_map = {}
 
-    def worker(test_name: str, shell_template: str, file_path: Path):
-        file_str = str(file_path)
-        cmd_str = f"echo {file_str} | {shell_template}"
-        try:
-            res = subprocess.run(
-                cmd_str, shell=True, text=True, capture_output=True, timeout=5
+    def record(test_name: str, file_str: str, output: List[Any]) -> None:
+        if needs_line_map(test_str[test_name]):
+            matches = match_shell_output(file_str, output, file_lines_map[file_str])
+        else:
+            matches = [
+                MatchResult(file=file_str, line=line, content=message, column=column)
+                for line, column, message in output
+            ]
+        if matches:
+            with lock:
+                results[test_name].matches.extend(matches)
+
+    def worker(test_name: str, test_dict: Dict[str, Any], file_str: str) -> None:
+        timeout = options[test_name]["timeout"]
+        command, input_text = shell_invocation(test_dict, [file_str], False)
+        with phase(test_name, "shell", file_str):
+            output = with_retries(
+                lambda: run_shell_command(command, timeout, input_text),
+                options[test_name]["retries"],
+                f"Timeout while running test '{test_name}' on {file_str}",
+            ).rstrip("\n")
+        if not output:
+            return
+        if needs_line_map(test_dict):
+            record(test_name, file_str, output.splitlines())
+        else:
+            parse = location_parser([file_str])
+            parsed = [parse(line) for line in output.splitlines()]
+            record(test_name, file_str, [loc for path, loc in parsed if path])
+
+    def batch_worker(
+        test_name: str, test_dict: Dict[str, Any], chunk: List[str]
+    ) -> None:
+        timeout = options[test_name]["timeout"] * len(chunk)
+        if needs_line_map(test_dict):
+            delimiter = test_dict.get("delimiter", BATCH_DELIMITER)
+            parse = partial(split_batch_line, paths=set(chunk), delimiter=delimiter)
+        else:
+            parse = location_parser(chunk)
+        command, input_text = shell_invocation(test_dict, chunk, True)
+        with phase(test_name, "shell"):
+            outputs = with_retries(
+                lambda: run_shell_batch(command, input_text, parse, chunk, timeout),
+                options[test_name]["retries"],
+                f"Timeout while running test '{test_name}' on {len(chunk)} files",
+            )
+        for file_str, output in outputs.items():
+            record(test_name, file_str, output)
+
+    def rule_tasks(test_name: str, test_dict: Dict[str, Any]) -> Iterator[Task]:
+        if test_dict.get("batch", False):
+            for chunk in batch_chunks(test_name, test_dict, files):
+                yield test_name, partial(batch_worker, test_name, test_dict, chunk)
+        else:
+            for file_path in files:
+                yield test_name, partial(worker, test_name, test_dict, str(file_path))
+
+    # alternate between rules so a rule at its concurrency limit does not
+    # hold up every worker
+    tasks = interleave(
+        rule_tasks(test_name, test_dict) for test_name, test_dict in test_str.items()
+    )
+    limits = {
+        test_name: opts["max_concurrency"]
+        for test_name, opts in options.items()
+        if opts["max_concurrency"] is not None
+    }
+    with phase("shell"):
+        run_tasks(tasks, workers or MAX_THREADS, limits)
+
+    return results
+
+
+def shell_test_options(test_name: str, test_dict: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Return the scheduling options of a shell test, checking their values:
+    'max_concurrency' (unlimited by default), 'timeout' in seconds per file
+    and the number of 'retries' after a timeout.
+    """
+    output_format = test_dict.get("format", CONTENT_FORMAT)
+    if output_format not in SHELL_FORMATS:
+        raise Exception(
+            f"Unknown format '{output_format}' for shell test '{test_name}', "
+            + f"expected one of {', '.join(SHELL_FORMATS)}."
+        )
+    check_shell_command(test_name, test_dict)
+    max_concurrency = test_dict.get("max_concurrency")
+    timeout = test_dict.get("timeout", SHELL_TIMEOUT)
+    retries = test_dict.get("retries", 0)
+
+    if max_concurrency is not None and (
+        not isinstance(max_concurrency, int) or max_concurrency < 1
+    ):
+        raise Exception(
+            f"'max_concurrency' for shell test '{test_name}' "
+            + "must be a positive integer."
+        )
+    if not isinstance(timeout, (int, float)) or timeout <= 0:
+        raise Exception(
+            f"'timeout' for shell test '{test_name}' must be a positive number."
+        )
+    if not isinstance(retries, int) or retries < 0:
+        raise Exception(
+            f"'retries' for shell test '{test_name}' must be a non-negative integer."
+        )
+    if test_dict.get("batch", False):
+        # checked here so a bad value fails before any command runs
+        batch_chunks(test_name, test_dict, [])
+    return {"max_concurrency": max_concurrency, "timeout": timeout, "retries": retries}
+
+
+def check_shell_command(test_name: str, test_dict: Dict[str, Any]) -> None:
+    """Check a shell test sets one of 'command' or 'argv' with valid placeholders."""
+    if ("command" in test_dict) == ("argv" in test_dict):
+        raise Exception(
+            f"Shell test '{test_name}' must set exactly one of 'command' or 'argv'."
+        )
+    argv = test_dict.get("argv")
+    if argv is None:
+        return
+    if not isinstance(argv, list) or not argv or not all(
+        isinstance(arg, str) for arg in argv
+    ):
+        raise Exception(
+            f"'argv' for shell test '{test_name}' must be a non-empty list of strings."
+        )
+    if test_dict.get("batch", False):
+        if any(FILE_PLACEHOLDER in arg for arg in argv):
+            raise Exception(
+                f"Batched shell test '{test_name}' must use '{FILES_PLACEHOLDER}' "
+                + f"rather than '{FILE_PLACEHOLDER}'."
             )
-            output = res.stdout.strip()
-            if output:
-                lines = output.splitlines()
-                with lock:
-                    tr = results[test_name]
-                    for line in lines:
-                        content = line.rstrip("\n")
-                        line_numbers = file_lines_map[file_str].get(content, [])
-                        if line_numbers:
-                            ln = line_numbers.pop(0)
-                            mr = MatchResult(
-                                file=file_str,
-                                line=ln,
-                                content=content,
-                            )
-                            tr.matches.append(mr)
+    elif FILES_PLACEHOLDER in argv:
+        raise Exception(
+            f"'{FILES_PLACEHOLDER}' in shell test '{test_name}' "
+            + "requires 'batch = true'."
+        )
+
+
+def needs_line_map(test_dict: Dict[str, Any]) -> bool:
+    """Whether a shell test prints line contents that must be looked up."""
+    return test_dict.get("format", CONTENT_FORMAT) == CONTENT_FORMAT
+
+
+def location_parser(paths: List[str]) -> Callable[[str], Tuple[Optional[str], Any]]:
+    """Return a parser of 'path:line[:col][: message]' output for the given files."""
+    known = {os.path.normpath(os.path.abspath(p)): p for p in paths}
+    return partial(parse_location_line, paths=known)
+
+
+def parse_location_line(
+    line: str, paths: Dict[str, str]
+) -> Tuple[Optional[str], Optional[Tuple[int, Optional[int], str]]]:
+    """
+    Parse a line such as flake8, mypy or 'grep -n' print into the file it
+    refers to and its (line, column, message). 'paths' maps normalized
+    absolute paths to the paths passed to the test, so relative output
+    still resolves. Lines about other files give (None, None).
+    """
+    index = line.find(":")
+    while index != -1:
+        match = LOCATION_PATTERN.fullmatch(line, index + 1)
+        if match is not None:
+            file_str = paths.get(os.path.normpath(os.path.abspath(line[:index])))
+            if file_str is not None:
+                lineno, column, message = match.groups()
+                location = (
+                    int(lineno),
+                    int(column) if column is not None else None,
+                    (message or "").strip(),
+                )
+                return file_str, location
+        index = line.find(":", index + 1)
+    return None, None
+
+
+def with_retries(work: Callable[[], Any], retries: int, message: str) -> Any:
+    """Call 'work', retrying after a timeout up to 'retries' times."""
+    for _ in range(retries):
+        try:
+            return work()
         except subprocess.TimeoutExpired:
-            raise Exception(f"Timeout while running test '{test_name}' on {file_path}")
+            pass
+    try:
+        return work()
+    except subprocess.TimeoutExpired:
+        attempts = f" after {retries + 1} attempts" if retries else ""
+        raise Exception(message + attempts)
 
-    threads = []
-    for test_name, test_dict in test_str.items():
-        shell_template = test_dict["command"]
-        for file_path in files:
-            t = threading.Thread(
-                target=worker, args=(test_name, shell_template, file_path)
+
+def shell_invocation(
+    test_dict: Dict[str, Any], chunk: List[str], batch: bool
+) -> Tuple[Command, Optional[str]]:
+    """
+    Return the command to run a shell test on 'chunk' and the text to write
+    to its stdin, if any. A 'command' runs through the shell. An 'argv' is
+    executed directly with '{file}' replaced by the path, or a '{files}'
+    argument replaced by every path in batch mode. Without a placeholder the
+    paths are written to stdin, one per line.
+    """
+    paths_text = "".join(file_str + "\n" for file_str in chunk)
+    argv = test_dict.get("argv")
+    if argv is None:
+        if batch:
+            return test_dict["command"], paths_text
+        return f"echo {chunk[0]} | {test_dict['command']}", None
+
+    command: List[str] = []
+    substituted = False
+    for arg in argv:
+        if batch and arg == FILES_PLACEHOLDER:
+            command.extend(chunk)
+            substituted = True
+        elif not batch and FILE_PLACEHOLDER in arg:
+            # str.replace so braces elsewhere in the argument are left alone
+            command.append(arg.replace(FILE_PLACEHOLDER, chunk[0]))
+            substituted = True
+        else:
+            command.append(arg)
+    return command, None if substituted else paths_text
+
+
+def start_shell(command: Command, has_input: bool) -> subprocess.Popen:
+    """Start a shell test in its own session, through the shell for strings."""
+    try:
+        return subprocess.Popen(
+            command,
+            shell=isinstance(command, str),
+            text=True,
+            stdin=subprocess.PIPE if has_input else subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True,
+        )
+    except FileNotFoundError:
+        raise Exception(f"Command not found: {command[0]}")
+    except OSError as e:
+        name = command if isinstance(command, str) else command[0]
+        raise Exception(f"Could not run {name}: {e}")
+
+
+def run_shell_command(
+    command: Command, timeout: float, input_text: Optional[str] = None
+) -> str:
+    """Run a shell test command, returning its stdout or raising TimeoutExpired."""
+    with start_shell(command, input_text is not None) as proc:
+        try:
+            stdout, _ = proc.communicate(input_text, timeout=timeout)
+        except subprocess.TimeoutExpired:
+            # kill the whole pipeline, or its children keep stdout open
+            kill_process_group(proc)
+            proc.communicate()
+            raise
+    return stdout
+
+
+def match_shell_output(
+    file_str: str, contents: List[str], line_map: Dict[str, List[int]]
+) -> List[MatchResult]:
+    """
+    Map lines printed by a shell test for one file to their line numbers.
+    Repeated lines consume successive line numbers, and lines that do not
+    appear in the file are ignored.
+    """
+    matches: List[MatchResult] = []
+    used: Dict[str, int] = {}
+    for content in contents:
+        line_numbers = line_map.get(content, [])
+        index = used.get(content, 0)
+        if index < len(line_numbers):
+            used[content] = index + 1
+            matches.append(
+                MatchResult(file=file_str, line=line_numbers[index], content=content)
             )
-            t.start()
-            threads.append(t)
+    return matches
 
-    for t in threads:
-        t.join()
 
-    return results
+def batch_chunks(
+    test_name: str, test_dict: Dict[str, Any], files: List[Path]
+) -> List[List[str]]:
+    """
+    Split files into the chunks a batched shell test runs on, 'batch_size'
+    files each, or one chunk per CPU by default. Chunks passed as '{files}'
+    arguments are split further so their paths fit in MAX_ARGV_BYTES.
+    """
+    batch_size = test_dict.get("batch_size")
+    if batch_size is None:
+        batch_size = max(1, -(-len(files) // MAX_THREADS))
+    if not isinstance(batch_size, int) or batch_size < 1:
+        raise Exception(
+            f"'batch_size' for shell test '{test_name}' must be a positive integer."
+        )
+    paths = [str(p) for p in files]
+    chunks = [paths[i : i + batch_size] for i in range(0, len(paths), batch_size)]
+    if FILES_PLACEHOLDER not in (test_dict.get("argv") or []):
+        return chunks
+    return [part for chunk in chunks for part in split_by_bytes(chunk)]
+
+
+def split_by_bytes(paths: List[str], limit: int = MAX_ARGV_BYTES) -> List[List[str]]:
+    """Split paths into runs whose encoded lengths, with separators, fit 'limit'."""
+    parts: List[List[str]] = []
+    current: List[str] = []
+    size = 0
+    for path in paths:
+        length = len(os.fsencode(path)) + 1
+        if current and size + length > limit:
+            parts.append(current)
+            current = []
+            size = 0
+        current.append(path)
+        size += length
+    if current:
+        parts.append(current)
+    return parts
+
+
+def split_batch_line(
+    line: str, paths: Set[str], delimiter: str
+) -> Tuple[Optional[str], str]:
+    """
+    Split a line of batched output into the file path and line content.
+    Paths may contain the delimiter, so the prefix must be one of 'paths'.
+    """
+    index = line.find(delimiter)
+    while index != -1:
+        if line[:index] in paths:
+            return line[:index], line[index + len(delimiter) :]
+        index = line.find(delimiter, index + 1)
+    return None, line
+
+
+def run_shell_batch(
+    command: Command,
+    input_text: Optional[str],
+    parse: Callable[[str], Tuple[Optional[str], Any]],
+    chunk: List[str],
+    timeout: float,
+) -> Dict[str, List[Any]]:
+    """
+    Run a batched shell test once for a chunk of files, writing 'input_text'
+    to its stdin. Every line of output is split by 'parse' into a path and a
+    value as it is produced. Raises TimeoutExpired if the command runs for
+    longer than 'timeout' seconds.
+    """
+    outputs: Dict[str, List[Any]] = {file_str: [] for file_str in chunk}
+    timed_out = threading.Event()
+
+    with start_shell(command, input_text is not None) as proc:
+        assert proc.stdout is not None
+        stdin = proc.stdin
+
+        def feed() -> None:
+            # written from a thread so a full stdout pipe can't block stdin
+            if stdin is None or input_text is None:
+                return
+            try:
+                stdin.write(input_text)
+                stdin.close()
+            except (BrokenPipeError, OSError):
+                pass
+
+        def kill() -> None:
+            timed_out.set()
+            kill_process_group(proc)
+
+        writer = threading.Thread(target=feed, daemon=True)
+        timer = threading.Timer(timeout, kill)
+        writer.start()
+        timer.start()
+        try:
+            for line in proc.stdout:
+                file_str, value = parse(line.rstrip("\n"))
+                if file_str is not None:
+                    outputs[file_str].append(value)
+            proc.wait()
+        finally:
+            timer.cancel()
+            writer.join()
+
+    if timed_out.is_set():
+        raise subprocess.TimeoutExpired(command, timeout)
+    return outputs
+
+
+def kill_process_group(proc: subprocess.Popen) -> None:
+    """Kill a shell started in its own session along with its children."""
+    try:
+        if hasattr(os, "killpg"):
+            os.killpg(proc.pid, signal.SIGKILL)
+        else:
+            proc.kill()
+    except OSError:
+        pass
 
 
 def results_to_json(
@@ -308,22 +1167,166 @@ def results_to_json(
     return counts
 
 
+def results_to_file_counts(
+    results: Tuple[Dict[str, TestResult], Dict[str, TestResult]], root: str
+) -> Dict[str, Dict[str, int]]:
+    """Convert test results to counts per test and per file relative to 'root'."""
+    return relative_counts(results_to_counts(results), root)
+
+
+def results_to_counts(
+    results: Tuple[Dict[str, TestResult], Dict[str, TestResult]],
+) -> FileCounts:
+    """Convert test results to counts per test and per file."""
+    file_counts: FileCounts = {}
+    for results_dict in results:
+        for name, tr in results_dict.items():
+            counts = file_counts.setdefault(name, {})
+            for m in tr.matches:
+                counts[m.file] = counts.get(m.file, 0) + 1
+    return file_counts
+
+
+def relative_counts(file_counts: FileCounts, root: str) -> FileCounts:
+    """Key per-file counts by paths relative to 'root' instead."""
+    relative: FileCounts = {}
+    for name, counts in file_counts.items():
+        rel_counts = relative.setdefault(name, {})
+        for file_str, count in counts.items():
+            rel = Path(os.path.relpath(os.path.abspath(file_str), root)).as_posix()
+            rel_counts[rel] = rel_counts.get(rel, 0) + count
+    return relative
+
+
+def total_counts(file_counts: FileCounts) -> Dict[str, int]:
+    """Sum per-file counts into the count of each test."""
+    return {name: sum(counts.values()) for name, counts in file_counts.items()}
+
+
+def get_file_counts_path(ratchet_path: str) -> str:
+    """Return the path of the per-file counts stored next to 'ratchet_path'."""
+    return os.path.splitext(ratchet_path)[0] + RATCHET_FILES_SUFFIX
+
+
+def load_file_counts(path: str) -> Dict[str, Dict[str, int]]:
+    """Load per-file counts, returning an empty dict if none are saved."""
+    if not os.path.isfile(path):
+        return {}
+    with open(path, "r") as file:
+        data = json.load(file)
+    return {
+        name: {f: int(count) for f, count in counts.items()}
+        for name, counts in data.items()
+    }
+
+
+def write_file_counts(path: str, file_counts: Dict[str, Dict[str, int]]) -> None:
+    """Write per-file counts as a sorted map, omitting files without infractions."""
+    data = {
+        name: {f: count for f, count in sorted(counts.items()) if count}
+        for name, counts in file_counts.items()
+    }
+    with open(path, "w") as file:
+        file.write(json.dumps(data, indent=2, sort_keys=True))
+
+
 def update_ratchets(
     test_path: str,
     cmd_mode: bool,
     regex_mode: bool,
     paths: Optional[List[str]],
     override_ratchet_path: Optional[str] = None,
+    jobs: Optional[int] = None,
+    use_cache: Optional[bool] = None,
+    since: Optional[str] = None,
 ) -> None:
-    """Update the current ratchets based on 'test_path'."""
-    results = evaluate_tests(test_path, cmd_mode, regex_mode, paths)
-    results_json = results_to_json(results)
-
+    """
+    Update the current ratchets based on 'test_path'. Counts of tests that
+    were not evaluated (see 'cmd_mode' and 'regex_mode') are kept.
+
+    With 'baseline = "file"' in ratchet.settings, counts are also stored
+    per file, and when 'paths' or 'since' is given only those files are
+    evaluated and the totals are recomputed from the stored counts. Until
+    every evaluated test has stored counts, the whole tree is evaluated
+    instead. Otherwise, if 'since' is a git ref, counts are projected from the
+    files changed since that ref.
+    """
     if override_ratchet_path is None:
         path = get_ratchet_path()
     else:
         path = override_ratchet_path
 
+    all_regex, all_shell, settings = load_tests(test_path, False, False)
+    regex_tests, shell_tests, _ = load_tests(test_path, cmd_mode, regex_mode)
+    configured = list(all_regex or {}) + list(all_shell or {})
+    evaluated = set(regex_tests or {}) | set(shell_tests or {})
+
+    previous = load_ratchet_results(path)
+    counts: Dict[str, int] = {
+        name: int(count)
+        for name, count in previous.items()
+        if name in configured and name not in evaluated
+    }
+
+    if settings.get("baseline", "total") == "file":
+        root = find_project_root()
+        files_path = get_file_counts_path(path)
+        file_counts = load_file_counts(files_path)
+        if any(name not in file_counts for name in evaluated):
+            # a partial update would replace the total with the touched files
+            paths = None
+            since = None
+
+        counted = count_tests(
+            test_path,
+            cmd_mode,
+            regex_mode,
+            paths,
+            jobs=jobs,
+            use_cache=use_cache,
+            since=since,
+        )
+        fresh = relative_counts(counted, root)
+
+        touched: Optional[Set[str]] = None
+        if since is not None:
+            touched = set(changed_files(since, root))
+        elif paths:
+            touched = {
+                Path(os.path.relpath(os.path.abspath(p), root)).as_posix()
+                for p in paths
+            }
+
+        for name in evaluated:
+            kept: Dict[str, int] = {}
+            if touched is not None:
+                previous_counts = file_counts.get(name, {})
+                kept = {f: c for f, c in previous_counts.items() if f not in touched}
+            kept.update(fresh.get(name, {}))
+            file_counts[name] = kept
+
+        file_counts = {n: c for n, c in file_counts.items() if n in configured}
+        write_file_counts(files_path, file_counts)
+        counts.update((name, sum(file_counts[name].values())) for name in evaluated)
+    elif since is not None:
+        counts.update(
+            count_since(
+                test_path,
+                cmd_mode,
+                regex_mode,
+                since,
+                jobs=jobs,
+                use_cache=use_cache,
+                baseline=previous,
+            )
+        )
+    else:
+        counted = count_tests(
+            test_path, cmd_mode, regex_mode, paths, jobs=jobs, use_cache=use_cache
+        )
+        counts.update(total_counts(counted))
+
+    results_json = {name: counts[name] for name in configured if name in counts}
     with open(path, "w") as file:
         file.write(json.dumps(results_json, indent=2))
 
@@ -408,10 +1411,20 @@ def add_blames(
         repo_root = None
 
     db_path = os.path.join(str(repo_root), CACHING_FILENAME)
-    db = CachingDatabase(db_path)
+    with CachingDatabase(db_path) as db:
+        enrich_with_blames(regex_results, shell_results, db, repo_root)
+    return regex_results, shell_results
 
-    new_records: List[BlameRecord] = []
+
+def enrich_with_blames(
+    regex_results: Dict[str, TestResult],
+    shell_results: Dict[str, TestResult],
+    db: CachingDatabase,
+    repo_root: Optional[str],
+) -> None:
+    """Fill in blames from the cache, blaming the remaining lines per file."""
     needs_blame: List[Tuple[MatchResult, str, int, str]] = []
+    located: List[Tuple[MatchResult, str, int, str]] = []
 
     for results_dict in (regex_results, shell_results):
         for _, tr in results_dict.items():
@@ -425,104 +1438,118 @@ def add_blames(
                     continue
                 if line_no is None:
                     raise LookupError(f"No line found matching: {line_content}")
+                located.append((m, file_path, line_no, line_content))
+
+    # cached blames are keyed by the blob id of each file's current contents,
+    # and are looked up for every file at once
+    blob_ids: Dict[str, Optional[str]] = {}
+    cached: Dict[str, Dict[int, BlameRecord]] = {}
+    if repo_root is not None:
+        with phase("blame_cache"):
+            for _, file_path, _, _ in located:
+                if file_path not in blob_ids:
+                    blob_ids[file_path] = file_blob_id(file_path)
+            cached = db.get_many_blob_blames(b for b in blob_ids.values() if b)
+
+    def from_cache(
+        m: MatchResult,
+        file_path: str,
+        line_no: int,
+        cache: Dict[str, Dict[int, BlameRecord]],
+    ) -> bool:
+        blob_id = blob_ids.get(file_path)
+        blame_res = cache.get(blob_id, {}).get(line_no) if blob_id else None
+        if blame_res is None:
+            return False
+        m.blame_author = blame_res.author
+        m.blame_time = (
+            blame_res.timestamp if isinstance(blame_res.timestamp, datetime) else None
+        )
+        return True
+
+    for m, file_path, line_no, line_content in located:
+        if not from_cache(m, file_path, line_no, cached):
+            needs_blame.append((m, file_path, line_no, line_content))
+
+    if needs_blame and repo_root is not None:
+        # uncommitted lines indexed by 'ratchets blame-index' at the current HEAD
+        try:
+            head = head_commit(repo_root)
+        except Exception:
+            head = None
+        if head is not None:
+            missing = {blob_ids.get(file_path) for _, file_path, _, _ in needs_blame}
+            worktree = db.get_worktree_blames(head, (b for b in missing if b))
+            needs_blame = [
+                entry
+                for entry in needs_blame
+                if not from_cache(entry[0], entry[1], entry[2], worktree)
+            ]
+
+    if needs_blame and repo_root is not None:
+        root = repo_root
+        # one git blame per file, covering every line that needs it
+        by_file: Dict[str, Dict[int, List[Tuple[MatchResult, str]]]] = {}
+        for m, file_path, line_no, line_content in needs_blame:
+            lines = by_file.setdefault(file_path, {})
+            lines.setdefault(line_no, []).append((m, line_content))
+
+        def blame_task(file_path: str) -> None:
+            lines = by_file[file_path]
+            try:
+                blames = blame_file(file_path, lines, root)
+            except Exception as e:
+                # the matches are still listed, only without a blame
+                print(
+                    f"Warning: could not blame {os.path.relpath(file_path)}: {e}",
+                    file=sys.stderr,
+                )
+                return
+            records = []
+            for line_no, line_matches in lines.items():
+                found = blames.get(line_no)
+                if found is None:
+                    continue
+                author, parsed_time, commit, _ = found
+                for m, line_content in line_matches:
+                    m.blame_author = author
+                    m.blame_time = parsed_time
+                # uncommitted lines get a real blame once they are committed
+                if not is_committed(commit):
+                    continue
+                records.append(
+                    BlameRecord(
+                        line_content=line_matches[0][1],
+                        line_number=int(line_no),
+                        timestamp=parsed_time,
+                        file_name=file_path,
+                        author=author,
+                        blob_id=blob_ids[file_path],
+                    )
+                )
+            # queued, and written in one transaction when the database closes
+            db.create_or_update_blob_blames(records)
 
-                if repo_root is not None:
-                    blame_res: Optional[BlameRecord] = db.get_blame(line_no, file_path)
-                    if blame_res is not None and blame_res.line_content == line_content:
-                        m.blame_author = blame_res.author
-                        m.blame_time = (
-                            blame_res.timestamp
-                            if isinstance(blame_res.timestamp, datetime)
-                            else None
-                        )
-                        continue
-                needs_blame.append((m, file_path, line_no, line_content))
-
-    if needs_blame:
-        task_q = queue.Queue()
-        for item in needs_blame:
-            task_q.put(item)
-
-        def worker():
-            while True:
-                try:
-                    m, file_path, line_no, line_content = task_q.get(block=False)
-                except queue.Empty:
-                    break
-
-                author: Optional[str] = None
-                parsed_time: Optional[datetime] = None
-
-                if repo_root is not None:
-                    try:
-                        cmd = [
-                            "git",
-                            "blame",
-                            "-L",
-                            f"{line_no},{line_no}",
-                            "--porcelain",
-                            file_path,
-                        ]
-                        res = subprocess.run(
-                            cmd,
-                            capture_output=True,
-                            text=True,
-                            cwd=repo_root,
-                            timeout=5,
-                        )
-                        if res.returncode == 0:
-                            parsed_author: Optional[str] = None
-                            parsed_ts: Optional[datetime] = None
-                            for line in res.stdout.splitlines():
-                                if line.startswith("author "):
-                                    parsed_author = line[len("author ") :].strip()
-                                elif line.startswith("author-time "):
-                                    try:
-                                        ts_int = int(
-                                            line[len("author-time ") :].strip()
-                                        )
-                                        parsed_ts = datetime.fromtimestamp(ts_int)
-                                    except Exception:
-                                        parsed_ts = None
-                                if parsed_author is not None and parsed_ts is not None:
-                                    break
-                            if parsed_author is not None and parsed_ts is not None:
-                                author = parsed_author
-                                parsed_time = parsed_ts
-                                new_records.append(
-                                    BlameRecord(
-                                        line_content=line_content,
-                                        line_number=int(line_no),
-                                        timestamp=parsed_ts,
-                                        file_name=file_path,
-                                        author=parsed_author,
-                                    )
-                                )
-                        else:
-                            print(res.stderr, end="")
-                    except Exception:
-                        pass
-
-                m.blame_author = author
-                m.blame_time = parsed_time
-                task_q.task_done()
-
-        num_tasks = task_q.qsize()
-        num_threads = min(MAX_THREADS, num_tasks) if num_tasks > 0 else 0
-        threads: List[threading.Thread] = []
-        for _ in range(num_threads):
-            t = threading.Thread(target=worker)
-            t.daemon = True
-            t.start()
-            threads.append(t)
-        task_q.join()
-        for t in threads:
-            t.join()
-
-    if new_records:
-        db.create_or_update_blames(new_records)
+        tasks = ((file_path, partial(blame_task, file_path)) for file_path in by_file)
+        with phase("blame"):
+            run_tasks(tasks, min(MAX_THREADS, len(by_file)))
 
-    return regex_results, shell_results
+
+def report_profile(profiler: Profiler, trace_path: Optional[str]) -> None:
+    """
+    Time the regex rules of the profiled run one at a time, then print the
+    profile to stderr and write the trace to 'trace_path' if given.
+    """
+    for files, test_str in profiler.regex_work:
+        rule_times, file_times = time_rules(files, test_str)
+        for name, seconds in rule_times.items():
+            profiler.add(name, "regex", seconds)
+        for file_str, seconds in file_times.items():
+            profiler.add_file(file_str, seconds)
+    profiler.print_summary(sys.stderr)
+    if trace_path is not None:
+        profiler.write_trace(trace_path)
+        print(f"Wrote a trace of the run to {trace_path}.", file=sys.stderr)
 
 
 def expand_paths(file_args: Optional[List[str]]) -> Optional[List[str]]:
@@ -547,8 +1574,35 @@ def expand_paths(file_args: Optional[List[str]]) -> Optional[List[str]]:
     return expanded_paths if expanded_paths else None
 
 
+def add_blame_index_arguments(parser: argparse.ArgumentParser) -> None:
+    """Add the options of 'ratchets blame-index' to its subparser."""
+    parser.add_argument(
+        "--rebuild",
+        action="store_true",
+        help="blame every file again instead of only those changed since the "
+        + "indexed commit",
+    )
+
+
+def blame_index_cli(args: argparse.Namespace) -> None:
+    """Entry point for 'ratchets blame-index', building or updating the index."""
+    repo_root = find_project_root()
+    db_path = os.path.join(str(repo_root), CACHING_FILENAME)
+    with CachingDatabase(db_path) as db:
+        summary = build_blame_index(
+            str(repo_root), db, rebuild=args.rebuild, workers=MAX_THREADS
+        )
+    print(
+        f"Indexed {summary.indexed} file(s) at {summary.commit[:12]}, "
+        + f"{summary.overlaid} with uncommitted changes."
+    )
+
+
 def cli():
     """Primary entry point for CLI usage, providing parsing and function calls."""
+    # imported here since the daemon builds on this module
+    from ratchets.serve import add_serve_arguments, serve_cli
+
     parser = argparse.ArgumentParser(description="Python ratchet testing")
 
     parser.add_argument("-t", "--toml-file", help="specify a .toml file with tests")
@@ -574,19 +1628,27 @@ def cli():
         "-b",
         "--blame",
         action="store_true",
-        help="run an additional git-blame for"
+        help="run an additional git-blame for "
         + "each infraction, ordering results by timestamp",
     )
 
     parser.add_argument(
-        "--clear-cache", action="store_true", help="clear the blame cache"
+        "--clear-cache",
+        action="store_true",
+        help="clear the blame and result caches",
+    )
+
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="evaluate every file even if 'cache' is enabled in ratchet.settings",
     )
 
     parser.add_argument(
         "-m",
         "--max-count",
         type=int,
-        help="maximum infractions to display per test"
+        help="maximum infractions to display per test "
         + "(only applies with --blame; default is 10)",
     )
 
@@ -605,7 +1667,82 @@ def cli():
         help="update ratchets_values.json",
     )
 
+    parser.add_argument(
+        "--since",
+        metavar="REF",
+        help="only evaluate files changed since the git ref REF, comparing "
+        + "them with their contents at the merge base",
+    )
+
+    parser.add_argument(
+        "--format",
+        choices=["text"] + list(SINKS),
+        default="text",
+        help="print every infringing line as JSON Lines, one JSON document or "
+        + "a SARIF log instead of text, writing matches as files finish",
+    )
+
+    parser.add_argument(
+        "-o",
+        "--output",
+        metavar="PATH",
+        help="write the --format output to PATH instead of stdout",
+    )
+
+    parser.add_argument(
+        "--no-daemon",
+        action="store_true",
+        help="evaluate in this process even if 'ratchets serve' is running",
+    )
+
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="print the time spent in each phase, rule and file, the processes "
+        + "started and the peak memory to stderr",
+    )
+
+    parser.add_argument(
+        "--profile-trace",
+        metavar="PATH",
+        help="also write the profile to PATH as a Chrome trace, "
+        + "viewable in Perfetto (implies --profile)",
+    )
+
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        help="number of processes used for regex tests "
+        + "(0 uses one per CPU; defaults to 'jobs' in ratchet.settings or 1)",
+    )
+
+    commands = parser.add_subparsers(dest="command", metavar="COMMAND")
+    add_blame_index_arguments(
+        commands.add_parser(
+            "blame-index",
+            help="build or update the blame index",
+            description="blame every committed .py file once so --blame runs "
+            + "can answer from the cache",
+        )
+    )
+    add_serve_arguments(
+        commands.add_parser(
+            "serve",
+            help="run a daemon that keeps results in memory",
+            description="keep rules, files and results in memory and answer "
+            + "ratchets runs in this project over a Unix socket",
+        )
+    )
+
     args = parser.parse_args()
+    if args.command == "blame-index":
+        blame_index_cli(args)
+        return
+    if args.command == "serve":
+        serve_cli(args)
+        return
+
     file: Optional[str] = args.toml_file
     cmd_mode: bool = args.shell_only
     regex_mode: bool = args.regex_only
@@ -616,6 +1753,15 @@ def cli():
     verbose: bool = args.verbose
     max_count: Optional[int] = args.max_count
     path_files: List[str] = args.files
+    jobs: Optional[int] = args.jobs
+    use_cache: Optional[bool] = False if args.no_cache else None
+    since: Optional[str] = args.since
+    profiler = Profiler() if args.profile or args.profile_trace else None
+    # a daemon only serves full runs of the default tests.toml, and its time
+    # can't be profiled from here
+    use_daemon = not (
+        args.no_daemon or args.no_cache or file or path_files or since or profiler
+    )
 
     paths = expand_paths(path_files)
 
@@ -629,11 +1775,18 @@ def cli():
     if (paths is None or len(paths) == 0) and path_files is not None:
         raise FileNotFoundError("No .py files found in the specified locations.")
 
+    if since is not None and path_files is not None:
+        raise Exception("--since cannot be combined with --files.")
+
     excludes_path = get_excludes_path()
 
+    streaming = args.format != "text"
+    if args.output is not None and not streaming:
+        raise Exception("--output requires --format.")
+
     mutex_options = [
         [cmd_mode, regex_mode, clear_cache],
-        [blame, verbose, update, compare_counts, clear_cache],
+        [blame, verbose, update, compare_counts, clear_cache, streaming],
     ]
 
     for ls in mutex_options:
@@ -643,8 +1796,9 @@ def cli():
     if clear_cache:
         repo_root = find_project_root()
         db_path = os.path.join(str(repo_root), CACHING_FILENAME)
-        db = CachingDatabase(db_path)
-        db.clear_cache()
+        with CachingDatabase(db_path) as db:
+            db.clear_cache()
+        ResultCache(os.path.join(str(repo_root), RESULTS_FILENAME)).clear_cache()
         print("Cache cleared.")
         return
 
@@ -672,39 +1826,99 @@ def cli():
         print("No tests defined...")
         exit()
 
-    if blame:
-        issues = evaluate_tests(test_path, cmd_mode, regex_mode, paths)
-        print_issues_with_blames(issues, max_count)
-    elif compare_counts:
-        issues = evaluate_tests(test_path, cmd_mode, regex_mode, paths)
-        current_json = results_to_json(issues)
-        previous_json = load_ratchet_results()
-        print_diff(current_json, previous_json)
-    elif update:
-        update_ratchets(test_path, cmd_mode, regex_mode, paths)
-        print("Ratchets updated successfully.")
-    elif verbose:
-        issues = evaluate_tests(test_path, cmd_mode, regex_mode, paths)
-        for issue_type in issues:
-            print_issues(issue_type)
-    else:
-        issues = evaluate_tests(test_path, cmd_mode, regex_mode, paths)
-        current_json = results_to_json(issues)
-        print("Current " + str(current_json))
-        previous_json = load_ratchet_results()
-        print("Previous: " + str(previous_json))
-        print("Diffs:")
-        print_diff(current_json, previous_json)
+    def served_results() -> Optional[Results]:
+        """Return the selected results from a running daemon, if one may be used."""
+        if not use_daemon:
+            return None
+        served = query_results(find_project_root())
+        if served is None:
+            return None
+        regex_results, shell_results = served
+        return (
+            {} if cmd_mode else regex_results,
+            {} if regex_mode else shell_results,
+        )
+
+    def evaluate_selected() -> Tuple[Dict[str, TestResult], Dict[str, TestResult]]:
+        """Evaluate the tests selected by the CLI options."""
+        served = served_results()
+        if served is not None:
+            return served
+        return evaluate_tests(
+            test_path,
+            cmd_mode,
+            regex_mode,
+            paths,
+            jobs=jobs,
+            use_cache=use_cache,
+            since=since,
+        )
+
+    def count_selected() -> Dict[str, int]:
+        """Count infractions for the selected tests, projecting if '--since' is set."""
+        if since is not None:
+            return count_since(
+                test_path, cmd_mode, regex_mode, since, jobs=jobs, use_cache=use_cache
+            )
+        served = served_results()
+        if served is not None:
+            return results_to_json(served)
+        # only the counts are needed, so no matches are kept
+        counted = count_tests(
+            test_path, cmd_mode, regex_mode, paths, jobs=jobs, use_cache=use_cache
+        )
+        return total_counts(counted)
+
+    with profiled(profiler):
+        if streaming:
+            regex_tests, shell_tests, _ = load_tests(test_path, cmd_mode, regex_mode)
+            rules = dict(regex_tests or {}, **(shell_tests or {}))
+            findings = stream_tests(
+                test_path, cmd_mode, regex_mode, paths, jobs=jobs, since=since
+            )
+            root = find_project_root()
+            if args.output is None:
+                write_findings(findings, rules, args.format, sys.stdout, root)
+            else:
+                with open(args.output, "w", encoding="utf-8") as out:
+                    write_findings(findings, rules, args.format, out, root)
+        elif blame:
+            issues = evaluate_selected()
+            print_issues_with_blames(issues, max_count)
+        elif compare_counts:
+            current_json = count_selected()
+            previous_json = load_ratchet_results()
+            print_diff(current_json, previous_json)
+        elif update:
+            update_ratchets(
+                test_path,
+                cmd_mode,
+                regex_mode,
+                paths,
+                jobs=jobs,
+                use_cache=use_cache,
+                since=since,
+            )
+            print("Ratchets updated successfully.")
+        elif verbose:
+            issues = evaluate_selected()
+            for issue_type in issues:
+                print_issues(issue_type)
+        else:
+            current_json = count_selected()
+            print("Current " + str(current_json))
+            previous_json = load_ratchet_results()
+            print("Previous: " + str(previous_json))
+            print("Diffs:")
+            print_diff(current_json, previous_json)
+
+    if profiler is not None:
+        report_profile(profiler, args.profile_trace)
 
 
 def process_file(file_path: str) -> Dict[str, List[int]]:
     """Read a file and build a map."""
-    file_map: Dict[str, List[int]] = {}
-    with open(file_path, "r", encoding="utf-8") as f:
-        for idx, line in enumerate(f, start=1):
-            normalized = line.rstrip("\n")
-            file_map.setdefault(normalized, []).append(idx)
-    return file_map
+    return build_line_map(split_lines(read_text(file_path)))
 
 
 # After comparing this and a parallelized version, this runs faster.
@@ -715,12 +1929,13 @@ def process_file(file_path: str) -> Dict[str, List[int]]:
 def build_file_lines_map(files: List[str]) -> Dict[str, Dict[str, List[int]]]:
     """Process files serially, returning a dict with line contents."""
     file_lines_map: Dict[str, Dict[str, List[int]]] = {}
-    for fp in files:
-        try:
-            file_map = process_file(fp)
-            file_lines_map[fp] = file_map
-        except Exception as e:
-            raise Exception(f"Error reading {fp}: {e}")
+    with phase("line_maps"):
+        for fp in files:
+            try:
+                file_map = process_file(fp)
+                file_lines_map[fp] = file_map
+            except Exception as e:
+                raise Exception(f"Error reading {fp}: {e}")
     return file_lines_map
 
 
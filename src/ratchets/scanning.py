@@ -0,0 +1,557 @@
+import os
+import re
+import time
+import heapq
+import signal
+import threading
+from bisect import bisect_left
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass
+from pathlib import Path
+from functools import partial
+from typing import (
+    Any,
+    Callable,
+    ContextManager,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Pattern,
+    Tuple,
+    TypeVar,
+    Union,
+)
+
+from ratchets.results import TestResult, MatchResult
+from ratchets.literals import Literals, required_literals, literal_pattern
+from ratchets.profiling import active, phase
+
+# (line number, stripped line content) pairs for a single rule in a single file.
+FileMatches = List[Tuple[int, str]]
+LineMap = Dict[str, List[int]]
+# compact per-file result sent back from worker processes.
+FileScan = Tuple[str, Dict[str, FileMatches], Optional[LineMap]]
+# number of matches of each rule in a single file, and its line map if built.
+FileCount = Tuple[str, Dict[str, int], Optional[LineMap]]
+T = TypeVar("T")
+
+# most files scanned by one worker task, so results stream back as they finish.
+STREAM_CHUNK_FILES = 256
+
+# rules compiled once per worker process by '_init_worker'.
+_WORKER_RULES: Optional["RuleSet"] = None
+
+# line rules are searched line by line, file rules once over the whole buffer.
+LINE_MODE = "line"
+FILE_MODE = "file"
+REGEX_MODES = (LINE_MODE, FILE_MODE)
+
+
+class RuleTimeout(Exception):
+    """Raised when a regex rule runs for longer than its time budget on a file."""
+
+    def __init__(self, rule: str, budget: float, file: Optional[str] = None):
+        super().__init__(rule, budget, file)
+        self.rule = rule
+        self.budget = budget
+        self.file = file
+
+    def __str__(self) -> str:
+        where = f" on {self.file}" if self.file else ""
+        return (
+            f"Regex test '{self.rule}' ran for longer than its time budget "
+            + f"of {self.budget}s{where}."
+        )
+
+
+@contextmanager
+def time_limit(seconds: float, error: Callable[[], Exception]) -> Iterator[None]:
+    """
+    Raise 'error()' in the enclosed block once it has run for 'seconds'.
+    The limit is a SIGALRM timer, so it only applies in the main thread of
+    a process, and does nothing elsewhere. A timer that was already set is
+    resumed afterwards.
+    """
+    if (
+        not hasattr(signal, "setitimer")
+        or threading.current_thread() is not threading.main_thread()
+    ):
+        yield
+        return
+
+    def expire(signum: int, frame: Any) -> None:
+        raise error()
+
+    previous = signal.signal(signal.SIGALRM, expire)
+    start = time.monotonic()
+    outer, _ = signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        # the alarm may go off before it is disarmed, and the handler must be
+        # restored even then
+        try:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+        finally:
+            signal.signal(signal.SIGALRM, previous)
+            if outer:
+                remaining = outer - (time.monotonic() - start)
+                signal.setitimer(signal.ITIMER_REAL, max(remaining, 1e-6))
+
+
+@dataclass
+class CompiledRule:
+    name: str
+    pattern: Pattern[str]
+    literals: Optional[Literals] = None
+    literal_search: Optional[Pattern[str]] = None
+    mode: str = LINE_MODE
+    # seconds the rule may run on one file, see 'time_limit'.
+    time_budget: Optional[float] = None
+
+    def budget(self) -> ContextManager[None]:
+        """Limit the enclosed block to the rule's time budget, if it has one."""
+        if self.time_budget is None:
+            return nullcontext()
+        error = partial(RuleTimeout, self.name, self.time_budget)
+        return time_limit(self.time_budget, error)
+
+    def may_match(self, line: str) -> bool:
+        """Return False only if the line cannot contain a match."""
+        if self.literal_search is not None:
+            return self.literal_search.search(line) is not None
+        return any(lit in line for lit in self.literals or ())
+
+
+class RuleSet:
+    """
+    Compiled regex rules with a shared literal prefilter.
+    Line rules with required literals only run on lines where the combined
+    literal matcher finds something, the rest run on every line. File rules
+    are kept apart and run once over each file's buffer.
+    """
+
+    def __init__(self, rules: List[CompiledRule]):
+        self.rules = rules
+        self.file_rules = [rule for rule in rules if rule.mode == FILE_MODE]
+        line_rules = [rule for rule in rules if rule.mode == LINE_MODE]
+        self.fallback = [rule for rule in line_rules if not rule.literals]
+        self.filtered = [rule for rule in line_rules if rule.literals]
+
+        sensitive = set()
+        insensitive = set()
+        for rule in self.filtered:
+            if rule.literal_search is not None:
+                insensitive.update(rule.literals or ())
+            else:
+                sensitive.update(rule.literals or ())
+
+        alternatives = []
+        if sensitive:
+            alternatives.append(literal_pattern(sensitive).pattern)
+        if insensitive:
+            alternatives.append("(?i:" + literal_pattern(insensitive).pattern + ")")
+        self.gate: Optional[Pattern[str]] = (
+            re.compile("|".join(alternatives)) if alternatives else None
+        )
+
+    def __iter__(self):
+        return iter(self.rules)
+
+    @property
+    def needs_lines(self) -> bool:
+        """Whether any rule has to be evaluated line by line."""
+        return bool(self.fallback or self.filtered)
+
+
+def compile_regex_rules(test_str: Dict[str, Dict[str, Any]]) -> RuleSet:
+    """Compile every regex rule once so files can be scanned in a single pass."""
+    rules: List[CompiledRule] = []
+    for test_name, rule in test_str.items():
+        mode = rule.get("mode", LINE_MODE)
+        if mode not in REGEX_MODES:
+            raise Exception(
+                f"Unknown mode '{mode}' for regex test '{test_name}', "
+                + f"expected one of {', '.join(REGEX_MODES)}."
+            )
+        time_budget = rule.get("time_budget")
+        if time_budget is not None and (
+            not isinstance(time_budget, (int, float)) or time_budget <= 0
+        ):
+            raise Exception(
+                f"'time_budget' for regex test '{test_name}' must be a positive number."
+            )
+        pattern = re.compile(rule["regex"])
+        literals = required_literals(pattern)
+        literal_search = None
+        if literals and pattern.flags & re.IGNORECASE:
+            literal_search = literal_pattern(
+                literals, pattern.flags & (re.IGNORECASE | re.ASCII)
+            )
+        rules.append(
+            CompiledRule(
+                test_name, pattern, literals, literal_search, mode, time_budget
+            )
+        )
+    return RuleSet(rules)
+
+
+def read_text(file_path: Union[str, Path]) -> str:
+    """Read a file into memory, translating newlines like line iteration does."""
+    with open(file_path, "r", encoding="utf-8") as f:
+        return f.read()
+
+
+def split_lines(text: str) -> List[str]:
+    """Split 'text' on newlines, keeping the newline on every line that has one."""
+    lines = text.split("\n")
+    last = lines.pop()
+    result = [line + "\n" for line in lines]
+    if last:
+        result.append(last)
+    return result
+
+
+def matching_lines(lines: List[str], rules: RuleSet) -> Dict[str, List[int]]:
+    """Return the numbers of the lines each line rule matches in a single file."""
+    matches: Dict[str, List[int]] = {}
+    for rule in rules.fallback:
+        search = rule.pattern.search
+        with rule.budget():
+            found = [lineno for lineno, line in enumerate(lines, 1) if search(line)]
+        if found:
+            matches[rule.name] = found
+
+    if rules.gate is None:
+        return matches
+
+    gate = rules.gate.search
+    candidates = [(lineno, line) for lineno, line in enumerate(lines, 1) if gate(line)]
+    if not candidates:
+        return matches
+
+    for rule in rules.filtered:
+        search = rule.pattern.search
+        may_match = rule.may_match
+        with rule.budget():
+            found = [
+                lineno
+                for lineno, line in candidates
+                if may_match(line) and search(line)
+            ]
+        if found:
+            matches[rule.name] = found
+    return matches
+
+
+def scan_lines(lines: List[str], rules: RuleSet) -> Dict[str, FileMatches]:
+    """Run every compiled rule over the lines of a single file."""
+    return {
+        name: [(lineno, lines[lineno - 1].strip()) for lineno in found]
+        for name, found in matching_lines(lines, rules).items()
+    }
+
+
+def newline_offsets(text: str) -> List[int]:
+    """Return the offset of every newline character in 'text'."""
+    offsets: List[int] = []
+    find = text.find
+    pos = find("\n")
+    while pos != -1:
+        offsets.append(pos)
+        pos = find("\n", pos + 1)
+    return offsets
+
+
+def scan_text(text: str, rules: RuleSet) -> Dict[str, FileMatches]:
+    """
+    Run every file rule once over a whole buffer, mapping match offsets to
+    line numbers by binary search over the newline offsets.
+    """
+    matches: Dict[str, FileMatches] = {}
+    offsets: Optional[List[int]] = None
+
+    for rule in rules.file_rules:
+        if rule.literals and not rule.may_match(text):
+            continue
+        found: FileMatches = []
+        with rule.budget():
+            starts = [match.start() for match in rule.pattern.finditer(text)]
+        for match_start in starts:
+            if offsets is None:
+                offsets = newline_offsets(text)
+            # a match at the very end of a newline-terminated file
+            # belongs to the last line rather than an empty one after it
+            index = bisect_left(offsets, match_start)
+            if index == len(offsets) and text.endswith("\n"):
+                index -= 1
+            start = offsets[index - 1] + 1 if index else 0
+            end = offsets[index] if index < len(offsets) else len(text)
+            found.append((index + 1, text[start:end].strip()))
+        if found:
+            matches[rule.name] = found
+    return matches
+
+
+def count_text(text: str, rules: RuleSet) -> Dict[str, int]:
+    """Count the matches of every file rule in a whole buffer."""
+    counts: Dict[str, int] = {}
+    for rule in rules.file_rules:
+        if rule.literals and not rule.may_match(text):
+            continue
+        with rule.budget():
+            found = sum(1 for _ in rule.pattern.finditer(text))
+        if found:
+            counts[rule.name] = found
+    return counts
+
+
+def build_line_map(lines: List[str]) -> LineMap:
+    """Map each line's content (without newline) to the line numbers it appears on."""
+    line_map: LineMap = {}
+    for idx, line in enumerate(lines, start=1):
+        line_map.setdefault(line.rstrip("\n"), []).append(idx)
+    return line_map
+
+
+def resolve_jobs(jobs: Optional[int]) -> int:
+    """Return the worker count to use, where 0 or less means one per CPU."""
+    if jobs is None:
+        return 1
+    if jobs <= 0:
+        return os.cpu_count() or 1
+    return jobs
+
+
+def partition_files(files: List[Path], chunks: int) -> List[List[Path]]:
+    """Split files into 'chunks' lists of similar total size, largest files first."""
+    sized = []
+    for file_path in files:
+        try:
+            size = os.path.getsize(file_path)
+        except OSError:
+            size = 0
+        sized.append((size, file_path))
+    sized.sort(key=lambda item: item[0], reverse=True)
+
+    bins: List[List[Path]] = [[] for _ in range(chunks)]
+    heap = [(0, idx) for idx in range(chunks)]
+    for size, file_path in sized:
+        load, idx = heapq.heappop(heap)
+        bins[idx].append(file_path)
+        heapq.heappush(heap, (load + size, idx))
+    return [b for b in bins if b]
+
+
+def stream_chunks(files: List[Path], workers: int) -> List[List[Path]]:
+    """
+    Split files into chunks of similar total size for 'workers' processes,
+    none of them holding more than STREAM_CHUNK_FILES files.
+    """
+    chunk_count = (len(files) + STREAM_CHUNK_FILES - 1) // STREAM_CHUNK_FILES
+    # bins balanced by size can hold many small files, so they are split again
+    return [
+        chunk[start : start + STREAM_CHUNK_FILES]
+        for chunk in partition_files(files, max(workers, chunk_count))
+        for start in range(0, len(chunk), STREAM_CHUNK_FILES)
+    ]
+
+
+def scan_file(file_path: Union[str, Path], rules: RuleSet, build_map: bool) -> FileScan:
+    """Read a single file once and scan it with every rule."""
+    file_str = str(file_path)
+    try:
+        text = read_text(file_path)
+    except Exception as e:
+        raise Exception(f"Error reading {file_str}: {e}")
+
+    try:
+        file_matches = scan_text(text, rules) if rules.file_rules else {}
+        line_map = None
+        if rules.needs_lines or build_map:
+            lines = split_lines(text)
+            file_matches.update(scan_lines(lines, rules))
+            line_map = build_line_map(lines) if build_map else None
+    except RuleTimeout as e:
+        raise RuleTimeout(e.rule, e.budget, file_str) from None
+    return file_str, file_matches, line_map
+
+
+def count_file(
+    file_path: Union[str, Path], rules: RuleSet, build_map: bool = False
+) -> FileCount:
+    """
+    Count the matches of every rule in a single file, without keeping them.
+    With 'build_map', the shell line lookup is built from the same buffer.
+    """
+    file_str = str(file_path)
+    try:
+        text = read_text(file_path)
+    except Exception as e:
+        raise Exception(f"Error reading {file_str}: {e}")
+
+    try:
+        counts = count_text(text, rules) if rules.file_rules else {}
+        line_map = None
+        if rules.needs_lines or build_map:
+            lines = split_lines(text)
+            found = matching_lines(lines, rules)
+            counts.update((name, len(numbers)) for name, numbers in found.items())
+            line_map = build_line_map(lines) if build_map else None
+    except RuleTimeout as e:
+        raise RuleTimeout(e.rule, e.budget, file_str) from None
+    return file_str, counts, line_map
+
+
+def _init_worker(test_str: Dict[str, Dict[str, Any]]) -> None:
+    """Compile the rule set once for this worker process."""
+    global _WORKER_RULES
+    _WORKER_RULES = compile_regex_rules(test_str)
+
+
+def _scan_chunk(chunk: List[Path], work: Callable[[Path, RuleSet], T]) -> List[T]:
+    """Run 'work' on a chunk of files inside a worker process."""
+    assert _WORKER_RULES is not None
+    return [work(file_path, _WORKER_RULES) for file_path in chunk]
+
+
+def iter_files(
+    files: List[Path],
+    test_str: Dict[str, Dict[str, Any]],
+    work: Callable[[Path, RuleSet], T],
+    jobs: Optional[int] = None,
+    rules: Optional[RuleSet] = None,
+) -> Iterator[T]:
+    """
+    Yield 'work' for every file as soon as it is done. Serially, files are
+    yielded in order. With more than one job, files are sharded across a
+    process pool in chunks of at most STREAM_CHUNK_FILES, and chunks are
+    yielded in the order they finish. 'work' must be picklable.
+    """
+    profiler = active()
+    if profiler is not None:
+        profiler.add_regex_work(files, test_str)
+
+    workers = min(resolve_jobs(jobs), len(files))
+    if workers <= 1:
+        if rules is None:
+            rules = compile_regex_rules(test_str)
+        for file_path in files:
+            yield work(file_path, rules)
+        return
+
+    chunks = stream_chunks(files, workers)
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=_init_worker, initargs=(test_str,)
+    ) as executor:
+        futures = [executor.submit(_scan_chunk, chunk, work) for chunk in chunks]
+        for future in as_completed(futures):
+            yield from future.result()
+
+
+def iter_scans(
+    files: List[Path],
+    test_str: Dict[str, Dict[str, Any]],
+    build_maps: bool = False,
+    jobs: Optional[int] = None,
+    rules: Optional[RuleSet] = None,
+) -> Iterator[FileScan]:
+    """Yield the scan of every file as soon as it is done, see 'iter_files'."""
+    work = partial(scan_file, build_map=build_maps)
+    return iter_files(files, test_str, work, jobs, rules)
+
+
+def count_files(
+    files: List[Path],
+    test_str: Dict[str, Dict[str, Any]],
+    jobs: Optional[int] = None,
+    line_maps: Optional[Dict[str, LineMap]] = None,
+) -> Dict[str, Dict[str, int]]:
+    """
+    Count the matches of every rule per file, keyed by rule and then file.
+    No match objects are built, and only files with matches are listed.
+    If 'line_maps' is given, it is filled with the shell line lookup of
+    every file.
+    """
+    counts: Dict[str, Dict[str, int]] = {name: {} for name in test_str}
+    work = partial(count_file, build_map=line_maps is not None)
+    with phase("regex_count"):
+        for file_str, file_counts, line_map in iter_files(
+            files, test_str, work, jobs
+        ):
+            for name, count in file_counts.items():
+                counts[name][file_str] = count
+            if line_maps is not None and line_map is not None:
+                line_maps[file_str] = line_map
+    return counts
+
+
+def time_rules(
+    files: List[Path], test_str: Dict[str, Dict[str, Any]]
+) -> Tuple[Dict[str, float], Dict[str, float]]:
+    """
+    Time every regex rule on its own, returning the seconds spent in each
+    rule and in each file. Each file is read once, and every rule is run
+    over it as a rule set of its own, with its own literal prefilter.
+    """
+    rules = compile_regex_rules(test_str)
+    singles = [(rule.name, RuleSet([rule])) for rule in rules]
+    rule_times: Dict[str, float] = {rule.name: 0.0 for rule in rules}
+    file_times: Dict[str, float] = {}
+    for file_path in files:
+        text = read_text(file_path)
+        lines = split_lines(text)
+        elapsed = 0.0
+        for name, single in singles:
+            start = time.perf_counter()
+            try:
+                if single.file_rules:
+                    scan_text(text, single)
+                else:
+                    matching_lines(lines, single)
+            except RuleTimeout as e:
+                raise RuleTimeout(e.rule, e.budget, str(file_path)) from None
+            seconds = time.perf_counter() - start
+            rule_times[name] += seconds
+            elapsed += seconds
+        file_times[str(file_path)] = elapsed
+    return rule_times, file_times
+
+
+def scan_files(
+    files: List[Path],
+    test_str: Optional[Dict[str, Dict[str, Any]]],
+    build_maps: bool = False,
+    jobs: Optional[int] = None,
+) -> Tuple[Dict[str, TestResult], Dict[str, LineMap]]:
+    """
+    Read each file exactly once, running all regex rules against it.
+    When 'build_maps' is set, the same buffer is used to build the line
+    lookup map needed by shell tests. With more than one job, files are
+    sharded across a process pool.
+    """
+    test_str = test_str or {}
+    rules = compile_regex_rules(test_str)
+    with phase("regex_scan"):
+        scans = list(iter_scans(files, test_str, build_maps, jobs, rules))
+    # keep the output order independent of how files were sharded
+    order = {str(file_path): idx for idx, file_path in enumerate(files)}
+    scans.sort(key=lambda scan: order[scan[0]])
+
+    results: Dict[str, TestResult] = {
+        rule.name: TestResult(name=rule.name, matches=[]) for rule in rules
+    }
+    line_maps: Dict[str, LineMap] = {}
+
+    for file_str, file_matches, line_map in scans:
+        for name, found in file_matches.items():
+            results[name].matches.extend(
+                MatchResult(file=file_str, line=lineno, content=content)
+                for lineno, content in found
+            )
+        if line_map is not None:
+            line_maps[file_str] = line_map
+
+    return results, line_maps
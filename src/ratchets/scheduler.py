@@ -0,0 +1,131 @@
+import threading
+from collections import deque
+from typing import (
+    Callable,
+    Deque,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    TypeVar,
+)
+
+T = TypeVar("T")
+
+# a unit of work and the name of the rule it belongs to.
+Task = Tuple[str, Callable[[], None]]
+# tasks per worker that may be set aside while their rule is at its limit.
+DEFERRED_PER_WORKER = 64
+
+
+def interleave(groups: Iterable[Iterator[T]]) -> Iterator[T]:
+    """Yield from each iterator in turn until all of them are exhausted."""
+    active: List[Iterator[T]] = list(groups)
+    while active:
+        remaining: List[Iterator[T]] = []
+        for group in active:
+            try:
+                item = next(group)
+            except StopIteration:
+                continue
+            remaining.append(group)
+            yield item
+        active = remaining
+
+
+def run_tasks(
+    tasks: Iterator[Task],
+    workers: int,
+    limits: Optional[Dict[str, int]] = None,
+) -> None:
+    """
+    Run tasks on a fixed pool of 'workers' threads. Tasks are pulled from the
+    iterator only when a worker is free, so they are never all in memory at
+    once. 'limits' caps how many tasks of a rule run at the same time; a task
+    whose rule is at its limit is set aside, and the worker runs another
+    task instead of waiting for it. The first error stops the remaining
+    tasks and is raised to the caller.
+    """
+    limits = limits or {}
+    workers = max(1, workers)
+    cond = threading.Condition()
+    stop = threading.Event()
+    errors: List[BaseException] = []
+    running: Dict[str, int] = {}
+    # tasks pulled while their rule was at its limit
+    deferred: Deque[Task] = deque()
+    exhausted = False
+
+    def fail(error: BaseException) -> None:
+        with cond:
+            errors.append(error)
+            stop.set()
+            cond.notify_all()
+
+    def has_slot(name: str) -> bool:
+        limit = limits.get(name)
+        return limit is None or running.get(name, 0) < limit
+
+    def take() -> Optional[Task]:
+        """Return a task whose rule has a free slot, or None if there is none."""
+        nonlocal exhausted
+        for task in deferred:
+            if has_slot(task[0]):
+                deferred.remove(task)
+                return task
+        while not exhausted and len(deferred) < workers * DEFERRED_PER_WORKER:
+            task = next(tasks, None)
+            if task is None:
+                exhausted = True
+            elif has_slot(task[0]):
+                return task
+            else:
+                deferred.append(task)
+        return None
+
+    def next_task() -> Optional[Task]:
+        with cond:
+            while not stop.is_set():
+                task = take()
+                if task is not None:
+                    running[task[0]] = running.get(task[0], 0) + 1
+                    return task
+                if exhausted and not deferred:
+                    return None
+                # every task at hand waits for a running task of its rule
+                cond.wait()
+            return None
+
+    def finished(name: str) -> None:
+        with cond:
+            running[name] -= 1
+            cond.notify_all()
+
+    def worker() -> None:
+        while True:
+            try:
+                task = next_task()
+            except BaseException as e:
+                fail(e)
+                return
+            if task is None:
+                return
+            name, work = task
+            try:
+                work()
+            except BaseException as e:
+                fail(e)
+                return
+            finally:
+                finished(name)
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(workers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    if errors:
+        raise errors[0]
@@ -0,0 +1,294 @@
+import os
+import time
+import signal
+import argparse
+import threading
+import socketserver
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from ratchets.abstracted_tests import RatchetSession
+from ratchets.daemon import (
+    make_socket_dir,
+    read_message,
+    request,
+    send_message,
+    socket_path,
+)
+from ratchets.results import Results, results_to_dict
+from ratchets.run_tests import (
+    EXCLUDED_FILENAME,
+    IGNORE_FILENAME,
+    TEST_FILENAME,
+    empty_results,
+    find_project_root,
+    results_to_json,
+)
+
+# seconds between checks for changed files while idle.
+POLL_INTERVAL = 1.0
+# seconds after which files are discovered again, even if no directory changed.
+RESCAN_INTERVAL = 60.0
+
+# (modification time, size, inode) of a file, or None if it doesn't exist.
+Stamp = Optional[Tuple[int, int, int]]
+
+
+def stat_stamp(path: str) -> Stamp:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+
+def tree_stamps(root: str, files: List[Path]) -> Dict[str, Stamp]:
+    """
+    Stamp the directories holding 'files' and their parents up to 'root',
+    the .gitignore files in them and the git index. A file added to or
+    removed from one of these directories changes its modification time.
+    """
+    root = os.path.abspath(root)
+    dirs = {root}
+    for f in files:
+        directory = os.path.dirname(os.path.abspath(f))
+        while directory not in dirs and len(directory) > len(root):
+            dirs.add(directory)
+            directory = os.path.dirname(directory)
+    paths = [os.path.join(root, ".git", "index")]
+    for directory in dirs:
+        paths += [directory, os.path.join(directory, ".gitignore")]
+    return {path: stat_stamp(path) for path in paths}
+
+
+class WarmSession(RatchetSession):
+    """
+    A session that stays loaded between runs. The configuration and rules
+    are kept until tests.toml or an exclusion file changes, and results are
+    kept per file, so a refresh only re-evaluates files whose modification
+    time, size or inode changed. Files are only discovered again when a
+    directory holding them, a .gitignore or the git index changed, or
+    every RESCAN_INTERVAL seconds to find files in new directories.
+    """
+
+    use_daemon = False
+
+    def __init__(self, root: str):
+        super().__init__(root)
+        self.lock = threading.RLock()
+        self._config_stamps: Dict[str, Stamp] = {}
+        self._stamps: Dict[str, Stamp] = {}
+        self._per_file: Dict[str, Results] = {}
+        self._tree_stamps: Dict[str, Stamp] = {}
+        self._discovered = 0.0
+
+    def config_paths(self) -> List[str]:
+        names = (TEST_FILENAME, EXCLUDED_FILENAME, IGNORE_FILENAME)
+        return [os.path.join(self.root, name) for name in names]
+
+    def refresh(self) -> List[Path]:
+        """Bring the results up to date, returning the files evaluated again."""
+        with self.lock:
+            config_stamps = {p: stat_stamp(p) for p in self.config_paths()}
+            if config_stamps != self._config_stamps:
+                self._config = None
+                self._stamps = {}
+                self._per_file = {}
+                self._files = None
+                self._config_stamps = config_stamps
+
+            now = time.monotonic()
+            if (
+                self._files is None
+                or now - self._discovered >= RESCAN_INTERVAL
+                or tree_stamps(self.root, self._files) != self._tree_stamps
+            ):
+                self._files = None
+                self._tree_stamps = tree_stamps(self.root, self.files)
+                self._discovered = now
+            files = self.files
+            stamps = {str(f): stat_stamp(str(f)) for f in files}
+            changed = [
+                f
+                for f in files
+                if str(f) not in self._per_file
+                or self._stamps.get(str(f)) != stamps[str(f)]
+            ]
+            self._stamps = stamps
+            for name in set(self._per_file) - set(stamps):
+                del self._per_file[name]
+
+            regex_tests = self.regex_tests or None
+            shell_tests = self.shell_tests or None
+            if changed and (regex_tests or shell_tests):
+                self._per_file.update(
+                    split_by_file(
+                        changed, self.evaluate(changed, regex_tests, shell_tests)
+                    )
+                )
+            elif changed:
+                for f in changed:
+                    self._per_file[str(f)] = empty_results(None, None)
+
+            self._results = join_files(
+                [self._per_file[str(f)] for f in files], regex_tests, shell_tests
+            )
+            return changed
+
+    def results(self) -> Results:
+        with self.lock:
+            self.refresh()
+            assert self._results is not None
+            return self._results
+
+    def counts(self) -> Dict[str, int]:
+        return results_to_json(self.results())
+
+
+def split_by_file(files: List[Path], results: Results) -> Dict[str, Results]:
+    """Split results into the results of each file, keeping every test."""
+    regex_results, shell_results = results
+
+    def blank() -> Results:
+        return empty_results(regex_results, shell_results)
+
+    per_file: Dict[str, Results] = {str(f): blank() for f in files}
+    for kind, part in enumerate(results):
+        for name, tr in part.items():
+            for m in tr.matches:
+                per_file.setdefault(m.file, blank())[kind][name].matches.append(m)
+    return per_file
+
+
+def join_files(
+    parts: List[Results],
+    regex_tests: Optional[Dict[str, Any]],
+    shell_tests: Optional[Dict[str, Any]],
+) -> Results:
+    """Concatenate per-file results in file order."""
+    regex_results, shell_results = empty_results(regex_tests, shell_tests)
+    for part_regex, part_shell in parts:
+        for joined, part in ((regex_results, part_regex), (shell_results, part_shell)):
+            for name, tr in part.items():
+                if name in joined:
+                    joined[name].matches.extend(tr.matches)
+    return regex_results, shell_results
+
+
+class RatchetHandler(socketserver.StreamRequestHandler):
+    """Answer one JSON request on a connection."""
+
+    server: "RatchetServer"
+
+    def handle(self) -> None:
+        message = read_message(self.connection)
+        if message is None:
+            return
+        command = message.get("command")
+        response: Dict[str, Any]
+        try:
+            if command == "ping":
+                response = {"root": self.server.session.root, "pid": os.getpid()}
+            elif command == "results":
+                results = self.server.session.results()
+                response = {"results": results_to_dict(results)}
+            elif command == "stop":
+                response = {"stopping": True}
+                threading.Thread(target=self.server.shutdown, daemon=True).start()
+            else:
+                response = {"error": f"Unknown command: {command}"}
+        except Exception as e:
+            response = {"error": str(e)}
+        send_message(self.connection, response)
+
+
+class RatchetServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Serves a warm session for one project root on a Unix socket, polling
+    for changes in the background so results are ready before they are
+    asked for.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, root: str, poll_interval: float = POLL_INTERVAL):
+        self.session = WarmSession(root)
+        self.poll_interval = poll_interval
+        self.path = socket_path(root)
+        make_socket_dir(self.path)
+        if os.path.exists(self.path):
+            if request(root, {"command": "ping"}) is not None:
+                raise Exception(f"A ratchets daemon is already serving {root}.")
+            # left behind by a daemon that didn't shut down cleanly
+            os.unlink(self.path)
+        super().__init__(self.path, RatchetHandler)
+        self._stop = threading.Event()
+        self._poller = threading.Thread(target=self.poll, daemon=True)
+
+    def poll(self) -> None:
+        while not self._stop.wait(self.poll_interval):
+            try:
+                self.session.refresh()
+            except Exception:
+                # reported to the client on its next request instead
+                pass
+
+    def serve_forever(self, poll_interval: float = 0.5) -> None:
+        self._poller.start()
+        try:
+            super().serve_forever(poll_interval)
+        finally:
+            self._stop.set()
+
+    def server_close(self) -> None:
+        super().server_close()
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def serve(root: str, poll_interval: float = POLL_INTERVAL) -> None:
+    """Run a daemon for 'root' until it is stopped or interrupted."""
+    server = RatchetServer(root, poll_interval)
+
+    def terminate(signum: int, frame: Any) -> None:
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, terminate)
+    try:
+        server.session.refresh()
+        print(f"Serving ratchets for {root} on {server.path}")
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def add_serve_arguments(parser: argparse.ArgumentParser) -> None:
+    """Add the options of 'ratchets serve' to its subparser."""
+    parser.add_argument(
+        "--poll-interval",
+        type=float,
+        default=POLL_INTERVAL,
+        help=f"seconds between checks for changed files (default is {POLL_INTERVAL})",
+    )
+    parser.add_argument(
+        "--stop", action="store_true", help="stop the daemon serving this project"
+    )
+
+
+def serve_cli(args: argparse.Namespace) -> None:
+    """Entry point for 'ratchets serve'."""
+    if args.poll_interval <= 0:
+        raise Exception("--poll-interval must be positive.")
+
+    root = find_project_root()
+    if args.stop:
+        if request(root, {"command": "stop"}) is None:
+            print("No ratchets daemon is running.")
+        else:
+            print("Stopped the ratchets daemon.")
+        return
+    serve(root, args.poll_interval)
@@ -1,24 +1,69 @@
+import os
 import re
+import time
 import toml
+import random
 import argparse
-from typing import Dict, Any, Optional
+from dataclasses import dataclass, field
+from functools import lru_cache, partial
+from pathlib import Path
+from typing import Dict, Any, Iterable, List, Optional, Pattern, Set
 from .run_tests import (
+    find_project_root,
     get_file_path,
+    get_ignore_rules,
+    get_python_files,
 )
+from .scanning import RuleTimeout, time_limit, time_rules
+
+try:
+    from re import _parser as sre_parse  # Python 3.11+
+except ImportError:
+    import sre_parse  # type: ignore
+
+# files of the project each rule is benchmarked on.
+SAMPLE_FILES = 200
+# length of each adversarial input, enough for quadratic backtracking to show.
+ADVERSARIAL_LENGTH = 2000
+# seconds a rule without a 'time_budget' may take on one input.
+DEFAULT_BUDGET = 1.0
+# characters every rule is tried on, besides those in its pattern.
+ADVERSARIAL_CHARS = " \ta0#_."
+# most characters taken from one pattern.
+MAX_PATTERN_CHARS = 16
+
+_REPEATS = {sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT}
+_CATEGORY_CHARS = {
+    sre_parse.CATEGORY_DIGIT: "0",
+    sre_parse.CATEGORY_SPACE: " ",
+    sre_parse.CATEGORY_WORD: "a",
+}
+
+
+@lru_cache(maxsize=None)
+def compile_regex(regex: str) -> Pattern[str]:
+    """Compile a regex once, however many examples it is checked against."""
+    return re.compile(regex)
 
 
 def evaluate_single_regex(regex: str, input_str: str) -> Optional[re.Match[str]]:
     """Evaluate a single regexp based on 'input_str'."""
-    pattern = re.compile(regex)
-    return pattern.search(input_str)
+    return compile_regex(regex).search(input_str)
+
+
+def example_inputs(rule: Dict[str, Any], example: str) -> List[str]:
+    """Split an example the same way files are evaluated for the rule's mode."""
+    if rule.get("mode") == "file":
+        return [example]
+    return example.splitlines()
 
 
 def check_valid(regex_tests: Dict[str, Dict[str, Any]]) -> None:
-    """Given a dict of regex test and strings, returns if none of the regexps match their strings."""
+    """Raise if any regex matches one of its valid examples."""
     for test in regex_tests:
         regex: str = regex_tests[test]["regex"]
         for validation in regex_tests[test]["valid"]:
-            for line in validation.splitlines():
+            for line in example_inputs(regex_tests[test], validation):
                 if evaluate_single_regex(regex, line):
                     raise Exception(f"Regex: {regex} matched {line}")
 
@@ -29,15 +74,194 @@ def check_invalid(regex_tests: Dict[str, Dict[str, Any]]) -> None:
         regex: str = regex_tests[test]["regex"]
         for validation in regex_tests[test]["invalid"]:
             found: bool = False
-            for line in validation.splitlines():
+            for line in example_inputs(regex_tests[test], validation):
                 if evaluate_single_regex(regex, line):
                     found = True
             if not found:
                 raise Exception(f"Regex: {regex} not matched in {validation}")
 
 
-def validate(filename: Optional[str]) -> None:
-    """Verify the given file's example expressions match the regexps."""
+def _subpatterns(op: Any, av: Any) -> List[Any]:
+    """Return the parsed sequences nested in one regex item."""
+    if op in _REPEATS:
+        return [av[2]]
+    if op is sre_parse.SUBPATTERN:
+        return [av[-1]]
+    if op is sre_parse.BRANCH:
+        return list(av[1])
+    if op in (sre_parse.ASSERT, sre_parse.ASSERT_NOT):
+        return [av[1]]
+    if op is sre_parse.GROUPREF_EXISTS:
+        return [p for p in av[1:] if p is not None]
+    return []
+
+
+def _has_nested_repeat(items: Iterable, repeated: bool) -> bool:
+    for op, av in items:
+        inner = repeated
+        # fixed counts like 'a{2}' can only match one way
+        if op in _REPEATS and av[1] > 1 and av[1] != av[0]:
+            if repeated:
+                return True
+            inner = True
+        # atomic groups and possessive repeats never backtrack into themselves,
+        # so they are not followed
+        if any(_has_nested_repeat(p, inner) for p in _subpatterns(op, av)):
+            return True
+    return False
+
+
+def has_nested_quantifier(regex: str) -> bool:
+    """
+    Whether a repetition in 'regex' repeats something that is itself
+    repeated, like '(a+)+' or '(\\w+\\s?)*'. Such patterns can backtrack
+    exponentially on inputs that almost match.
+    """
+    return _has_nested_repeat(sre_parse.parse(regex), False)
+
+
+def pattern_chars(regex: str) -> List[str]:
+    """Return characters that 'regex' matches literally or in a class."""
+    chars: Set[str] = set()
+
+    def collect(items: Iterable) -> None:
+        for op, av in items:
+            if op is sre_parse.LITERAL:
+                chars.add(chr(av))
+            elif op is sre_parse.ANY:
+                chars.add("a")
+            elif op is sre_parse.IN:
+                for in_op, in_av in av:
+                    if in_op is sre_parse.LITERAL:
+                        chars.add(chr(in_av))
+                    elif in_op is sre_parse.RANGE:
+                        chars.add(chr(in_av[0]))
+                    elif in_op is sre_parse.CATEGORY and in_av in _CATEGORY_CHARS:
+                        chars.add(_CATEGORY_CHARS[in_av])
+            for sub in _subpatterns(op, av):
+                collect(sub)
+
+    collect(sre_parse.parse(regex))
+    return sorted(chars)[:MAX_PATTERN_CHARS]
+
+
+def adversarial_inputs(regex: str, length: int = ADVERSARIAL_LENGTH) -> List[str]:
+    """
+    Return inputs that make backtracking patterns slow: long runs of one
+    character the pattern matches, followed by a character that makes the
+    match fail at the very end.
+    """
+    chars = sorted(set(pattern_chars(regex)) | set(ADVERSARIAL_CHARS))
+    inputs = [c * length + "\x00" for c in chars]
+    inputs.append("".join(chars) * (length // len(chars)) + "\x00")
+    return inputs
+
+
+@dataclass
+class RuleReport:
+    """How fast a regex rule is, and why it may be slow."""
+
+    name: str
+    nested_quantifier: bool
+    # seconds on the sample of the project, and the bytes it holds
+    sample_seconds: float = 0.0
+    sample_bytes: int = 0
+    # the slowest adversarial input, and how long the rule took on it
+    worst_seconds: float = 0.0
+    worst_input: Optional[str] = None
+    timeouts: List[str] = field(default_factory=list)
+
+    @property
+    def throughput(self) -> Optional[float]:
+        """Megabytes of the sample scanned per second."""
+        if not self.sample_bytes or not self.sample_seconds:
+            return None
+        return self.sample_bytes / self.sample_seconds / 2 ** 20
+
+
+def sample_files(root: str, count: int = SAMPLE_FILES, seed: int = 0) -> List[Path]:
+    """Return up to 'count' of the project's files, the same ones every time."""
+    files = get_python_files(root, None, get_ignore_rules(root))
+    if len(files) <= count:
+        return files
+    return sorted(random.Random(seed).sample(files, count))
+
+
+def benchmark_rule(
+    name: str, rule: Dict[str, Any], files: List[Path]
+) -> RuleReport:
+    """
+    Time a regex rule on 'files' and on adversarial inputs. Each file and
+    input may take the rule's 'time_budget', or DEFAULT_BUDGET seconds,
+    before it is stopped and recorded as a timeout.
+    """
+    regex = rule["regex"]
+    budget = rule.get("time_budget", DEFAULT_BUDGET)
+    report = RuleReport(name, has_nested_quantifier(regex))
+
+    try:
+        rule_times, _ = time_rules(files, {name: dict(rule, time_budget=budget)})
+        report.sample_seconds = rule_times[name]
+        report.sample_bytes = sum(os.path.getsize(f) for f in files)
+    except RuleTimeout as e:
+        report.timeouts.append(os.path.relpath(e.file) if e.file else "the sample")
+
+    pattern = compile_regex(regex)
+    search = pattern.search if rule.get("mode") != "file" else pattern.findall
+    for text in adversarial_inputs(regex):
+        shown = repr(text[:8]) + f" * {len(text) - 1}"
+        start = time.perf_counter()
+        try:
+            with time_limit(budget, partial(RuleTimeout, name, budget)):
+                search(text)
+        except RuleTimeout:
+            report.timeouts.append(shown)
+            # the other inputs would most likely time out as well
+            break
+        seconds = time.perf_counter() - start
+        if seconds > report.worst_seconds:
+            report.worst_seconds = seconds
+            report.worst_input = shown
+    return report
+
+
+def print_reports(reports: List[RuleReport]) -> None:
+    """Print the throughput of each rule and any warnings about it."""
+    print(f"{'Rule':<30} {'MB/s':>10} {'Worst input (s)':>16}")
+    for report in reports:
+        throughput = report.throughput
+        shown = f"{throughput:.1f}" if throughput is not None else "-"
+        print(f"{report.name:<30} {shown:>10} {report.worst_seconds:>16.4f}")
+    for report in reports:
+        if report.nested_quantifier:
+            print(
+                f"Warning: '{report.name}' repeats a repeated expression, "
+                + "which can backtrack exponentially."
+            )
+        for where in report.timeouts:
+            print(f"Warning: '{report.name}' ran out of time on {where}.")
+
+
+def lint_rules(
+    regex_tests: Dict[str, Dict[str, Any]], files: List[Path]
+) -> List[RuleReport]:
+    """Benchmark every rule, raising if any of them ran out of time."""
+    reports = [benchmark_rule(name, rule, files) for name, rule in regex_tests.items()]
+    print_reports(reports)
+    slow = [report.name for report in reports if report.timeouts]
+    if slow:
+        raise Exception(
+            f"Regex tests ran out of time and could stall a scan: {', '.join(slow)}. "
+            + "Rewrite them, or raise their 'time_budget' if they are only slow."
+        )
+    return reports
+
+
+def validate(filename: Optional[str], benchmark: bool = True) -> bool:
+    """
+    Verify the given file's example expressions match the regexps, then
+    benchmark each regexp on the project and on adversarial inputs.
+    """
     test_path: str = get_file_path(filename)
     config: Dict[str, Any] = toml.load(test_path)
     regex_tests: Optional[Dict[str, Dict[str, Any]]] = config.get("ratchet", {}).get(
@@ -46,7 +270,7 @@ def validate(filename: Optional[str]) -> None:
 
     if regex_tests is None:
         print("No regex tests found, there is nothing to validate.")
-        return
+        return True
 
     # these will throw errors if not valid otherwise simply return.
     # this allows for stderr to be used, as well as exit
@@ -54,13 +278,21 @@ def validate(filename: Optional[str]) -> None:
 
     check_valid(regex_tests)
     check_invalid(regex_tests)
+    if benchmark:
+        lint_rules(regex_tests, sample_files(find_project_root()))
+    return True
 
 
 if __name__ == "__main__":
     """Entry point to parse CLI inputs and evaluate .toml test file."""
     parser = argparse.ArgumentParser(description="Regex ratchet validation")
     parser.add_argument("-t", "--toml-file")
+    parser.add_argument(
+        "--no-benchmark",
+        action="store_true",
+        help="only check the examples, without timing the regexps",
+    )
     args = parser.parse_args()
     file: Optional[str] = args.toml_file
-    if validate(file):
+    if validate(file, not args.no_benchmark):
         print("Your .toml file is valid!")
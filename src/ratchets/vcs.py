@@ -0,0 +1,148 @@
+import os
+import hashlib
+import tempfile
+import subprocess
+from typing import Dict, Iterator, List, Optional
+
+
+def run_git(args: List[str], cwd: str, timeout: Optional[float] = None) -> str:
+    """Run a git command in 'cwd', returning stdout or raising on failure."""
+    res = subprocess.run(
+        ["git"] + args,
+        cwd=cwd,
+        capture_output=True,
+        text=True,
+        timeout=timeout,
+    )
+    if res.returncode != 0:
+        raise Exception(f"git {' '.join(args)} failed: {res.stderr.strip()}")
+    return res.stdout
+
+
+def merge_base(ref: str, root: str) -> str:
+    """Return the commit where HEAD diverged from 'ref'."""
+    return run_git(["merge-base", ref, "HEAD"], root).strip()
+
+
+def changed_files(ref: str, root: str) -> List[str]:
+    """
+    Return paths, relative to 'root', that differ between 'ref' and the
+    working tree. This is 'git diff ref...HEAD' plus uncommitted changes.
+    Renames are reported as a deletion and an addition.
+    """
+    diff = ["diff", "--name-only", "--no-renames", "--relative", "-z"]
+    committed = run_git(diff + [f"{ref}...HEAD"], root)
+    uncommitted = run_git(diff + ["HEAD"], root)
+    untracked = run_git(["ls-files", "--others", "--exclude-standard", "-z"], root)
+
+    paths = set()
+    for output in (committed, uncommitted, untracked):
+        paths.update(p for p in output.split("\0") if p)
+    return sorted(paths)
+
+
+def show_file(rev: str, path: str, root: str) -> Optional[bytes]:
+    """
+    Return the contents of 'path', relative to 'root', at 'rev', or None if
+    it does not exist there.
+    """
+    res = subprocess.run(
+        ["git", "show", f"{rev}:./{path}"],
+        cwd=root,
+        capture_output=True,
+    )
+    if res.returncode != 0:
+        return None
+    return res.stdout
+
+
+def hash_blob(data: bytes) -> str:
+    """Return the id git gives a blob with these contents, as 'git hash-object'."""
+    header = f"blob {len(data)}\0".encode("ascii")
+    return hashlib.sha1(header + data).hexdigest()
+
+
+def file_blob_id(path: str) -> Optional[str]:
+    """Return the blob id of a file in the working tree, or None if unreadable."""
+    try:
+        with open(path, "rb") as f:
+            return hash_blob(f.read())
+    except OSError:
+        return None
+
+
+def head_commit(root: str) -> str:
+    """Return the commit id of HEAD."""
+    return run_git(["rev-parse", "HEAD"], root).strip()
+
+
+def tree_blobs(rev: str, root: str) -> Dict[str, str]:
+    """Return the blob id of every file under 'root' at 'rev', keyed by path."""
+    output = run_git(["ls-tree", "-r", "-z", rev], root)
+    blobs: Dict[str, str] = {}
+    for entry in output.split("\0"):
+        if not entry:
+            continue
+        # '<mode> <type> <object>\t<path>'
+        info, path = entry.split("\t", 1)
+        _, kind, blob_id = info.split()
+        if kind == "blob":
+            blobs[path] = blob_id
+    return blobs
+
+
+def diff_names(old: str, new: Optional[str], root: str) -> List[str]:
+    """
+    Return paths, relative to 'root', that differ between two revisions, or
+    between 'old' and the working tree when 'new' is None.
+    """
+    args = ["diff", "--name-only", "--no-renames", "--relative", "-z", old]
+    if new is not None:
+        args.append(new)
+    return [p for p in run_git(args, root).split("\0") if p]
+
+
+def stream_git_paths(args: List[str], root: str) -> Iterator[str]:
+    """
+    Yield the NUL separated paths a git command prints, as they stream in.
+    Raises once the output is consumed if git fails.
+    """
+    # stderr goes to a file, since a full pipe would block git while stdout
+    # is still being read
+    with tempfile.TemporaryFile() as stderr:
+        proc = subprocess.Popen(
+            ["git"] + args, cwd=root, stdout=subprocess.PIPE, stderr=stderr
+        )
+        assert proc.stdout is not None
+        pending = b""
+        completed = False
+        try:
+            for chunk in iter(lambda: proc.stdout.read(65536), b""):
+                *paths, pending = (pending + chunk).split(b"\0")
+                for path in paths:
+                    yield os.fsdecode(path)
+            completed = True
+        finally:
+            if not completed:
+                proc.kill()
+            proc.stdout.close()
+            proc.wait()
+        if proc.returncode != 0:
+            stderr.seek(0)
+            message = stderr.read().decode("utf-8", "replace").strip()
+            raise Exception(f"git {' '.join(args)} failed: {message}")
+
+
+def ls_files(root: str, pathspecs: List[str]) -> Iterator[str]:
+    """
+    Yield the paths, relative to 'root', of tracked and untracked files that
+    git doesn't ignore. Tracked files of submodules are included, but git
+    can't list their untracked files, nor the files of nested repositories
+    that aren't submodules.
+    """
+    # '--recurse-submodules' only works with '--cached', so untracked files
+    # are listed by a second call
+    tracked = ["ls-files", "-z", "--cached", "--recurse-submodules", "--"]
+    yield from stream_git_paths(tracked + pathspecs, root)
+    untracked = ["ls-files", "-z", "--others", "--exclude-standard", "--"]
+    yield from stream_git_paths(untracked + pathspecs, root)
@@ -0,0 +1,77 @@
+from ratchets import run_tests
+import json
+
+TOML = """
+[ratchet.settings]
+baseline = "file"
+
+[ratchet.regex.prints]
+regex = "print\\\\("
+
+[ratchet.shell.long_lines]
+command = "xargs -n1 awk 'length($0) > 30'"
+"""
+
+
+def read_json(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def test_per_file_baseline(tmp_path, monkeypatch):
+    """Ensure per-file counts are stored and totals are updated incrementally."""
+    monkeypatch.chdir(tmp_path)
+    toml_path = str(tmp_path / "tests.toml")
+    (tmp_path / "tests.toml").write_text(TOML)
+    (tmp_path / "a.py").write_text("print(1)\nprint(2)\n")
+    (tmp_path / "sub").mkdir()
+    long_line = "x = 'longer than thirty chars..'\n"
+    (tmp_path / "sub" / "b.py").write_text("print(3)\n" + long_line)
+
+    ratchet_path = str(tmp_path / "ratchet_values.json")
+    files_path = run_tests.get_file_counts_path(ratchet_path)
+
+    run_tests.update_ratchets(toml_path, False, False, None, ratchet_path)
+    assert read_json(ratchet_path) == {"prints": 3, "long_lines": 1}
+    assert read_json(files_path) == {
+        "long_lines": {"sub/b.py": 1},
+        "prints": {"a.py": 2, "sub/b.py": 1},
+    }
+
+    (tmp_path / "a.py").write_text("print(1)\nprint(2)\nprint(3)\n")
+    (tmp_path / "sub" / "b.py").write_text("x = 1\n")
+
+    # only a.py is re-evaluated, so the stale count for b.py is kept
+    run_tests.update_ratchets(
+        toml_path, False, False, [str(tmp_path / "a.py")], ratchet_path
+    )
+    assert read_json(ratchet_path) == {"prints": 4, "long_lines": 1}
+
+    # shell counts are left alone when only regex tests are updated
+    run_tests.update_ratchets(
+        toml_path, False, True, [str(tmp_path / "sub" / "b.py")], ratchet_path
+    )
+    assert read_json(ratchet_path) == {"prints": 3, "long_lines": 1}
+    assert read_json(files_path)["prints"] == {"a.py": 3}
+
+    run_tests.update_ratchets(toml_path, False, False, None, ratchet_path)
+    assert read_json(ratchet_path) == {"prints": 3, "long_lines": 0}
+
+
+def test_partial_update_without_file_counts(tmp_path, monkeypatch):
+    """Ensure the first partial update counts the whole tree, not only its files."""
+    monkeypatch.chdir(tmp_path)
+    toml_path = str(tmp_path / "tests.toml")
+    (tmp_path / "tests.toml").write_text(TOML)
+    (tmp_path / "a.py").write_text("print(1)\n")
+    (tmp_path / "b.py").write_text("print(2)\nprint(3)\n")
+    ratchet_path = str(tmp_path / "ratchet_values.json")
+
+    run_tests.update_ratchets(
+        toml_path, False, False, [str(tmp_path / "a.py")], ratchet_path
+    )
+    assert read_json(ratchet_path) == {"prints": 3, "long_lines": 0}
+    assert read_json(run_tests.get_file_counts_path(ratchet_path))["prints"] == {
+        "a.py": 1,
+        "b.py": 2,
+    }
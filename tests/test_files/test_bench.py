@@ -0,0 +1,60 @@
+from ratchets import bench, run_tests
+import json
+
+SPEC = bench.RepoSpec(files=12, lines=40, density=0.2, ignored_files=6, commits=2)
+
+
+def test_generate_repo_is_deterministic(tmp_path):
+    """Ensure a seed always generates the same files, and ignored ones are skipped."""
+    first, second = tmp_path / "a", tmp_path / "b"
+    bench.generate_repo(first, SPEC)
+    bench.generate_repo(second, SPEC)
+
+    files = run_tests.get_python_files(
+        str(first), None, run_tests.get_ignore_rules(str(first))
+    )
+    assert len(files) == SPEC.files
+    for path in files:
+        rel = path.relative_to(first)
+        assert path.read_text() == (second / rel).read_text()
+    assert not any(".venv" in path.parts for path in files)
+
+
+def test_run_benchmarks(tmp_path):
+    """Ensure every benchmark runs on a small repository and reports timings."""
+    bench.generate_repo(tmp_path, SPEC)
+    results = bench.run_benchmarks(str(tmp_path), SPEC, list(bench.BENCHMARKS), 1)
+
+    assert set(results["results"]) == set(bench.BENCHMARKS)
+    for result in results["results"].values():
+        assert len(result["runs"]) == 1
+        assert result["median"] >= 0
+    assert results["spec"]["files"] == SPEC.files
+    json.dumps(results)
+
+
+def test_compare_flags_regressions(tmp_path):
+    """Ensure only benchmarks slower than the threshold are regressions."""
+
+    def saved(medians):
+        return {
+            "results": {
+                name: {"median": median, "min": median, "runs": [median]}
+                for name, median in medians.items()
+            }
+        }
+
+    baseline = saved({"regex_scan": 1.0, "shell": 1.0, "blame_cold": 1.0})
+    current = saved({"regex_scan": 1.05, "shell": 1.5, "cache_hit": 0.1})
+    rows = bench.compare_results(baseline, current, 0.1)
+    assert [(row[0], row[4]) for row in rows] == [
+        ("regex_scan", False),
+        ("shell", True),
+    ]
+
+    baseline_path, current_path = tmp_path / "base.json", tmp_path / "cur.json"
+    baseline_path.write_text(json.dumps(baseline))
+    current_path.write_text(json.dumps(current))
+    argv = ["--compare", str(baseline_path), "--current", str(current_path)]
+    assert bench.main(argv) == 1
+    assert bench.main(argv + ["--threshold", "0.6"]) == 0
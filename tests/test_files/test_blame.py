@@ -0,0 +1,195 @@
+from ratchets import blame, results, run_tests, vcs
+from ratchets.results import MatchResult
+import os
+import subprocess
+
+
+def git(repo, author, *args):
+    env = dict(
+        os.environ,
+        GIT_AUTHOR_NAME=author,
+        GIT_AUTHOR_EMAIL="ratchets@example.com",
+        GIT_COMMITTER_NAME=author,
+        GIT_COMMITTER_EMAIL="ratchets@example.com",
+    )
+    subprocess.run(
+        ["git"] + list(args), cwd=repo, env=env, check=True, capture_output=True
+    )
+
+
+def test_blame_is_grouped_by_file(tmp_path, monkeypatch):
+    """Ensure every match is blamed with one git invocation per file."""
+    repo = tmp_path / "repo"
+    repo.mkdir()
+    git(repo, "First", "init", "-q")
+    (repo / "a.py").write_text("print(1)\nx = 1\nprint(2)\n")
+    (repo / "b.py").write_text("print(3)\n")
+    git(repo, "First", "add", ".")
+    git(repo, "First", "commit", "-q", "-m", "first")
+    (repo / "a.py").write_text("print(1)\nx = 1\nprint(2)\nprint(4)\n")
+    git(repo, "Second", "commit", "-q", "-am", "second")
+    monkeypatch.chdir(repo)
+
+    calls = []
+    run_git = blame.run_git
+
+    def counting_run_git(args, cwd, timeout=None):
+        calls.append(args)
+        return run_git(args, cwd, timeout)
+
+    monkeypatch.setattr(blame, "run_git", counting_run_git)
+
+    a = str(repo / "a.py")
+    b = str(repo / "b.py")
+    lines = [(a, 1), (a, 3), (a, 4), (b, 1)]
+    prints = results.TestResult(
+        name="prints",
+        matches=[MatchResult(file=f, line=n, content="print") for f, n in lines],
+    )
+    # a second rule matching the same line shares the blame
+    again = results.TestResult(name="again", matches=[MatchResult(a, 4, "print(4)")])
+    run_tests.add_blames(({"prints": prints, "again": again}, {}))
+
+    assert len(calls) == 2
+    authors = [m.blame_author for m in prints.matches]
+    assert authors == ["First", "First", "Second", "First"]
+    assert again.matches[0].blame_author == "Second"
+
+
+def test_blame_failure_is_a_warning(tmp_path, monkeypatch, capsys):
+    """Ensure a file that can't be blamed is named on stderr and skipped."""
+    repo = tmp_path / "repo"
+    repo.mkdir()
+    git(repo, "First", "init", "-q")
+    (repo / "a.py").write_text("print(1)\n")
+    git(repo, "First", "add", ".")
+    git(repo, "First", "commit", "-q", "-m", "first")
+    monkeypatch.chdir(repo)
+
+    def failing_blame(*args, **kwargs):
+        raise Exception("git blame failed")
+
+    monkeypatch.setattr(run_tests, "blame_file", failing_blame)
+    match = MatchResult(str(repo / "a.py"), 1, "print(1)")
+    prints = results.TestResult(name="prints", matches=[match])
+    run_tests.add_blames(({"prints": prints}, {}))
+
+    captured = capsys.readouterr()
+    assert "Warning: could not blame a.py: git blame failed" in captured.err
+    assert captured.out == "" and match.blame_author is None
+
+
+def test_blame_args(tmp_path):
+    path = tmp_path / "a.py"
+    path.write_text("x = 1\n" * 100)
+    args = blame.blame_args(str(path), [1, 2, 3, 10])
+    assert args[-4:] == ["-L", "10,10", "--", str(path)]
+    assert args.count("-L") == 2
+
+    # dense matches blame the whole file instead
+    assert "-L" not in blame.blame_args(str(path), range(1, 40))
+
+
+def blame_prints(repo, name, lines):
+    path = str(repo / name)
+    tr = results.TestResult(
+        name="prints",
+        matches=[MatchResult(file=path, line=n, content="print") for n in lines],
+    )
+    run_tests.add_blames(({"prints": tr}, {}))
+    return [m.blame_author for m in tr.matches]
+
+
+def test_blame_cache_survives_renames(tmp_path, monkeypatch):
+    """Ensure cached blames are keyed by blob, not by path or line content."""
+    repo = tmp_path / "repo"
+    repo.mkdir()
+    git(repo, "First", "init", "-q")
+    (repo / "a.py").write_text("print(1)\nprint(2)\n")
+    git(repo, "First", "add", ".")
+    git(repo, "First", "commit", "-q", "-m", "first")
+    monkeypatch.chdir(repo)
+
+    calls = []
+    run_git = blame.run_git
+
+    def counting_run_git(args, cwd, timeout=None):
+        calls.append(args)
+        return run_git(args, cwd, timeout)
+
+    monkeypatch.setattr(blame, "run_git", counting_run_git)
+
+    assert blame_prints(repo, "a.py", [1, 2]) == ["First", "First"]
+    assert len(calls) == 1
+
+    git(repo, "Second", "mv", "a.py", "b.py")
+    git(repo, "Second", "commit", "-q", "-m", "rename")
+    assert blame_prints(repo, "b.py", [1, 2]) == ["First", "First"]
+    assert len(calls) == 1
+
+    # uncommitted lines are blamed every time until they are committed
+    (repo / "b.py").write_text("print(0)\nprint(1)\nprint(2)\n")
+    assert blame_prints(repo, "b.py", [1, 3]) == ["Not Committed Yet", "First"]
+    assert blame_prints(repo, "b.py", [1, 3]) == ["Not Committed Yet", "First"]
+    assert len(calls) == 3
+    git(repo, "Second", "commit", "-q", "-am", "edit")
+    assert blame_prints(repo, "b.py", [1, 3]) == ["Second", "First"]
+    assert blame_prints(repo, "b.py", [1, 3]) == ["Second", "First"]
+    assert len(calls) == 4
+
+
+def test_hash_blob(tmp_path):
+    path = tmp_path / "a.py"
+    path.write_text("print(1)\n")
+    expected = subprocess.run(
+        ["git", "hash-object", str(path)], capture_output=True, text=True
+    ).stdout.strip()
+    assert vcs.file_blob_id(str(path)) == expected
+
+
+def test_blame_index(tmp_path, monkeypatch):
+    """Ensure an indexed repo answers blames without running git blame."""
+    repo = tmp_path / "repo"
+    repo.mkdir()
+    git(repo, "First", "init", "-q")
+    (repo / "a.py").write_text("print(1)\nprint(2)\n")
+    (repo / "b.py").write_text("print(3)\n")
+    git(repo, "First", "add", ".")
+    git(repo, "First", "commit", "-q", "-m", "first")
+    monkeypatch.chdir(repo)
+
+    calls = []
+    run_git = blame.run_git
+
+    def counting_run_git(args, cwd, timeout=None):
+        calls.append(args)
+        return run_git(args, cwd, timeout)
+
+    monkeypatch.setattr(blame, "run_git", counting_run_git)
+    db_path = str(repo / run_tests.CACHING_FILENAME)
+
+    def index():
+        with run_tests.CachingDatabase(db_path) as db:
+            return blame.build_blame_index(str(repo), db, workers=2)
+
+    assert index().indexed == 2
+    assert len(calls) == 2
+
+    # only files changed by a new commit are blamed again
+    (repo / "a.py").write_text("print(1)\nprint(2)\nprint(4)\n")
+    git(repo, "Second", "commit", "-q", "-am", "second")
+    calls.clear()
+    assert index().indexed == 1
+    assert len(calls) == 1
+
+    # uncommitted changes are overlaid with a working tree blame
+    (repo / "b.py").write_text("print(0)\nprint(3)\n")
+    calls.clear()
+    summary = index()
+    assert (summary.indexed, summary.overlaid) == (0, 1)
+    assert len(calls) == 1
+
+    calls.clear()
+    assert blame_prints(repo, "a.py", [1, 3]) == ["First", "Second"]
+    assert blame_prints(repo, "b.py", [1, 2]) == ["Not Committed Yet", "First"]
+    assert calls == []
@@ -1,6 +1,9 @@
 from ratchets.caching import CachingDatabase, BlameRecord
 from ratchets.abstracted_tests import find_project_root
+from concurrent.futures import ProcessPoolExecutor
 import os
+import sqlite3
+import pytest
 from datetime import datetime
 
 CACHING_FILENAME = "tests/test_files/temp_ratchet_blame.db"
@@ -27,7 +30,7 @@ def test_create_multi_connections():
 
 
 def test_record_updating():
-    """Ensure records are updated correctly when line numbers and file names match."""
+    """Ensure records are updated correctly when line numbers and blob ids match."""
 
     repo_root = find_project_root()
     db_path = os.path.join(str(repo_root), CACHING_FILENAME)
@@ -37,6 +40,7 @@ def test_record_updating():
 
     file_name = "example.py"
     line_number = 42
+    blob_id = "blob"
 
     # create record
     record1 = BlameRecord(
@@ -45,8 +49,9 @@ def test_record_updating():
         timestamp=datetime(2020, 1, 1, 12, 0, 0),
         file_name=file_name,
         author="Author1",
+        blob_id=blob_id,
     )
-    db.create_or_update_blame(record1)
+    db.create_or_update_blob_blames([record1])
 
     # update with new author/timestamp/content
     record2 = BlameRecord(
@@ -55,10 +60,11 @@ def test_record_updating():
         timestamp=datetime(2021, 1, 1, 12, 0, 0),
         file_name=file_name,
         author="Author2",
+        blob_id=blob_id,
     )
-    db.create_or_update_blame(record2)
+    db.create_or_update_blob_blames([record2])
 
-    updated = db.get_blame(line_number, file_name)
+    updated = db.get_blob_blames(blob_id).get(line_number)
 
     assert updated is not None, "We inserted this record, it should not be 'None'"
 
@@ -72,10 +78,11 @@ def test_record_updating():
         timestamp=datetime(2022, 1, 1, 12, 0, 0),
         file_name=file_name,
         author="Author3",
+        blob_id=blob_id,
     )
-    db.create_or_update_blames([record3])
+    db.create_or_update_blob_blames([record3])
 
-    updated = db.get_blame(line_number, file_name)
+    updated = db.get_blob_blames(blob_id).get(line_number)
 
     assert updated is not None, "We inserted this record, it should not be 'None'"
     assert updated.author == "Author3", "Batch-record update failed"
@@ -84,6 +91,90 @@ def test_record_updating():
     print("test_record_updating passed")
 
 
+def test_legacy_blames_table_is_dropped(tmp_path):
+    """Ensure caches written by older versions lose their path-keyed table."""
+    db_path = str(tmp_path / "blame.db")
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TABLE blames (file_name TEXT, line_number INTEGER)")
+    conn.commit()
+    conn.close()
+
+    CachingDatabase(db_path).close()
+    conn = sqlite3.connect(db_path)
+    tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master")}
+    conn.close()
+    assert "blames" not in tables and "blob_blames" in tables
+
+
+def make_blob_record(blob_id, line_number, author="Author"):
+    return BlameRecord(
+        line_content="x = 1",
+        line_number=line_number,
+        timestamp=datetime(2020, 1, 1, 12, 0, 0),
+        file_name="example.py",
+        author=author,
+        blob_id=blob_id,
+    )
+
+
+def test_bulk_lookup(tmp_path):
+    """Ensure queued writes are visible to bulk lookups and persisted on close."""
+    db_path = str(tmp_path / "blame.db")
+    with CachingDatabase(db_path) as db:
+        records = [make_blob_record(f"blob{i}", n) for i in range(900) for n in (1, 2)]
+        db.create_or_update_blob_blames(records)
+        found = db.get_many_blob_blames(f"blob{i}" for i in range(0, 900, 2))
+        assert len(found) == 450
+        assert sorted(found["blob4"]) == [1, 2]
+
+    with CachingDatabase(db_path) as db:
+        assert db.get_blob_blames("blob899")[2].author == "Author"
+
+
+def test_deprecated_blame_wrappers(tmp_path):
+    """Ensure the file-keyed blame methods still work over the blob-keyed cache."""
+    source = tmp_path / "example.py"
+    source.write_text("x = 1\n")
+    record = make_blob_record(None, 1)
+    record.file_name = str(source)
+    with CachingDatabase(str(tmp_path / "blame.db")) as db:
+        with pytest.deprecated_call():
+            db.create_or_update_blame(record)
+        with pytest.deprecated_call():
+            assert db.get_blame(1, str(source)).author == "Author"
+        with pytest.deprecated_call():
+            assert db.get_blames([(str(source), 2)]) == {}
+
+        source.write_text("x = 2\n")
+        with pytest.deprecated_call():
+            assert db.get_blame(1, str(source)) is None
+
+
+def write_blames(args):
+    db_path, worker = args
+    with CachingDatabase(db_path) as db:
+        for line_number in range(1, 51):
+            db.create_or_update_blob_blames(
+                [make_blob_record(f"blob{worker}", line_number, f"Author{worker}")]
+            )
+            db.flush()
+    return worker
+
+
+def test_concurrent_writers(tmp_path):
+    """Ensure parallel processes sharing the cache do not lose writes."""
+    db_path = str(tmp_path / "blame.db")
+    CachingDatabase(db_path).close()
+    with ProcessPoolExecutor(max_workers=4) as executor:
+        list(executor.map(write_blames, [(db_path, worker) for worker in range(4)]))
+
+    with CachingDatabase(db_path) as db:
+        found = db.get_many_blob_blames(f"blob{worker}" for worker in range(4))
+    assert {blob: len(lines) for blob, lines in found.items()} == {
+        f"blob{worker}": 50 for worker in range(4)
+    }
+
+
 if __name__ == "__main__":
     test_create_new_db()
     test_create_multi_connections()
@@ -0,0 +1,135 @@
+from ratchets import abstracted_tests, daemon, serve
+import os
+import tempfile
+import threading
+import pytest
+
+TOML = """
+[ratchet.regex.prints]
+regex = "print\\\\("
+
+[ratchet.shell.long_lines]
+command = "xargs -n1 awk 'length($0) > 30'"
+"""
+
+
+@pytest.fixture
+def server(tmp_path):
+    (tmp_path / "tests.toml").write_text(TOML)
+    (tmp_path / "a.py").write_text("print(1)\n")
+    (tmp_path / "b.py").write_text("x = 'a line longer than thirty characters'\n")
+    # a long poll interval, so only requests refresh the results
+    srv = serve.RatchetServer(str(tmp_path), poll_interval=60)
+    thread = threading.Thread(target=srv.serve_forever, daemon=True)
+    thread.start()
+    yield srv
+    srv.shutdown()
+    srv.server_close()
+    thread.join()
+
+
+def counts(root):
+    regex_results, shell_results = daemon.query_results(str(root))
+    return {
+        name: len(tr.matches)
+        for part in (regex_results, shell_results)
+        for name, tr in part.items()
+    }
+
+
+def test_daemon_serves_fresh_results(server, tmp_path):
+    """Ensure the daemon only re-evaluates changed files and sees new ones."""
+    assert counts(tmp_path) == {"prints": 1, "long_lines": 1}
+    assert server.session.refresh() == []
+
+    (tmp_path / "a.py").write_text("print(1)\nprint(2)\n")
+    (tmp_path / "c.py").write_text("print(3)\n")
+    assert counts(tmp_path) == {"prints": 3, "long_lines": 1}
+
+    (tmp_path / "b.py").unlink()
+    assert counts(tmp_path) == {"prints": 3, "long_lines": 0}
+
+    # a changed configuration reloads the rules
+    (tmp_path / "tests.toml").write_text(TOML.split("[ratchet.shell")[0])
+    assert counts(tmp_path) == {"prints": 3}
+
+
+def test_refresh_only_rediscovers_changed_trees(tmp_path, monkeypatch):
+    """Ensure files are only discovered again once a directory changed."""
+    (tmp_path / "tests.toml").write_text(TOML)
+    (tmp_path / "pkg").mkdir()
+    (tmp_path / "pkg" / "a.py").write_text("print(1)\n")
+    session = serve.WarmSession(str(tmp_path))
+    discovered = []
+    get_python_files = abstracted_tests.get_python_files
+
+    def counting(*args):
+        discovered.append(args)
+        return get_python_files(*args)
+
+    monkeypatch.setattr(abstracted_tests, "get_python_files", counting)
+    assert len(session.refresh()) == 1
+    assert session.refresh() == [] and len(discovered) == 1
+
+    # edits are found without discovering the files again
+    (tmp_path / "pkg" / "a.py").write_text("print(1)\nprint(2)\n")
+    assert len(session.refresh()) == 1 and len(discovered) == 1
+
+    (tmp_path / "pkg" / "b.py").write_text("print(3)\n")
+    assert [p.name for p in session.refresh()] == ["b.py"]
+    assert len(discovered) == 2
+
+    monkeypatch.setattr(serve, "RESCAN_INTERVAL", 0)
+    session.refresh()
+    assert len(discovered) == 3
+
+
+def test_sessions_use_the_daemon(server, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    abstracted_tests.reset_session()
+    # the daemon shares this module, so warm it up before patching
+    server.session.refresh()
+
+    def no_evaluation(*args, **kwargs):
+        raise AssertionError("evaluated in process while a daemon is running")
+
+    monkeypatch.setattr(abstracted_tests, "evaluate_files", no_evaluation)
+    rule = abstracted_tests.get_regex_tests()["prints"]
+    assert len(abstracted_tests.get_python_test_matches("prints", rule)) == 1
+    abstracted_tests.reset_session()
+
+
+def test_no_daemon(tmp_path):
+    assert daemon.query_results(str(tmp_path)) is None
+    # a socket left behind by a daemon that died is replaced
+    (tmp_path / daemon.SOCKET_FILENAME).write_text("")
+    assert daemon.query_results(str(tmp_path)) is None
+    srv = serve.RatchetServer(str(tmp_path))
+    srv.server_close()
+    assert not (tmp_path / daemon.SOCKET_FILENAME).exists()
+
+
+def test_daemons_of_other_users_are_ignored(server, tmp_path, monkeypatch):
+    """Ensure results are only taken from sockets owned by the current user."""
+    assert daemon.query_results(str(tmp_path)) is not None
+    monkeypatch.setattr(os, "getuid", lambda: os.stat(server.path).st_uid + 1)
+    assert daemon.query_results(str(tmp_path)) is None
+
+
+def test_long_roots_use_a_private_directory(tmp_path, monkeypatch):
+    """Ensure sockets of deep roots go to a directory only the user can use."""
+    monkeypatch.delenv("XDG_RUNTIME_DIR", raising=False)
+    monkeypatch.setattr(tempfile, "tempdir", str(tmp_path))
+    root = str(tmp_path / ("deep" * 30))
+    path = daemon.socket_path(root)
+    assert os.path.dirname(path) == str(tmp_path / f"ratchets-{os.getuid()}")
+
+    daemon.make_socket_dir(path)
+    assert os.stat(os.path.dirname(path)).st_mode & 0o777 == 0o700
+    os.chmod(os.path.dirname(path), 0o777)
+    try:
+        daemon.make_socket_dir(path)
+    except Exception as e:
+        assert "not accessible to other users" in str(e)
+    else:
+        assert False, "expected a shared socket directory to be rejected"
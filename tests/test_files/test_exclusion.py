@@ -2,6 +2,7 @@ from ratchets import run_tests
 from ratchets import abstracted_tests
 import os
 import shutil
+import subprocess
 
 
 def test_config():
@@ -76,6 +77,131 @@ def test_exclusion():
     ), "There is an extra entry in the expected_results dictionary"
 
 
+def test_walker_prunes_and_reads_nested_ignores(tmp_path, monkeypatch):
+    """Ensure ignored directories are never entered and nested rules apply."""
+    tree = {
+        ".gitignore": ".venv/\n/build\n",
+        "ratchet_excluded.txt": "skipped/\n",
+        "a.py": "",
+        ".venv/lib/site.py": "",
+        "build/out.py": "",
+        "skipped/s.py": "",
+        "pkg/build/kept.py": "",
+        "pkg/.gitignore": "gen_*.py\n!gen_keep.py\n",
+        "pkg/gen_a.py": "",
+        "pkg/gen_keep.py": "",
+        "pkg/sub/gen_b.py": "",
+        "pkg/sub/.gitignore": "!gen_b.py\n",
+    }
+    for name, content in tree.items():
+        path = tmp_path / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(content)
+
+    entered = []
+    scandir = os.scandir
+
+    def recording_scandir(path):
+        entered.append(os.path.relpath(path, tmp_path))
+        return scandir(path)
+
+    monkeypatch.setattr(os, "scandir", recording_scandir)
+    rules = run_tests.get_ignore_rules(str(tmp_path))
+    files = run_tests.get_python_files(str(tmp_path), None, rules)
+
+    found = [os.path.relpath(f, tmp_path) for f in files]
+    assert sorted(found) == [
+        "a.py",
+        "pkg/build/kept.py",
+        "pkg/gen_keep.py",
+        "pkg/sub/gen_b.py",
+    ]
+    assert not any(p.startswith((".venv", "build", "skipped")) for p in entered)
+
+    # explicit paths and changed files follow the same rules
+    everything = [tmp_path / name for name in tree if name.endswith(".py")]
+    filtered = run_tests.filter_excluded_files(
+        everything,
+        str(tmp_path / "ratchet_excluded.txt"),
+        str(tmp_path / ".gitignore"),
+    )
+    assert sorted(os.path.relpath(f, tmp_path) for f in filtered) == sorted(found)
+
+
+def test_git_discovery(tmp_path, monkeypatch):
+    """Ensure files are listed from the git index, with the same rules applied."""
+
+    def git(*args):
+        subprocess.run(["git"] + list(args), cwd=tmp_path, check=True)
+
+    git("init", "-q")
+    tree = {
+        ".gitignore": "ignored*.py\n",
+        "ratchet_excluded.txt": "excluded.py\n",
+        "tracked.py": "",
+        "deleted.py": "",
+        "excluded.py": "",
+        "ignored_tracked.py": "",
+        "pkg/untracked.py": "",
+        "pkg/ignored.py": "",
+        "notes.txt": "",
+    }
+    for name, content in tree.items():
+        path = tmp_path / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(content)
+    git("add", "tracked.py", "deleted.py", "excluded.py")
+    git("add", "-f", "ignored_tracked.py")
+    (tmp_path / "deleted.py").unlink()
+
+    def no_walk(*args, **kwargs):
+        raise AssertionError("walked the tree inside a git checkout")
+
+    monkeypatch.setattr(run_tests, "walk_python_files", no_walk)
+    rules = run_tests.get_ignore_rules(str(tmp_path))
+    files = run_tests.get_python_files(str(tmp_path), None, rules)
+    expected = ["pkg/untracked.py", "tracked.py"]
+    assert sorted(os.path.relpath(f, tmp_path) for f in files) == expected
+
+    # outside a checkout the tree is walked instead
+    monkeypatch.undo()
+    shutil.rmtree(tmp_path / ".git")
+    files = run_tests.get_python_files(str(tmp_path), None, rules)
+    assert sorted(os.path.relpath(f, tmp_path) for f in files) == expected
+
+
+def test_git_discovery_submodules(tmp_path, monkeypatch):
+    """Ensure tracked files of submodules are listed."""
+
+    def git(cwd, *args):
+        identity = ["-c", "user.name=t", "-c", "user.email=t@t"]
+        allow = ["-c", "protocol.file.allow=always"]
+        command = ["git"] + identity + allow + list(args)
+        subprocess.run(command, cwd=cwd, check=True, capture_output=True)
+
+    lib = tmp_path / "lib"
+    lib.mkdir()
+    git(lib, "init", "-q")
+    (lib / "helper.py").write_text("")
+    git(lib, "add", "helper.py")
+    git(lib, "commit", "-q", "-m", "lib")
+
+    project = tmp_path / "project"
+    project.mkdir()
+    git(project, "init", "-q")
+    (project / "main.py").write_text("")
+    git(project, "submodule", "add", "-q", str(lib), "vendor/lib")
+
+    def no_walk(*args, **kwargs):
+        raise AssertionError("walked the tree inside a git checkout")
+
+    monkeypatch.setattr(run_tests, "walk_python_files", no_walk)
+    rules = run_tests.get_ignore_rules(str(project))
+    files = run_tests.get_python_files(str(project), None, rules)
+    found = sorted(os.path.relpath(f, project) for f in files)
+    assert found == ["main.py", os.path.join("vendor", "lib", "helper.py")]
+
+
 if __name__ == "__main__":
     test_config()
     test_exclusion()
@@ -0,0 +1,80 @@
+from ratchets import output, run_tests
+import io
+import json
+
+REGEX = {"prints": {"regex": "print\\(", "description": "Use logging."}}
+SHELL = {
+    "long": {"argv": ["grep", "-Hn", "longer", "{file}"], "format": "location"}
+}
+
+
+def make_files(tmp_path):
+    files = []
+    for idx in range(6):
+        path = tmp_path / "pkg" / f"m{idx}.py"
+        path.parent.mkdir(exist_ok=True)
+        path.write_text("print(1)\n" * idx + "x = 'longer'\n")
+        files.append(path)
+    return files
+
+
+def test_stream_matches_evaluation(tmp_path):
+    """Ensure streamed findings are the matches a full evaluation returns."""
+    files = make_files(tmp_path)
+    regex_results, shell_results = run_tests.evaluate_files(files, REGEX, SHELL)
+    expected = sorted(
+        (kind, name, m.file, m.line)
+        for kind, part in (("regex", regex_results), ("shell", shell_results))
+        for name, tr in part.items()
+        for m in tr.matches
+    )
+    for jobs in (None, 2):
+        findings = run_tests.stream_files(files, REGEX, SHELL, jobs)
+        assert sorted((k, n, m.file, m.line) for k, n, m in findings) == expected
+
+
+def write(tmp_path, fmt):
+    files = make_files(tmp_path)
+    findings = run_tests.stream_files(files, REGEX, SHELL)
+    out = io.StringIO()
+    counts = output.write_findings(
+        findings, dict(REGEX, **SHELL), fmt, out, str(tmp_path)
+    )
+    assert counts == {"prints": 15, "long": 6}
+    return out.getvalue()
+
+
+def test_jsonl(tmp_path):
+    lines = [json.loads(line) for line in write(tmp_path, "jsonl").splitlines()]
+    assert len(lines) == 21
+    assert {"kind", "rule", "file", "line", "column", "content"} == set(lines[0])
+
+
+def test_json(tmp_path):
+    data = json.loads(write(tmp_path, "json"))
+    assert data["counts"] == {"prints": 15, "long": 6}
+    assert len(data["matches"]) == 21
+
+
+def test_sarif(tmp_path):
+    run = json.loads(write(tmp_path, "sarif"))["runs"][0]
+    rules = run["tool"]["driver"]["rules"]
+    assert [rule["id"] for rule in rules] == ["prints", "long"]
+    assert rules[0]["shortDescription"]["text"] == "Use logging."
+    assert len(run["results"]) == 21
+
+    result = run["results"][0]
+    location = result["locations"][0]["physicalLocation"]
+    assert location["artifactLocation"]["uriBaseId"] == output.ROOT_BASE_ID
+    assert location["artifactLocation"]["uri"].startswith("pkg/m")
+    assert location["region"]["startLine"] >= 1
+    base = run["originalUriBaseIds"][output.ROOT_BASE_ID]["uri"]
+    assert base == tmp_path.as_uri() + "/"
+
+
+def test_sarif_uris_are_encoded(tmp_path):
+    """Ensure relative paths are percent-encoded like the absolute ones."""
+    sink = output.SarifSink(io.StringIO(), str(tmp_path))
+    m = run_tests.MatchResult(str(tmp_path / "my pkg" / "a#1.py"), 1, "x")
+    artifact = sink.location(m)["physicalLocation"]["artifactLocation"]
+    assert artifact["uri"] == "my%20pkg/a%231.py"
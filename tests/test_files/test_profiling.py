@@ -0,0 +1,71 @@
+from ratchets import profiling, run_tests
+import io
+import sys
+import json
+
+REGEX = {"prints": {"regex": "print\\(", "description": "Use logging."}}
+SHELL = {"long": {"argv": ["grep", "-Hn", "longer", "{file}"], "format": "location"}}
+
+
+def make_files(tmp_path):
+    files = []
+    for idx in range(4):
+        path = tmp_path / f"m{idx}.py"
+        path.write_text("print(1)\n" * idx + "x = 'longer'\n")
+        files.append(path)
+    return files
+
+
+def test_phase_without_profiler():
+    """Ensure phases do nothing unless a run is being profiled."""
+    assert profiling.active() is None
+    with profiling.phase("discover"):
+        pass
+    assert profiling.active() is None
+
+
+def test_profile_run(tmp_path):
+    """Ensure a profiled run records phases, rules, files and processes."""
+    files = make_files(tmp_path)
+    profiler = profiling.Profiler()
+    with profiling.profiled(profiler):
+        assert profiling.active() is profiler
+        run_tests.evaluate_files(files, REGEX, SHELL)
+    assert profiling.active() is None
+
+    trace_path = tmp_path / "trace.json"
+    run_tests.report_profile(profiler, str(trace_path))
+    summary = profiler.summary()
+
+    phases = {row["name"]: row for row in summary["phases"]}
+    assert phases["run"]["calls"] == 1
+    assert "regex_scan" in phases and "shell" in phases
+    assert [row["name"] for row in summary["rules"]["regex"]] == ["prints"]
+    shell_rules = summary["rules"]["shell"]
+    assert [(row["name"], row["calls"]) for row in shell_rules] == [("long", 4)]
+    assert {row["file"] for row in summary["slowest_files"]} == {
+        str(f) for f in files
+    }
+    assert summary["peak_memory"] > 0
+    if sys.version_info >= (3, 8):
+        assert summary["processes"] == {"grep": len(files)}
+
+    trace = json.loads(trace_path.read_text())
+    slices = [e for e in trace["traceEvents"] if e["ph"] == "X"]
+    assert slices[0]["name"] == "run"
+    assert all(e["ts"] >= 0 and e["dur"] >= 0 for e in slices)
+    assert {e["args"].get("file") for e in slices if e["cat"] == "shell"} == {
+        str(f) for f in files
+    }
+
+    out = io.StringIO()
+    profiler.print_summary(out)
+    assert "regex_scan" in out.getvalue() and "prints" in out.getvalue()
+
+
+def test_command_name():
+    """Ensure spawned processes are named by the program they run."""
+    assert profiling.command_name("subprocess.Popen", (None, ["git", "blame"])) == "git"
+    assert profiling.command_name("subprocess.Popen", (None, "echo x | awk")) == "echo"
+    assert profiling.command_name("subprocess.Popen", ("/bin/sh", "x")) == "sh"
+    assert profiling.command_name("os.system", ("ls -l",)) == "ls"
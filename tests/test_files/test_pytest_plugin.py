@@ -0,0 +1,172 @@
+from ratchets import abstracted_tests, pytest_plugin
+from ratchets.run_tests import results_to_json
+import os
+import subprocess
+import sys
+
+TOML = """
+[ratchet.regex.prints]
+regex = "print\\\\("
+
+[ratchet.shell.long_lines]
+command = "xargs -n1 awk 'length($0) > 30'"
+"""
+
+
+def make_project(tmp_path):
+    project = tmp_path / "project"
+    project.mkdir()
+    (project / "tests.toml").write_text(TOML)
+    for idx in range(10):
+        body = "print(%d)\n" % idx * (idx % 3)
+        body += "y = 'a line longer than thirty...'\n"
+        (project / f"m{idx}.py").write_text(body)
+    return project
+
+
+def test_shards_are_scanned_once(tmp_path, monkeypatch):
+    """Ensure workers share shard results and aggregate to the full counts."""
+    project = make_project(tmp_path)
+    monkeypatch.chdir(project)
+    root = str(project)
+    expected = results_to_json(abstracted_tests.RatchetSession(root).results())
+
+    calls = []
+    evaluate_files = pytest_plugin.evaluate_files
+
+    def counting_evaluate(files, *args, **kwargs):
+        calls.append(len(files))
+        return evaluate_files(files, *args, **kwargs)
+
+    monkeypatch.setattr(pytest_plugin, "evaluate_files", counting_evaluate)
+
+    shared = str(tmp_path / "shared")
+    first = pytest_plugin.SharedSession(root, shared, 0, 2)
+    second = pytest_plugin.SharedSession(root, shared, 1, 2)
+    assert results_to_json(first.results()) == expected
+    assert sum(calls) == 10
+
+    # every shard was published by the first worker, so nothing is rescanned
+    assert results_to_json(second.results()) == expected
+    assert sum(calls) == 10
+
+
+def test_dead_claim_is_taken_over(tmp_path, monkeypatch):
+    """Ensure a shard claimed by a worker that died is evaluated locally."""
+    project = make_project(tmp_path)
+    monkeypatch.chdir(project)
+    root = str(project)
+    expected = results_to_json(abstracted_tests.RatchetSession(root).results())
+
+    session = pytest_plugin.SharedSession(root, str(tmp_path / "shared"), 0, 1)
+    dead = subprocess.Popen([sys.executable, "-c", "pass"])
+    dead.wait()
+    os.makedirs(session.shared_dir)
+    with open(session.shard_path(0, ".claim"), "w") as f:
+        f.write(str(dead.pid))
+
+    assert results_to_json(session.results()) == expected
+    # taken over like any other shard, so it is published for other workers
+    assert os.path.exists(session.shard_path(0, ".json"))
+
+
+def test_failed_shard_is_not_waited_for(tmp_path, monkeypatch):
+    """Ensure a shard another worker failed on raises instead of hanging."""
+    project = make_project(tmp_path)
+    monkeypatch.chdir(project)
+    root = str(project)
+    shared = str(tmp_path / "shared")
+
+    def failing_evaluate(*args, **kwargs):
+        raise Exception("shell rule timed out")
+
+    monkeypatch.setattr(pytest_plugin, "evaluate_files", failing_evaluate)
+    first = pytest_plugin.SharedSession(root, shared, 0, 2)
+    try:
+        first.results()
+    except Exception as e:
+        assert "timed out" in str(e)
+    else:
+        assert False, "expected the shard to fail"
+    monkeypatch.undo()
+    monkeypatch.chdir(project)
+
+    second = pytest_plugin.SharedSession(root, shared, 1, 2)
+    try:
+        second.results()
+    except Exception as e:
+        assert "Another worker failed on shard" in str(e)
+        assert "timed out" in str(e)
+    else:
+        assert False, "expected the failed shard to be reported"
+
+
+def test_wait_for_shard_gives_up(tmp_path, monkeypatch):
+    """Ensure a shard held by a live worker is only waited for so long."""
+    project = make_project(tmp_path)
+    session = pytest_plugin.SharedSession(str(project), str(tmp_path / "s"), 0, 2)
+    os.makedirs(session.shared_dir)
+    assert session.claim(0)
+    monkeypatch.setattr(pytest_plugin, "SHARD_TIMEOUT", 0.1)
+    try:
+        session.wait_for_shard(0, [], None, None)
+    except Exception as e:
+        assert "Gave up on shard 0" in str(e)
+    else:
+        assert False, "expected waiting for the shard to time out"
+
+
+def test_counts_are_sharded_without_matches(tmp_path, monkeypatch):
+    """Ensure sharded counts take the count path, never building matches."""
+    project = make_project(tmp_path)
+    monkeypatch.chdir(project)
+    root = str(project)
+    expected = abstracted_tests.RatchetSession(root).counts()
+
+    def no_evaluation(*args, **kwargs):
+        raise AssertionError("built the matches to count them")
+
+    monkeypatch.setattr(pytest_plugin, "evaluate_files", no_evaluation)
+    shared = str(tmp_path / "shared")
+    for worker in range(2):
+        session = pytest_plugin.SharedSession(root, shared, worker, 2)
+        session.use_daemon = False
+        assert session.counts() == expected
+
+
+def test_plugin_only_activates_in_ratchets_projects(tmp_path, monkeypatch):
+    """Ensure xdist workers of other projects get no shared directory."""
+
+    class Config:
+        pass
+
+    class Node:
+        def __init__(self):
+            self.config = Config()
+            self.workerinput = {}
+
+    other = tmp_path / "other"
+    other.mkdir()
+    (other / "pyproject.toml").write_text("")
+    monkeypatch.chdir(other)
+    assert pytest_plugin.ratchets_root() is None
+    node = Node()
+    pytest_plugin.pytest_configure_node(node)
+    assert node.workerinput == {}
+
+    project = make_project(tmp_path)
+    monkeypatch.chdir(project)
+    node = Node()
+    pytest_plugin.pytest_configure_node(node)
+    try:
+        assert node.workerinput[pytest_plugin.ROOT_KEY] == str(project)
+        assert os.path.isdir(node.workerinput[pytest_plugin.SHARED_DIR_KEY])
+    finally:
+        pytest_plugin.pytest_unconfigure(node.config)
+
+
+def test_shard_files():
+    files = [str(idx) for idx in range(7)]
+    shards = pytest_plugin.shard_files(files, 3)
+    assert shards == [["0", "1", "2"], ["3", "4"], ["5", "6"]]
+    assert pytest_plugin.shard_files(files[:2], 8) == [["0"], ["1"]]
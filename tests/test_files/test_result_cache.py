@@ -0,0 +1,112 @@
+from ratchets import run_tests
+from ratchets.caching import ResultCache
+import os
+import sqlite3
+
+REGEX_TESTS = {
+    "prints": {"regex": "print\\("},
+    "comments": {"regex": "#"},
+}
+SHELL_TESTS = {"long_lines": {"command": "xargs -n1 awk 'length($0) > 20'"}}
+
+
+def write_files(tmp_path):
+    contents = [
+        "# first\nprint(1)\n",
+        "# first\nprint(1)\n",
+        "x = 'a line that is clearly too long'\n",
+    ]
+    files = []
+    for idx, content in enumerate(contents):
+        path = tmp_path / f"file_{idx}.py"
+        path.write_text(content)
+        files.append(path)
+    return files
+
+
+def counts(results):
+    return run_tests.results_to_json(results)
+
+
+def test_cache_matches_uncached(tmp_path):
+    """Ensure cached evaluation gives the same results as a full evaluation."""
+    files = write_files(tmp_path)
+    cache = ResultCache(str(tmp_path / "results.db"))
+
+    expected_regex = run_tests.evaluate_regex_tests(files, REGEX_TESTS)
+    expected_shell = run_tests.evaluate_shell_tests(files, SHELL_TESTS)
+
+    for _ in range(2):
+        regex, shell = run_tests.evaluate_with_cache(
+            files, REGEX_TESTS, SHELL_TESTS, cache
+        )
+        assert regex == expected_regex
+        assert shell == expected_shell
+
+
+def test_cache_skips_unchanged_work(tmp_path, monkeypatch):
+    """Ensure duplicate files, unchanged files and unchanged rules are not re-run."""
+    files = write_files(tmp_path)
+    cache = ResultCache(str(tmp_path / "results.db"))
+
+    evaluated = []
+    real_regex = run_tests.evaluate_regex_tests
+
+    def tracking_regex(group, tests, *args, **kwargs):
+        evaluated.append((sorted(os.path.basename(str(f)) for f in group), set(tests)))
+        return real_regex(group, tests, *args, **kwargs)
+
+    monkeypatch.setattr(run_tests, "evaluate_regex_tests", tracking_regex)
+
+    first = run_tests.evaluate_with_cache(files, REGEX_TESTS, None, cache)
+    # identical contents are only scanned once
+    assert evaluated == [(["file_0.py", "file_2.py"], {"prints", "comments"})]
+    assert counts(first) == {"prints": 2, "comments": 2}
+
+    evaluated.clear()
+    run_tests.evaluate_with_cache(files, REGEX_TESTS, None, cache)
+    assert evaluated == []
+
+    evaluated.clear()
+    edited = dict(REGEX_TESTS, comments={"regex": "#\\s"})
+    edited_results = run_tests.evaluate_with_cache(files, edited, None, cache)
+    assert evaluated == [(["file_0.py", "file_2.py"], {"comments"})]
+    assert counts(edited_results) == {"prints": 2, "comments": 2}
+
+    evaluated.clear()
+    files[2].write_text("print(2)\n")
+    changed = run_tests.evaluate_with_cache(files, REGEX_TESTS, None, cache)
+    assert evaluated == [(["file_2.py"], {"prints", "comments"})]
+    assert counts(changed) == {"prints": 3, "comments": 2}
+
+
+def test_stale_entries_are_evicted(tmp_path):
+    """Ensure results of old contents and signatures of deleted files are dropped."""
+    files = write_files(tmp_path)
+    db_path = str(tmp_path / "results.db")
+    cache = ResultCache(db_path)
+    # old enough that their signatures are stored
+    for path in files:
+        os.utime(path, (1, 1))
+
+    def stored():
+        conn = sqlite3.connect(db_path)
+        names = {row[0] for row in conn.execute("SELECT file_name FROM file_stats")}
+        contents = {row[0] for row in conn.execute("SELECT content_hash FROM results")}
+        conn.close()
+        return names, contents
+
+    run_tests.evaluate_with_cache(files, REGEX_TESTS, None, cache)
+    names, contents = stored()
+    assert names == {str(f) for f in files} and len(contents) == 2
+
+    files[2].write_text("print(2)\n")
+    os.utime(files[2], (1, 1))
+    run_tests.evaluate_with_cache(files, REGEX_TESTS, None, cache)
+    assert len(stored()[1]) == 2
+
+    files[0].unlink()
+    files[1].unlink()
+    run_tests.evaluate_with_cache(files[2:], REGEX_TESTS, None, cache)
+    names, contents = stored()
+    assert names == {str(files[2])} and len(contents) == 1
@@ -0,0 +1,227 @@
+from ratchets import run_tests
+from ratchets import scanning
+import builtins
+import signal
+import re
+import os
+
+
+def get_spec_files():
+    proj_root = run_tests.find_project_root()
+    spec_dir = os.path.join(proj_root, "tests/file_spec_files")
+    return [
+        os.path.join(spec_dir, name)
+        for name in sorted(os.listdir(spec_dir))
+        if name.endswith(".py")
+    ]
+
+
+def test_split_lines_matches_file_iteration():
+    """Ensure buffered lines are identical to iterating over the open file."""
+    for file_path in get_spec_files():
+        with open(file_path, "r", encoding="utf-8") as f:
+            expected = list(f)
+        assert scanning.split_lines(scanning.read_text(file_path)) == expected
+
+    assert scanning.split_lines("") == []
+    assert scanning.split_lines("a\nb") == ["a\n", "b"]
+    assert scanning.split_lines("a\n\n") == ["a\n", "\n"]
+
+
+def test_single_read_per_file(monkeypatch):
+    """Ensure each file is opened once, regardless of the number of rules."""
+    files = get_spec_files()
+    tests = {
+        "exceptions": {"regex": "except[:]"},
+        "comments": {"regex": "#"},
+        "tabs": {"regex": "\\t"},
+    }
+
+    opened = []
+    real_open = builtins.open
+
+    def counting_open(file, *args, **kwargs):
+        opened.append(str(file))
+        return real_open(file, *args, **kwargs)
+
+    monkeypatch.setattr(builtins, "open", counting_open)
+
+    line_maps = {}
+    results = run_tests.evaluate_regex_tests(files, tests, line_maps)
+
+    assert sorted(opened) == sorted(files)
+    assert set(line_maps) == set(files)
+    assert len(results["exceptions"].matches) == 6
+    assert len(results["comments"].matches) == 8
+    assert len(results["tabs"].matches) == 0
+
+
+def test_process_pool_matches_serial():
+    """Ensure sharding files across processes gives the same results in order."""
+    files = get_spec_files() * 3
+    tests = {
+        "exceptions": {"regex": "except[:]"},
+        "comments": {"regex": "#"},
+    }
+
+    serial_lines = {}
+    serial = run_tests.evaluate_regex_tests(files, tests, serial_lines, jobs=1)
+    pooled_lines = {}
+    pooled = run_tests.evaluate_regex_tests(files, tests, pooled_lines, jobs=2)
+
+    assert serial == pooled
+    assert serial_lines == pooled_lines
+
+
+def test_partition_files_balanced():
+    """Ensure every file lands in exactly one chunk."""
+    files = get_spec_files()
+    chunks = scanning.partition_files(files, 4)
+    assert len(chunks) == len(files)
+    assert sorted(f for chunk in chunks for f in chunk) == sorted(files)
+
+
+def test_stream_chunks_are_capped(tmp_path, monkeypatch):
+    """Ensure one large file doesn't leave the small ones in an oversized chunk."""
+    files = [tmp_path / "large.py"] + [tmp_path / f"s{i}.py" for i in range(9)]
+    files[0].write_text("x" * 10000)
+    for path in files[1:]:
+        path.write_text("x")
+    monkeypatch.setattr(scanning, "STREAM_CHUNK_FILES", 3)
+    chunks = scanning.stream_chunks(files, 2)
+    assert max(len(chunk) for chunk in chunks) <= 3
+    assert sorted(f for chunk in chunks for f in chunk) == sorted(files)
+
+
+def test_literal_prefilter_matches_plain_search():
+    """Ensure the literal prefilter never changes which lines a rule matches."""
+    patterns = {
+        "bare": "except[:]",
+        "either": "import " + "pytorch_lightning|from " + "pytorch_lightning",
+        "wildcard": "from\\s+[^\\s]+\\s+import\\s+\\*",
+        "class": "[ \\t]+$",
+        "caseless": "(?i)#" + ".*\\b(?:T" + "ODO|FIX" + "ME)\\b",
+        "scoped": "(?i:abc)def",
+        "no_literal": "^\\s*$",
+    }
+    lines = [
+        "except" + ":\n",
+        "  except ValueError:\n",
+        "from " + "pytorch_lightning import Trainer\n",
+        "from os import " + "*\n",
+        "x = 1   \n",
+        "# fix" + "me later\n",
+        "# ſome FIX" + "ME\n",
+        "ABCdef\n",
+        "abcDEF\n",
+        "\n",
+        "plain",
+    ]
+
+    rules = scanning.compile_regex_rules(
+        {name: {"regex": regex} for name, regex in patterns.items()}
+    )
+    found = scanning.scan_lines(lines, rules)
+
+    for name, regex in patterns.items():
+        pattern = re.compile(regex)
+        expected = [
+            (lineno, line.strip())
+            for lineno, line in enumerate(lines, 1)
+            if pattern.search(line)
+        ]
+        assert found.get(name, []) == expected, name
+
+    assert [rule.name for rule in rules.fallback] == ["no_literal"]
+
+
+def test_file_mode_line_numbers(tmp_path):
+    """Ensure whole-file matches report the line each match starts on."""
+    source = tmp_path / "multi_line.py"
+    source.write_text("x = 1\ndef f():\n    pass\n\ndef g(a):\n    pass")
+    tests = {
+        "empty_function": {"regex": "def \\w+\\([^)]*\\):\\n\\s+pass", "mode": "file"},
+        "no_newline": {"regex": "\\Z(?<!\\n)\\Z", "mode": "file"},
+    }
+
+    results = run_tests.evaluate_regex_tests([source], tests)
+
+    empty = results["empty_function"].matches
+    assert [(m.line, m.content) for m in empty] == [(2, "def f():"), (5, "def g(a):")]
+    newline = results["no_newline"].matches
+    assert [(m.line, m.content) for m in newline] == [(6, "pass")]
+
+
+def test_counts_match_scans():
+    """Ensure counting gives the per-file totals of a full scan."""
+    files = get_spec_files()
+    tests = {
+        "comments": {"regex": "#"},
+        "defs": {"regex": "(?i)DEF "},
+        "blank": {"regex": "^\\s*$"},
+        "calls": {"regex": "\\w+\\(", "mode": "file"},
+    }
+    results, _ = scanning.scan_files(files, tests)
+    expected = run_tests.results_to_counts((results, {}))
+    for jobs in (None, 2):
+        assert scanning.count_files(files, tests, jobs) == expected
+
+
+def test_counting_reads_each_file_once(monkeypatch):
+    """Ensure counting shares the regex buffers with the shell line lookup."""
+    files = get_spec_files()
+    regex_tests = {"comments": {"regex": "#"}}
+    shell_tests = {"long": {"command": "xargs -n1 awk 'length($0) > 30'"}}
+    expected = run_tests.results_to_counts(
+        run_tests.evaluate_files(files, regex_tests, shell_tests)
+    )
+
+    opened = []
+    real_open = builtins.open
+
+    def counting_open(file, *args, **kwargs):
+        opened.append(str(file))
+        return real_open(file, *args, **kwargs)
+
+    monkeypatch.setattr(builtins, "open", counting_open)
+    counts = run_tests.count_matches(files, regex_tests, shell_tests)
+    assert sorted(opened) == sorted(files)
+    assert counts == expected
+
+
+def test_match_results_are_compact():
+    a = scanning.MatchResult("".join(["a", ".py"]), 1, "x")
+    b = scanning.MatchResult("".join(["a", ".py"]), 1, "x")
+    assert a == b and a.file is b.file
+    assert a != scanning.MatchResult("a.py", 2, "x")
+    assert not hasattr(a, "__dict__")
+    assert repr(a).startswith("MatchResult(file='a.py', line=1, content='x'")
+
+
+def test_rule_time_budget(tmp_path):
+    """Ensure a rule is stopped once it runs longer than its time budget."""
+    slow = tmp_path / "slow.py"
+    slow.write_text("a" * 40 + "!\n")
+    fast = tmp_path / "fast.py"
+    fast.write_text("aaa\n")
+    rules = {"nested": {"regex": "^(a+)+$", "time_budget": 0.1}}
+    handler = signal.getsignal(signal.SIGALRM)
+
+    counts = run_tests.count_matches([fast], rules, None)
+    assert counts == {"nested": {str(fast): 1}}
+    for evaluate in (run_tests.evaluate_files, run_tests.count_matches):
+        try:
+            evaluate([fast, slow], rules, None)
+        except scanning.RuleTimeout as e:
+            assert (e.rule, e.file) == ("nested", str(slow))
+            assert "time budget of 0.1s" in str(e)
+        else:
+            assert False, "expected the rule to run out of time"
+        assert signal.getsignal(signal.SIGALRM) is handler
+
+    try:
+        scanning.compile_regex_rules({"bad": {"regex": "a", "time_budget": 0}})
+    except Exception as e:
+        assert "time_budget" in str(e)
+    else:
+        assert False, "expected an invalid time_budget to be rejected"
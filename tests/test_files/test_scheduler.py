@@ -0,0 +1,108 @@
+from ratchets import run_tests
+from ratchets.scheduler import interleave, run_tasks
+import threading
+import time
+import pytest
+
+
+def test_concurrency_is_bounded():
+    """Ensure no more than the worker count, or a rule's limit, runs at once."""
+    lock = threading.Lock()
+    running = {"all": 0, "a": 0}
+    peak = {"all": 0, "a": 0}
+    pulled = []
+
+    def work(name):
+        def run():
+            with lock:
+                for key in ("all", name):
+                    if key in running:
+                        running[key] += 1
+                        peak[key] = max(peak[key], running[key])
+            time.sleep(0.01)
+            with lock:
+                for key in ("all", name):
+                    if key in running:
+                        running[key] -= 1
+
+        return run
+
+    def tasks():
+        for idx in range(40):
+            pulled.append(idx)
+            yield ("a" if idx % 2 else "b"), work("a" if idx % 2 else "b")
+
+    run_tasks(tasks(), 4, {"a": 1})
+    assert len(pulled) == 40
+    assert peak["all"] <= 4
+    assert peak["a"] == 1
+
+
+def test_limited_rules_leave_workers_free():
+    """Ensure workers run other rules' tasks while a limited rule is busy."""
+    started = []
+    release = threading.Event()
+
+    def blocking():
+        started.append("a")
+        release.wait(5)
+
+    def quick():
+        started.append("b")
+        if started.count("b") == 6:
+            release.set()
+
+    def tasks():
+        for idx in range(4):
+            yield "a", blocking
+        for idx in range(6):
+            yield "b", quick
+
+    start = time.monotonic()
+    run_tasks(tasks(), 2, {"a": 1})
+    # the second worker ran every 'b' task while the first 'a' task blocked
+    assert started[:7] == ["a"] + ["b"] * 6
+    assert time.monotonic() - start < 4
+
+
+def test_errors_reach_the_caller():
+    """Ensure the first error is raised and no further tasks are pulled."""
+    pulled = []
+
+    def fail():
+        raise ValueError("broken")
+
+    def tasks():
+        for idx in range(1000):
+            pulled.append(idx)
+            yield "rule", fail if idx == 3 else (lambda: None)
+
+    with pytest.raises(ValueError):
+        run_tasks(tasks(), 2)
+    assert len(pulled) < 1000
+
+
+def test_interleave():
+    groups = [iter([1, 2, 3]), iter([]), iter([4])]
+    assert list(interleave(groups)) == [1, 4, 2, 3]
+
+
+def test_shell_timeout_is_raised(tmp_path):
+    """Ensure a timeout in a shell test fails the evaluation after retrying."""
+    path = tmp_path / "slow.py"
+    path.write_text("x = 1\n")
+    rule = {"command": "sleep 5", "timeout": 0.2, "retries": 1}
+
+    start = time.monotonic()
+    with pytest.raises(Exception, match="after 2 attempts"):
+        run_tests.evaluate_shell_tests([path], {"slow": rule})
+    assert time.monotonic() - start < 3
+
+
+def test_invalid_shell_options(tmp_path):
+    path = tmp_path / "a.py"
+    path.write_text("x = 1\n")
+    for option in ({"max_concurrency": 0}, {"timeout": -1}, {"retries": "2"}):
+        rule = dict({"command": "cat"}, **option)
+        with pytest.raises(Exception):
+            run_tests.evaluate_shell_tests([path], {"bad": rule})
@@ -0,0 +1,62 @@
+from ratchets import abstracted_tests
+import json
+
+TOML = """
+[ratchet.regex.prints]
+regex = "print\\\\("
+
+[ratchet.regex.asserts]
+regex = "assert "
+
+[ratchet.shell.long_lines]
+command = "xargs -n1 awk 'length($0) > 30'"
+"""
+
+
+def test_session_evaluates_once(tmp_path, monkeypatch):
+    """Ensure every check in a session shares one discovery and evaluation."""
+    (tmp_path / "tests.toml").write_text(TOML)
+    (tmp_path / "a.py").write_text("print(1)\nassert True\n")
+    (tmp_path / "b.py").write_text("x = 'a line longer than thirty characters'\n")
+    counts = {"prints": 1, "asserts": 1, "long_lines": 1}
+    (tmp_path / "ratchet_values.json").write_text(json.dumps(counts))
+    monkeypatch.chdir(tmp_path)
+    abstracted_tests.reset_session()
+
+    calls = {"discover": 0, "evaluate": 0}
+    get_python_files = abstracted_tests.get_python_files
+    evaluate_files = abstracted_tests.evaluate_files
+
+    def counting_discover(*args, **kwargs):
+        calls["discover"] += 1
+        return get_python_files(*args, **kwargs)
+
+    def counting_evaluate(*args, **kwargs):
+        calls["evaluate"] += 1
+        return evaluate_files(*args, **kwargs)
+
+    monkeypatch.setattr(abstracted_tests, "get_python_files", counting_discover)
+    monkeypatch.setattr(abstracted_tests, "evaluate_files", counting_evaluate)
+    # the checks only need counts, which are taken without building matches
+    count_matches = abstracted_tests.count_matches
+
+    def counting_count(*args, **kwargs):
+        calls["evaluate"] += 1
+        return count_matches(*args, **kwargs)
+
+    monkeypatch.setattr(abstracted_tests, "count_matches", counting_count)
+
+    try:
+        for name, rule in abstracted_tests.get_regex_tests().items():
+            abstracted_tests.check_regex_rule(name, rule)
+        for name, rule in abstracted_tests.get_shell_tests().items():
+            abstracted_tests.check_shell_rule(name, rule)
+        assert calls == {"discover": 1, "evaluate": 1}
+
+        # a rule that differs from the configured one is evaluated on its own
+        changed = {"regex": "x = "}
+        matches = abstracted_tests.get_python_test_matches("prints", changed)
+        assert [m.line for m in matches] == [1]
+        assert calls == {"discover": 1, "evaluate": 1}
+    finally:
+        abstracted_tests.reset_session()
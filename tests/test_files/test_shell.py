@@ -0,0 +1,139 @@
+from ratchets import run_tests
+import pytest
+
+PER_FILE = {"command": "xargs -n1 awk 'length($0) > 20'"}
+BATCHED = {
+    "command": "xargs awk 'length($0) > 20 { print FILENAME \":\" $0 }'",
+    "batch": True,
+    "batch_size": 2,
+}
+
+
+def make_files(tmp_path):
+    files = []
+    for idx in range(5):
+        # a delimiter in the directory name must not confuse the parser
+        path = tmp_path / f"dir:{idx}" / "m.py"
+        path.parent.mkdir()
+        body = "    indented line longer than twenty\n" * idx + "x = 1\n"
+        path.write_text(body)
+        files.append(path)
+    return files
+
+
+def summarize(result):
+    return sorted((m.file, m.line, m.content) for m in result.matches)
+
+
+def test_batch_matches_per_file(tmp_path):
+    """Ensure batched shell tests find the same lines as per-file runs."""
+    files = make_files(tmp_path)
+    per_file = run_tests.evaluate_shell_tests(files, {"long": PER_FILE})["long"]
+    batched = run_tests.evaluate_shell_tests(files, {"long": BATCHED})["long"]
+
+    assert summarize(batched) == summarize(per_file)
+    # leading whitespace of the first output line is kept for the lookup
+    assert len(per_file.matches) == 0 + 1 + 2 + 3 + 4
+
+
+def test_split_batch_line():
+    paths = {"a:b.py", "c.py"}
+    assert run_tests.split_batch_line("a:b.py:x: 1", paths, ":") == ("a:b.py", "x: 1")
+    assert run_tests.split_batch_line("c.py::", paths, ":") == ("c.py", ":")
+    assert run_tests.split_batch_line("d.py:x", paths, ":") == (None, "d.py:x")
+
+
+def test_batch_size_must_be_positive(tmp_path):
+    files = make_files(tmp_path)
+    chunks = run_tests.batch_chunks("long", BATCHED, files)
+    assert [len(chunk) for chunk in chunks] == [2, 2, 1]
+    with pytest.raises(Exception):
+        run_tests.batch_chunks("long", dict(BATCHED, batch_size=0), files)
+
+
+def test_argv_chunks_fit_arg_max():
+    """Ensure '{files}' chunks are split so their paths fit in one argv."""
+    files = [f"/tmp/{'x' * 95}{idx:04d}.py" for idx in range(4000)]
+    rule = {"argv": ["awk", "1", "{files}"], "batch": True, "batch_size": 4000}
+    chunks = run_tests.batch_chunks("long", rule, files)
+    assert len(chunks) > 1
+    assert [p for chunk in chunks for p in chunk] == files
+    for chunk in chunks:
+        assert sum(len(p) + 1 for p in chunk) <= run_tests.MAX_ARGV_BYTES
+    # paths written to stdin are not limited
+    stdin_rule = dict(rule, argv=["xargs", "awk", "1"])
+    assert len(run_tests.batch_chunks("long", stdin_rule, files)) == 1
+
+
+def test_location_format(tmp_path, monkeypatch):
+    """Ensure location output becomes matches without building a line map."""
+    files = make_files(tmp_path)
+    per_file = {"command": "xargs grep -Hn indented", "format": "location"}
+    batched = dict(per_file, batch=True)
+    content = run_tests.evaluate_shell_tests(files, {"long": BATCHED})
+
+    def no_line_map(files):
+        raise AssertionError("line map built for a location test")
+
+    monkeypatch.setattr(run_tests, "build_file_lines_map", no_line_map)
+    for rule in (per_file, batched):
+        result = run_tests.evaluate_shell_tests(files, {"grep": rule})["grep"]
+        assert sorted((m.file, m.line) for m in result.matches) == sorted(
+            (m.file, m.line) for m in content["long"].matches
+        )
+        assert all(m.content.startswith("indented") for m in result.matches)
+
+
+def test_parse_location_line(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    path = str(tmp_path / "a:b.py")
+    paths = {path: path}
+    parse = run_tests.parse_location_line
+    assert parse("a:b.py:3:7: E501 line too long", paths) == (
+        path,
+        (3, 7, "E501 line too long"),
+    )
+    assert parse(f"{path}:12", paths) == (path, (12, None, ""))
+    assert parse("./a:b.py:4: error: x", paths) == (path, (4, None, "error: x"))
+    assert parse("other.py:1: x", paths) == (None, None)
+
+
+def test_argv_runs_without_a_shell(tmp_path, monkeypatch):
+    """Ensure argv tests handle paths with spaces and shell metacharacters."""
+    # a shell would run the substitution in the working directory
+    monkeypatch.chdir(tmp_path)
+    files = []
+    for name in ("with space.py", "$(touch pwned).py", "semi;colon.py"):
+        path = tmp_path / name
+        path.write_text("    indented line longer than twenty\nx = 1\n")
+        files.append(path)
+
+    rules = {
+        "file": {"argv": ["awk", "length($0) > 20", "{file}"]},
+        "stdin": {"argv": ["xargs", "-d", "\n", "-n1", "awk", "length($0) > 20"]},
+        "files": {
+            "argv": ["awk", 'length($0) > 20 { print FILENAME ":" $0 }', "{files}"],
+            "batch": True,
+        },
+    }
+    results = run_tests.evaluate_shell_tests(files, rules)
+    for name in rules:
+        assert sorted(m.file for m in results[name].matches) == sorted(
+            str(p) for p in files
+        )
+    assert not (tmp_path / "pwned").exists()
+
+
+def test_invalid_argv(tmp_path):
+    files = make_files(tmp_path)
+    invalid = (
+        {"argv": []},
+        {"argv": "awk"},
+        {"argv": ["cat"], "command": "cat"},
+        {"argv": ["cat", "{files}"]},
+        {"argv": ["cat", "{file}"], "batch": True},
+        {"argv": ["ratchets-missing-command", "{file}"]},
+    )
+    for rule in invalid:
+        with pytest.raises(Exception):
+            run_tests.evaluate_shell_tests(files, {"bad": rule})
@@ -0,0 +1,100 @@
+from ratchets import run_tests
+from ratchets import abstracted_tests
+import json
+import os
+import subprocess
+
+TOML = """
+[ratchet.regex.prints]
+regex = "print\\\\("
+
+[ratchet.shell.long_lines]
+command = "xargs -n1 awk 'length($0) > 30'"
+"""
+
+
+def git(repo, *args):
+    env = dict(
+        os.environ,
+        GIT_AUTHOR_NAME="Ratchets",
+        GIT_AUTHOR_EMAIL="ratchets@example.com",
+        GIT_COMMITTER_NAME="Ratchets",
+        GIT_COMMITTER_EMAIL="ratchets@example.com",
+    )
+    subprocess.run(
+        ["git"] + list(args), cwd=repo, env=env, check=True, capture_output=True
+    )
+
+
+def make_repo(tmp_path):
+    repo = tmp_path / "repo"
+    repo.mkdir()
+    git(repo, "init", "-q")
+    (repo / "tests.toml").write_text(TOML)
+    (repo / "a.py").write_text("print(1)\nprint(2)\n")
+    (repo / "b.py").write_text("print(3)\nx = 'longer than thirty characters......'\n")
+    (repo / "moved.py").write_text("print(4)\n")
+    git(repo, "add", ".")
+    git(repo, "commit", "-q", "-m", "base")
+    git(repo, "branch", "base")
+    return repo
+
+
+def test_since_matches_full_run(tmp_path, monkeypatch):
+    """Ensure counts projected from changed files equal a full evaluation."""
+    repo = make_repo(tmp_path)
+    monkeypatch.chdir(repo)
+    toml_path = str(repo / "tests.toml")
+
+    full_before = run_tests.results_to_json(
+        run_tests.evaluate_tests(toml_path, False, False, None)
+    )
+    (repo / "ratchet_values.json").write_text(json.dumps(full_before))
+
+    (repo / "a.py").write_text("print(1)\n")
+    (repo / "c.py").write_text("print(5)\nprint(6)\ny = 'another line too long....'\n")
+    git(repo, "mv", "moved.py", "renamed.py")
+    git(repo, "add", ".")
+    git(repo, "commit", "-q", "-m", "change")
+    # uncommitted changes are counted as well
+    (repo / "b.py").write_text("x = 1\n")
+
+    full_after = run_tests.results_to_json(
+        run_tests.evaluate_tests(toml_path, False, False, None)
+    )
+    projected = run_tests.count_since(toml_path, False, False, "base")
+
+    assert projected == full_after
+    assert full_after == {"prints": 4, "long_lines": 1}
+
+    changed = run_tests.evaluate_tests(toml_path, False, False, None, since="base")
+    changed_files = {
+        os.path.basename(m.file) for tr in changed[0].values() for m in tr.matches
+    }
+    assert changed_files == {"a.py", "c.py", "renamed.py"}
+
+    monkeypatch.setenv(abstracted_tests.SINCE_ENVIRONMENT_VARIABLE, "base")
+    abstracted_tests.reset_session()
+    calls = []
+    count_since = abstracted_tests.count_since
+
+    def counting_since(*args, **kwargs):
+        calls.append(args)
+        return count_since(*args, **kwargs)
+
+    monkeypatch.setattr(abstracted_tests, "count_since", counting_since)
+    rules = abstracted_tests.get_regex_tests()
+    shell_rules = abstracted_tests.get_shell_tests()
+    abstracted_tests.check_regex_rule("prints", rules["prints"])
+    abstracted_tests.check_shell_rule("long_lines", shell_rules["long_lines"])
+    # projected counts are computed once per session for every rule
+    assert len(calls) == 1
+
+    (repo / "a.py").write_text("print(1)\nprint(7)\n")
+    abstracted_tests.reset_session()
+    try:
+        abstracted_tests.check_regex_rule("prints", rules["prints"])
+    except Exception as e:
+        assert "increased from 4 to 5" in str(e)
+    else:
+        assert False, "Expected the projected increase to fail the check."
@@ -34,5 +34,36 @@ def test_validate_regex():
                 ), f"Expected validation to fail for {full_path}, but it passed"
 
 
+def test_nested_quantifiers():
+    """Ensure repeated repetitions are flagged, and other patterns are not."""
+    for regex in ["(a+)+$", "^(\\w+\\s?)*$", "(?:x|(y*))+z", "(a*b?)*"]:
+        assert validate.has_nested_quantifier(regex), regex
+    for regex in ["a+b+", "(ab)+", "\\s+$", "(a?)+", "#.*\\bXXX\\b", "(a{2})+"]:
+        assert not validate.has_nested_quantifier(regex), regex
+
+
+def test_benchmark_rule(tmp_path):
+    """Ensure catastrophic rules run out of time and linear ones do not."""
+    sample = tmp_path / "sample.py"
+    sample.write_text("x = 1\n" * 100)
+
+    report = validate.benchmark_rule("fast", {"regex": "print\\("}, [sample])
+    assert not report.nested_quantifier and not report.timeouts
+    assert report.sample_bytes == sample.stat().st_size
+    assert report.throughput is None or report.throughput > 0
+
+    evil = {"regex": "^(\\w+\\s?)+$", "time_budget": 0.1}
+    report = validate.benchmark_rule("evil", evil, [sample])
+    assert report.nested_quantifier
+    assert report.timeouts
+
+    try:
+        validate.lint_rules({"evil": evil}, [sample])
+    except Exception as e:
+        assert "evil" in str(e)
+    else:
+        assert False, "expected lint_rules to reject the rule"
+
+
 if __name__ == "__main__":
     test_validate_regex()